@@ -1,13 +1,6 @@
-import boto3
-import os
-import sys
 import logging
 import time
 
-import botocore.session
-
-sys.path.append(os.path.join(os.path.dirname(__file__), "resource"))
-sys.path.append(os.path.join(os.path.dirname(__file__), "lib"))
 from data_mesh_util.lib.constants import *
 import data_mesh_util.lib.utils as utils
 from data_mesh_util.lib.SubscriberTracker import SubscriberTracker
@@ -33,8 +26,6 @@ class DataMeshAdmin:
     _config = {}
     _logger = logging.getLogger("DataMeshAdmin")
     _log_level = None
-    stream_handler = logging.StreamHandler(sys.stdout)
-    _logger.addHandler(stream_handler)
     _subscriber_tracker = None
     _automator = None
 
@@ -48,6 +39,7 @@ class DataMeshAdmin:
             self._region = region_name
 
         if use_creds is None:
+            import boto3
             self._session = boto3.session.Session(region_name=self._region)
         else:
             self._session = utils.create_session(credentials=use_creds, region=self._region)
@@ -58,9 +50,9 @@ class DataMeshAdmin:
         self._dynamo_resource = self._session.client('dynamodb')
         self._lf_client = self._session.client('lakeformation')
 
-        self._current_identity = self._sts_client.get_caller_identity()
+        self._current_identity = utils.whoami(credentials=self._session.get_credentials(), region=self._region)
 
-        self._logger.setLevel(log_level)
+        utils.configure_logger(self._logger, log_level)
         self._log_level = log_level
         self._automator = ApiAutomator(target_account=data_mesh_account_id, session=self._session,
                                        log_level=self._log_level)
@@ -88,12 +80,12 @@ class DataMeshAdmin:
         Private method to create objects needed for read-only access to the data mesh catalog
         :return:
         '''
-        utils.validate_correct_account(credentials=botocore.session.get_session().get_credentials(),
+        utils.validate_correct_account(credentials=utils.create_session().get_credentials(),
                                        account_id=self._data_mesh_account_id)
 
         self._create_template_config(self._config)
 
-        current_identity = self._sts_client.get_caller_identity()
+        current_identity = utils.whoami(credentials=self._session.get_credentials(), region=self._region)
 
         ro_tuple = self._automator.configure_iam(
             policy_name='DataMeshReadOnlyPolicy',
@@ -112,12 +104,12 @@ class DataMeshAdmin:
         Private method to create objects needed for an administrative role that can be used to grant access to Data Mesh roles
         :return:
         '''
-        utils.validate_correct_account(credentials=botocore.session.get_session().get_credentials(),
+        utils.validate_correct_account(credentials=utils.create_session().get_credentials(),
                                        account_id=self._data_mesh_account_id)
 
         self._create_template_config(self._config)
 
-        current_identity = self._sts_client.get_caller_identity()
+        current_identity = utils.whoami(credentials=self._session.get_credentials(), region=self._region)
 
         mgr_tuple = self._automator.configure_iam(
             policy_name='DataMeshManagerPolicy',
@@ -213,13 +205,15 @@ class DataMeshAdmin:
         of the Data Mesh Account. Creates IAM Roles & Policies for the DataMeshManager, DataProducer, and DataConsumer
         :return:
         '''
-        self._data_mesh_account_id = self._sts_client.get_caller_identity().get('Account')
+        self._data_mesh_account_id = utils.whoami(credentials=self._session.get_credentials(),
+                                                  region=self._region).get('Account')
 
-        self._current_credentials = boto3.session.Session().get_credentials()
+        self._current_credentials = utils.create_session().get_credentials()
         self._subscription_tracker = SubscriberTracker(data_mesh_account_id=self._data_mesh_account_id,
                                                        credentials=self._current_credentials,
                                                        region_name=self._region,
                                                        log_level=self._log_level)
+        self._subscription_tracker.migrate_indexes()
 
         # create the read-only consumer role for metadata descriptions
         ro_tuple = self._create_data_mesh_ro_role()
@@ -233,6 +227,36 @@ class DataMeshAdmin:
             "SubscriptionTracker": self._subscription_tracker.get_endpoints()
         }
 
+    def migrate_legacy_subscriptions(self) -> dict:
+        '''
+        Moves subscriptions created by earlier versions, which have random ids, to the ids generated from their request,
+        so that requesting them again doesn't create a duplicate subscription. Subscription ids held by consumers and
+        producers for these subscriptions change, and are returned. This method should be invoked once by an
+        Administrator of the Data Mesh Account after upgrading
+        :return: Dictionary with Migrated, a map of original to new subscription id, and NotMigrated, a list of the
+        original ids which were left in place
+        '''
+        tracker = SubscriberTracker(data_mesh_account_id=self._data_mesh_account_id,
+                                    credentials=self._session.get_credentials(),
+                                    region_name=self._region,
+                                    log_level=self._log_level)
+
+        return tracker.migrate_legacy_subscriptions()
+
+    def migrate_subscription_indexes(self) -> list:
+        '''
+        Creates the next secondary index missing from a subscriptions table created by an earlier version. DynamoDB
+        creates one index at a time, so this method should be invoked by an Administrator of the Data Mesh Account
+        after upgrading, and again once each index has been backfilled, until it returns no indexes
+        :return: Names of the indexes which were created
+        '''
+        tracker = SubscriberTracker(data_mesh_account_id=self._data_mesh_account_id,
+                                    credentials=self._session.get_credentials(),
+                                    region_name=self._region,
+                                    log_level=self._log_level)
+
+        return tracker.migrate_indexes()
+
     def initialize_producer_account(self, crawler_role_arn: str = None):
         '''
         Sets up an AWS Account to act as a Data Provider into the central Data Mesh Account. This method should be invoked
@@ -310,7 +334,8 @@ class DataMeshAdmin:
         utils.validate_correct_account(self._session.get_credentials(), self._data_mesh_account_id,
                                        should_match=False)
 
-        source_account = self._sts_client.get_caller_identity().get('Account')
+        source_account = utils.whoami(credentials=self._session.get_credentials(),
+                                      region=self._region).get('Account')
 
         local_role_name = None
         remote_role_name = None
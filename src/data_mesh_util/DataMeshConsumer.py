@@ -1,37 +1,24 @@
-import datetime
-import time
-import boto3
-import os
-import sys
-import json
-
-import botocore.session
-import shortuuid
 import logging
+import threading
 
-sys.path.append(os.path.join(os.path.dirname(__file__), "resource"))
-sys.path.append(os.path.join(os.path.dirname(__file__), "lib"))
-
+from data_mesh_util.lib.constants import *
+import data_mesh_util.lib.utils as utils
 from data_mesh_util.lib.ApiAutomator import ApiAutomator
-from data_mesh_util.lib.SubscriberTracker import *
+from data_mesh_util.lib.SubscriberTracker import SubscriberTracker, STATUS_ACTIVE, OWNER_PRINCIPAL, \
+    SUBSCRIBER_PRINCIPAL, DATABASE_NAME, RAM_SHARES
 
 
 class DataMeshConsumer:
-    _current_account = None
     _data_mesh_account_id = None
     _data_consumer_role_arn = None
-    _data_consumer_account_id = None
     _data_mesh_manager_role_arn = None
-    _session = None
-    _sts_client = None
     _config = {}
     _current_region = None
     _log_level = None
     _logger = logging.getLogger("DataMeshConsumer")
-    _logger.addHandler(logging.StreamHandler(sys.stdout))
-    _subscription_tracker = None
-    _consumer_automator = None
-    _ro_session = None
+    _use_credentials = None
+    _lazy_values = None
+    _lazy_lock = None
 
     def __init__(self, data_mesh_account_id: str, region_name: str, log_level: str = "INFO", use_credentials=None):
         if region_name is None:
@@ -40,49 +27,93 @@ class DataMeshConsumer:
             self._current_region = region_name
 
         self._data_mesh_account_id = data_mesh_account_id
+        self._use_credentials = use_credentials
 
-        # Assume the consumer account DataMeshConsumer role, unless we have been supplied temporary credentials for that role
-        self._session, _consumer_credentials = utils.assume_iam_role(role_name=DATA_MESH_CONSUMER_ROLENAME,
-                                                                     region_name=self._current_region,
-                                                                     use_credentials=use_credentials)
+        self._log_level = log_level
+        utils.configure_logger(self._logger, log_level)
 
-        self._sts_client = self._session.client('sts')
+        # sessions, the automator and the subscription tracker are created on first use, so that constructing a
+        # consumer makes no AWS API calls
+        self._lazy_values = {}
+        self._lazy_lock = threading.RLock()
 
-        self._log_level = log_level
-        self._logger.setLevel(log_level)
+    def _lazy(self, name: str, create):
+        value = self._lazy_values.get(name)
+        if value is None:
+            with self._lazy_lock:
+                value = self._lazy_values.get(name)
+                if value is None:
+                    value = create()
+                    self._lazy_values[name] = value
 
-        self._current_account = self._sts_client.get_caller_identity()
-        self._data_consumer_account_id = self._current_account.get('Account')
+        return value
 
-        self._consumer_automator = ApiAutomator(target_account=self._data_consumer_account_id,
-                                                session=self._session, log_level=self._log_level)
+    def _assume_consumer_role(self) -> tuple:
+        # Assume the consumer account DataMeshConsumer role, unless we have been supplied temporary credentials for that role
+        return utils.assume_refreshable_iam_role(role_name=DATA_MESH_CONSUMER_ROLENAME,
+                                                 region_name=self._current_region,
+                                                 use_credentials=self._use_credentials)
 
+    def _assume_mesh_role(self) -> tuple:
         # assume the DataMeshConsumer-<account-id> role in the mesh
-        _data_mesh_session, _data_mesh_credentials = utils.assume_iam_role(
+        session, credentials = utils.assume_refreshable_iam_role(
             role_name=utils.get_central_role_name(self._data_consumer_account_id, CONSUMER),
             region_name=self._current_region,
-            use_credentials=_consumer_credentials,
+            use_credentials=self._lazy('consumer_role', self._assume_consumer_role)[1],
             target_account=self._data_mesh_account_id
         )
         self._logger.debug("Created new STS Session for Data Mesh Admin Consumer")
 
-        utils.validate_correct_account(_data_mesh_credentials, data_mesh_account_id)
+        utils.validate_correct_account(credentials, self._data_mesh_account_id)
 
-        # create the subscription tracker
-        self._subscription_tracker = SubscriberTracker(credentials=_data_mesh_credentials,
-                                                       data_mesh_account_id=data_mesh_account_id,
-                                                       region_name=self._current_region,
-                                                       log_level=self._log_level)
+        return session, credentials
 
-        # finally, generate a read-only set of credentials in the mesh
-        self._ro_session = utils.assume_iam_role(
+    def _assume_read_only_role(self) -> tuple:
+        # generate a read-only set of credentials in the mesh
+        ro_session = utils.assume_refreshable_iam_role(
             role_name=DATA_MESH_READONLY_ROLENAME,
             region_name=self._current_region,
-            use_credentials=_data_mesh_credentials,
+            use_credentials=self._lazy('mesh_role', self._assume_mesh_role)[1],
             target_account=self._data_mesh_account_id
         )
         self._logger.debug("Created new STS Session for Data Mesh Read Only")
 
+        return ro_session
+
+    @property
+    def _session(self):
+        return self._lazy('consumer_role', self._assume_consumer_role)[0]
+
+    @property
+    def _sts_client(self):
+        return self._consumer_automator._get_client('sts')
+
+    @property
+    def _current_account(self) -> dict:
+        return utils.whoami(credentials=self._lazy('consumer_role', self._assume_consumer_role)[1],
+                            region=self._current_region)
+
+    @property
+    def _data_consumer_account_id(self) -> str:
+        return self._current_account.get('Account')
+
+    @property
+    def _consumer_automator(self) -> ApiAutomator:
+        return self._lazy('consumer_automator', lambda: ApiAutomator(
+            target_account=self._data_consumer_account_id, session=self._session, log_level=self._log_level))
+
+    @property
+    def _subscription_tracker(self) -> SubscriberTracker:
+        # create the subscription tracker
+        return self._lazy('subscription_tracker', lambda: SubscriberTracker(
+            credentials=self._lazy('mesh_role', self._assume_mesh_role)[1],
+            data_mesh_account_id=self._data_mesh_account_id, region_name=self._current_region,
+            log_level=self._log_level))
+
+    @property
+    def _ro_session(self):
+        return self._lazy('read_only_role', self._assume_read_only_role)
+
     def request_access_to_product(self, owner_account_id: str, database_name: str,
                                   request_permissions: list, tables: list = None) -> dict:
         '''
@@ -104,6 +135,34 @@ class DataMeshConsumer:
             suppress_object_validation=True
         )
 
+    def request_access_to_products(self, access_requests: list, suppress_object_validation: bool = False) -> list:
+        '''
+        Requests access to many data products at once, validating the requested objects with one call per database and
+        writing the subscriptions in conditional transactions of up to 25 subscriptions
+        :param access_requests: List of dicts with the arguments of request_access_to_product(): owner_account_id,
+        database_name, request_permissions, and optionally tables
+        :param suppress_object_validation:
+        :return: List with the response of request_access_to_product() for each request in order, with Created set to
+        False if it had already been requested, or a dict with the Request and an Error for requests which could not be
+        made
+        '''
+        results = self._subscription_tracker.create_subscription_requests(
+            principal=self._current_account.get('Account'),
+            requests=[{
+                'owner_account_id': r.get('owner_account_id'),
+                'database_name': r.get('database_name'),
+                'tables': r.get('tables'),
+                'request_grants': r.get('request_permissions')
+            } for r in access_requests],
+            suppress_object_validation=suppress_object_validation
+        )
+
+        for request, result in zip(access_requests, results):
+            if 'Error' in result:
+                result['Request'] = request
+
+        return results
+
     def finalize_subscription(self, subscription_id: str) -> None:
         '''
         Finalizes the process of requesting access to a data product. This imports the granted subscription into the consumer's account
@@ -128,6 +187,17 @@ class DataMeshConsumer:
     def get_subscription(self, request_id: str) -> dict:
         return self._subscription_tracker.get_subscription(subscription_id=request_id)
 
+    def get_subscriptions(self, request_ids: list, projection: list = None, consistent_read: bool = True) -> list:
+        '''
+        Get many subscriptions in batches, rather than a call per subscription
+        :param request_ids:
+        :param projection: Attributes to return, or None for all attributes
+        :param consistent_read: Set to False for eventually consistent reads
+        :return: List of the subscriptions in the order of request_ids, with None for those which don't exist
+        '''
+        return self._subscription_tracker.get_subscriptions(subscription_ids=request_ids, projection=projection,
+                                                            consistent_read=consistent_read)
+
     def get_table_info(self, database_name: str, table_name: str):
         return self._consumer_automator.describe_table(database_name, table_name)
 
@@ -136,8 +206,9 @@ class DataMeshConsumer:
         Lists active and pending product access grants.
         :return:
         '''
-        me = self._sts_client.get_caller_identity().get('Account')
-        return self._subscription_tracker.list_subscriptions(principal_id=me, request_status=STATUS_ACTIVE)
+        me = self._data_consumer_account_id
+        return {'Subscriptions': list(
+            self._subscription_tracker.iter_subscriptions(principal_id=me, request_status=STATUS_ACTIVE))}
 
     def delete_subscription(self, subscription_id: str, reason: str):
         '''
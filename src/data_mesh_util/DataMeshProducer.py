@@ -1,37 +1,28 @@
+import logging
+import threading
 import time
-import boto3
-import os
-import sys
+from concurrent.futures import ThreadPoolExecutor
 
+from data_mesh_util.lib.constants import *
+import data_mesh_util.lib.utils as utils
 from data_mesh_util.lib.ApiAutomator import ApiAutomator
-
-sys.path.append(os.path.join(os.path.dirname(__file__), "resource"))
-sys.path.append(os.path.join(os.path.dirname(__file__), "lib"))
-
-from data_mesh_util.lib.SubscriberTracker import *
+from data_mesh_util.lib.SubscriberTracker import SubscriberTracker, STATUS_ACTIVE, STATUS_DENIED, STATUS_PENDING, \
+    SUBSCRIPTION_ID, SUBSCRIBER_PRINCIPAL, DATABASE_NAME, TABLE_NAME, REQUESTED_GRANTS, PERMITTED_GRANTS, TABLE_ARNS
 
 
 class DataMeshProducer:
     _data_mesh_account_id = None
-    _data_producer_account_id = None
     _data_mesh_manager_role_arn = None
-    _session = None
-    _iam_client = None
-    _sts_client = None
     _config = {}
     _current_region = None
     _log_level = None
     _logger = logging.getLogger("DataMeshProducer")
-    stream_handler = logging.StreamHandler(sys.stdout)
-    _logger.addHandler(stream_handler)
     _data_mesh_account_id = None
     _data_producer_role_arn = None
-    _data_mesh_credentials = None
     _data_mesh_boto_session = None
-    _subscription_tracker = None
-    _data_producer_identity = None
-    _producer_automator = None
-    _mesh_automator = None
+    _use_credentials = None
+    _lazy_values = None
+    _lazy_lock = None
 
     def __init__(self, data_mesh_account_id: str, region_name: str, log_level: str = "INFO", use_credentials=None):
         self._data_mesh_account_id = data_mesh_account_id
@@ -41,45 +32,93 @@ class DataMeshProducer:
         else:
             self._current_region = region_name
 
-        # Assume the producer account DataMeshProducer role, unless we have been supplied temporary credentials for that role
-        self._session, _producer_credentials = utils.assume_iam_role(role_name=DATA_MESH_PRODUCER_ROLENAME,
-                                                                     region_name=self._current_region,
-                                                                     use_credentials=use_credentials)
+        self._use_credentials = use_credentials
+        self._log_level = log_level
+        utils.configure_logger(self._logger, log_level)
 
-        self._iam_client = self._session.client('iam')
-        self._sts_client = self._session.client('sts')
+        # sessions, automators and the subscription tracker are created on first use, so that constructing a
+        # producer makes no AWS API calls, and each method only pays for the sessions that it uses
+        self._lazy_values = {}
+        self._lazy_lock = threading.RLock()
 
-        self._log_level = log_level
-        self._logger.setLevel(log_level)
+    def _lazy(self, name: str, create):
+        value = self._lazy_values.get(name)
+        if value is None:
+            with self._lazy_lock:
+                value = self._lazy_values.get(name)
+                if value is None:
+                    value = create()
+                    self._lazy_values[name] = value
 
-        self._data_producer_identity = self._sts_client.get_caller_identity()
-        self._data_producer_account_id = self._data_producer_identity.get('Account')
+        return value
 
-        self._producer_automator = ApiAutomator(target_account=self._data_producer_account_id,
-                                                session=self._session, log_level=self._log_level)
+    def _assume_producer_role(self) -> tuple:
+        # Assume the producer account DataMeshProducer role, unless we have been supplied temporary credentials for that role
+        return utils.assume_refreshable_iam_role(role_name=DATA_MESH_PRODUCER_ROLENAME,
+                                                 region_name=self._current_region,
+                                                 use_credentials=self._use_credentials)
 
+    def _assume_mesh_role(self) -> tuple:
         # now assume the DataMeshProducer-<account-id> Role in the Mesh Account
-        self._data_mesh_session, self._data_mesh_credentials = utils.assume_iam_role(
+        session, credentials = utils.assume_refreshable_iam_role(
             role_name=utils.get_central_role_name(self._data_producer_account_id, PRODUCER),
             region_name=self._current_region,
-            use_credentials=_producer_credentials,
+            use_credentials=self._lazy('producer_role', self._assume_producer_role)[1],
             target_account=self._data_mesh_account_id
         )
 
         # validate that we are running in the data mesh account
-        utils.validate_correct_account(self._data_mesh_credentials, self._data_mesh_account_id)
-
-        # generate an API Automator in the mesh
-        self._mesh_automator = ApiAutomator(target_account=self._data_mesh_account_id,
-                                            session=self._data_mesh_session, log_level=self._log_level)
+        utils.validate_correct_account(credentials, self._data_mesh_account_id)
 
         self._logger.debug("Created new STS Session for Data Mesh Admin Producer")
-        self._logger.debug(self._data_mesh_credentials)
 
-        self._subscription_tracker = SubscriberTracker(credentials=self._data_mesh_credentials,
-                                                       data_mesh_account_id=data_mesh_account_id,
-                                                       region_name=self._current_region,
-                                                       log_level=log_level)
+        return session, credentials
+
+    @property
+    def _session(self):
+        return self._lazy('producer_role', self._assume_producer_role)[0]
+
+    @property
+    def _iam_client(self):
+        return self._producer_automator._get_client('iam')
+
+    @property
+    def _sts_client(self):
+        return self._producer_automator._get_client('sts')
+
+    @property
+    def _data_producer_identity(self) -> dict:
+        return utils.whoami(credentials=self._lazy('producer_role', self._assume_producer_role)[1],
+                            region=self._current_region)
+
+    @property
+    def _data_producer_account_id(self) -> str:
+        return self._data_producer_identity.get('Account')
+
+    @property
+    def _producer_automator(self) -> ApiAutomator:
+        return self._lazy('producer_automator', lambda: ApiAutomator(
+            target_account=self._data_producer_account_id, session=self._session, log_level=self._log_level))
+
+    @property
+    def _data_mesh_session(self):
+        return self._lazy('mesh_role', self._assume_mesh_role)[0]
+
+    @property
+    def _data_mesh_credentials(self):
+        return self._lazy('mesh_role', self._assume_mesh_role)[1]
+
+    @property
+    def _mesh_automator(self) -> ApiAutomator:
+        # generate an API Automator in the mesh
+        return self._lazy('mesh_automator', lambda: ApiAutomator(
+            target_account=self._data_mesh_account_id, session=self._data_mesh_session, log_level=self._log_level))
+
+    @property
+    def _subscription_tracker(self) -> SubscriberTracker:
+        return self._lazy('subscription_tracker', lambda: SubscriberTracker(
+            credentials=self._data_mesh_credentials, data_mesh_account_id=self._data_mesh_account_id,
+            region_name=self._current_region, log_level=self._log_level))
 
     def _create_mesh_table(self, table_def: dict, data_mesh_glue_client, source_database_name: str,
                            data_mesh_database_name: str,
@@ -122,22 +161,15 @@ class DataMeshProducer:
         except data_mesh_glue_client.exceptions.from_code('AlreadyExistsException'):
             self._logger.info(f"Glue Table {table_name} Already Exists")
 
-        table_partitions = self._producer_automator.get_table_partitions(
-            database_name=source_database_name,
-            table_name=table_name
-        )
-
-        if table_partitions is not None and len(table_partitions) > 0:
-            self._mesh_automator.create_table_partition_metadata(
-                database_name=data_mesh_database_name,
-                table_name=table_name,
-                partition_input_list=table_partitions
-            )
+        # stream partition pages from the producer and apply only the partitions which differ in the mesh
+        self._sync_mesh_table_partitions(source_database_name=source_database_name,
+                                         data_mesh_database_name=data_mesh_database_name,
+                                         table_name=table_name)
 
         # grant access to the producer account
+        grants = self._mesh_automator.lf_grant_accumulator(data_mesh_account_id=self._data_mesh_account_id)
         perms = ['INSERT', 'SELECT', 'ALTER', 'DELETE', 'DESCRIBE']
-        created_object = self._mesh_automator.lf_grant_permissions(
-            data_mesh_account_id=self._data_mesh_account_id,
+        grants.add(
             principal=producer_account_id,
             database_name=data_mesh_database_name,
             table_name=table_name,
@@ -147,8 +179,7 @@ class DataMeshProducer:
 
         # if create public metadata is True, then grant describe to the general data mesh consumer role
         if create_public_metadata is True:
-            created_object = self._mesh_automator.lf_grant_permissions(
-                data_mesh_account_id=self._data_mesh_account_id,
+            grants.add(
                 principal=utils.get_role_arn(self._data_mesh_account_id, DATA_MESH_READONLY_ROLENAME),
                 database_name=data_mesh_database_name,
                 table_name=table_name,
@@ -156,8 +187,10 @@ class DataMeshProducer:
                 grantable_permissions=None
             )
 
+        granted = grants.flush()
+
         # in the producer account, accept the RAM share after 1 second - seems to be an async delay
-        if created_object is not None:
+        if len(granted.get(GRANTS_GRANTED)) > 0:
             time.sleep(1)
             self._producer_automator.accept_pending_lf_resource_shares(
                 sender_account=data_mesh_account_id
@@ -177,9 +210,150 @@ class DataMeshProducer:
 
             return table_name, link_table_name
 
+    def _sync_mesh_table_partitions(self, source_database_name: str, data_mesh_database_name: str,
+                                    table_name: str, delete_missing: bool = False) -> dict:
+        partition_pages = self._producer_automator.iter_table_partitions(
+            database_name=source_database_name,
+            table_name=table_name,
+            total_segments=GLUE_PARTITION_READ_SEGMENTS
+        )
+        return self._mesh_automator.sync_table_partitions(
+            database_name=data_mesh_database_name,
+            table_name=table_name,
+            source_partition_pages=partition_pages,
+            delete_missing=delete_missing
+        )
+
+    def sync_data_product_partitions(self, source_database_name: str, table_name_regex: str = None,
+                                     expose_data_mesh_db_name: str = None) -> dict:
+        '''
+        Synchronise the partitions of published data products with the source tables, copying only the partitions
+        which were added, changed, or removed since the last synchronisation. Partitions which no longer exist in the
+        source table are deleted from the data mesh table
+        :param source_database_name:
+        :param table_name_regex:
+        :param expose_data_mesh_db_name:
+        :return: Dictionary of table name to partition synchronisation counts
+        '''
+        data_mesh_database_name = self._make_database_name(source_database_name)
+        if expose_data_mesh_db_name is not None:
+            data_mesh_database_name = expose_data_mesh_db_name
+
+        all_tables = self._producer_automator.load_glue_tables(
+            catalog_id=self._data_producer_account_id,
+            source_db_name=source_database_name,
+            table_name_regex=table_name_regex,
+            load_lf_tags=False
+        )
+
+        response = {}
+        for table in all_tables:
+            response[table.get('Name')] = self._sync_mesh_table_partitions(
+                source_database_name=source_database_name,
+                data_mesh_database_name=data_mesh_database_name,
+                table_name=table.get('Name'),
+                delete_missing=True
+            )
+
+        return response
+
     def _make_database_name(self, database_name: str):
         return "%s-%s" % (database_name, self._data_producer_identity.get('Account'))
 
+    def _create_data_product_table(self, table: dict, source_database_name: str, data_mesh_database_name: str,
+                                   create_public_metadata: bool, domain: str, data_product_name: str,
+                                   sync_mesh_catalog_schedule: str, sync_mesh_crawler_role_arn: str,
+                                   expose_table_references_with_suffix: str, bucket_policies) -> dict:
+        '''
+        Publish a single table as a data product. All clients are resolved through the API Automators, which share
+        them between threads, so this method can be run concurrently from a worker pool
+        :param table:
+        :param bucket_policies: BucketPolicyManager collecting the bucket policy entries for all tables
+        :return: Result entry for the table
+        '''
+        data_mesh_lf_client = self._mesh_automator._get_client('lakeformation')
+        data_mesh_glue_client = self._mesh_automator._get_client('glue')
+
+        table_s3_path = table.get('StorageDescriptor').get('Location')
+
+        table_s3_arn = utils.convert_s3_path_to_arn(table_s3_path)
+
+        # create a data lake location for the s3 path
+        try:
+            data_mesh_lf_client.register_resource(
+                ResourceArn=table_s3_arn,
+                UseServiceLinkedRole=True
+            )
+        except data_mesh_lf_client.exceptions.AlreadyExistsException:
+            pass
+
+        # grant data lake location access
+        producer_central_role_arn = utils.get_role_arn(account_id=self._data_mesh_account_id,
+                                                       role_name=utils.get_central_role_name(
+                                                           account_id=self._data_producer_account_id,
+                                                           type=PRODUCER))
+        data_mesh_lf_client.grant_permissions(
+            Principal={
+                'DataLakePrincipalIdentifier': producer_central_role_arn
+            },
+            Resource={
+                'DataLocation': {'ResourceArn': table_s3_arn}
+            },
+            Permissions=['DATA_LOCATION_ACCESS']
+        )
+
+        # create a mesh table for the local copy
+        created_table = self._create_mesh_table(
+            table_def=table,
+            data_mesh_glue_client=data_mesh_glue_client,
+            source_database_name=source_database_name,
+            data_mesh_database_name=data_mesh_database_name,
+            producer_account_id=self._data_producer_account_id,
+            data_mesh_account_id=self._data_mesh_account_id,
+            create_public_metadata=create_public_metadata,
+            expose_table_references_with_suffix=expose_table_references_with_suffix
+        )
+
+        # propagate lakeformation tags
+        tags = {}
+        if 'Tags' in table:
+            tags.update(table.get('Tags'))
+
+        # add the domain tag
+        if domain is not None:
+            tags[DOMAIN_TAG_KEY] = {'TagValues': [domain], 'ValidValues': [domain]}
+
+        # add the data product tag
+        if data_product_name is not None:
+            tags[DATA_PRODUCT_TAG_KEY] = {'TagValues': [data_product_name], 'ValidValues': [data_product_name]}
+
+        # attach all the tags to the table at once
+        self._mesh_automator.attach_tags(database=data_mesh_database_name, table=table.get('Name'), tags=tags)
+
+        # add a bucket policy entry allowing the data mesh lakeformation service linked role to perform GetObject*
+        table_bucket = table_s3_path.split("/")[2]
+        bucket_policies.add(
+            principal_account=self._data_mesh_account_id,
+            access_path=table_bucket
+        )
+
+        crawler_name = None
+        if sync_mesh_catalog_schedule is not None:
+            crawler_name = self._producer_automator.create_crawler(
+                database_name=data_mesh_database_name,
+                table_name=table.get('Name'),
+                s3_location=table_s3_path,
+                crawler_role=sync_mesh_crawler_role_arn,
+                sync_schedule=sync_mesh_catalog_schedule
+            )
+
+        return {
+            "TableName": table.get('Name'),
+            "Status": DATA_PRODUCT_CREATED,
+            "ResourceLinkTableName": created_table[1] if created_table is not None else None,
+            "Crawler": crawler_name
+        }
+
     def create_data_products(self, source_database_name: str,
                              create_public_metadata: bool = True,
                              table_name_regex: str = None,
@@ -188,25 +362,29 @@ class DataMeshProducer:
                              sync_mesh_catalog_schedule: str = None,
                              sync_mesh_crawler_role_arn: str = None,
                              expose_data_mesh_db_name: str = None,
-                             expose_table_references_with_suffix: str = "_link"):
+                             expose_table_references_with_suffix: str = "_link",
+                             max_workers: int = None) -> list:
+        '''
+        Create data products in the mesh from the tables in the source database. By default tables are processed one
+        after another. When max_workers is greater than 1, tables are processed concurrently by a bounded pool of
+        workers. Either way, failures are isolated to the table on which they occurred and recorded in the results
+        :param max_workers: Number of tables to process concurrently. Defaults to 1
+        :return: List of per-table results, each with TableName, Status, and ResourceLinkTableName, Crawler or Error
+        '''
         # generate the target database name for the mesh
         data_mesh_database_name = self._make_database_name(source_database_name)
         if expose_data_mesh_db_name is not None:
             data_mesh_database_name = expose_data_mesh_db_name
 
-        # create clients for the current account and with the new credentials in the data mesh account
-        producer_glue_client = self._session.client('glue', region_name=self._current_region)
-        producer_lf_client = self._session.client('lakeformation', region_name=self._current_region)
-        data_mesh_glue_client = utils.generate_client(service='glue', region=self._current_region,
-                                                      credentials=self._data_mesh_credentials)
-        data_mesh_lf_client = utils.generate_client(service='lakeformation', region=self._current_region,
-                                                    credentials=self._data_mesh_credentials)
+        if max_workers is not None and max_workers < 1:
+            raise Exception("max_workers must be a positive integer")
 
         # load the specified tables to be created as data products
         all_tables = self._producer_automator.load_glue_tables(
             catalog_id=self._data_producer_account_id,
             source_db_name=source_database_name,
-            table_name_regex=table_name_regex
+            table_name_regex=table_name_regex,
+            bulk_load_lf_tags=True
         )
 
         # get or create the target database exists in the mesh account
@@ -237,86 +415,46 @@ class DataMeshProducer:
         )
         self._logger.info("Validated Producer Account Database %s" % data_mesh_database_name)
 
-        for table in all_tables:
-            table_s3_path = table.get('StorageDescriptor').get('Location')
-
-            table_s3_arn = utils.convert_s3_path_to_arn(table_s3_path)
-
-            # create a data lake location for the s3 path
+        table_args = {
+            "source_database_name": source_database_name,
+            "data_mesh_database_name": data_mesh_database_name,
+            "create_public_metadata": create_public_metadata,
+            "domain": domain,
+            "data_product_name": data_product_name,
+            "sync_mesh_catalog_schedule": sync_mesh_catalog_schedule,
+            "sync_mesh_crawler_role_arn": sync_mesh_crawler_role_arn,
+            "expose_table_references_with_suffix": expose_table_references_with_suffix,
+            "bucket_policies": self._producer_automator.bucket_policy_manager()
+        }
+
+        def _isolated(table: dict) -> dict:
             try:
-                data_mesh_lf_client.register_resource(
-                    ResourceArn=table_s3_arn,
-                    UseServiceLinkedRole=True
-                )
-            except data_mesh_lf_client.exceptions.AlreadyExistsException:
-                pass
-
-            # grant data lake location access
-            producer_central_role_arn = utils.get_role_arn(account_id=self._data_mesh_account_id,
-                                                           role_name=utils.get_central_role_name(
-                                                               account_id=self._data_producer_account_id,
-                                                               type=PRODUCER))
-            data_mesh_lf_client.grant_permissions(
-                Principal={
-                    'DataLakePrincipalIdentifier': producer_central_role_arn
-                },
-                Resource={
-                    'DataLocation': {'ResourceArn': table_s3_arn}
-                },
-                Permissions=['DATA_LOCATION_ACCESS']
-            )
+                return self._create_data_product_table(table=table, **table_args)
+            except Exception as e:
+                self._logger.error(f"Failed to create Data Product for Table {table.get('Name')}: {e}")
+                return {
+                    "TableName": table.get('Name'),
+                    "Status": DATA_PRODUCT_FAILED,
+                    "Error": str(e)
+                }
+
+        if max_workers is None or max_workers == 1:
+            results = [_isolated(table) for table in all_tables]
+        else:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                results = list(executor.map(_isolated, all_tables))
 
-            # create a mesh table for the local copy
-            created_table = self._create_mesh_table(
-                table_def=table,
-                data_mesh_glue_client=data_mesh_glue_client,
-                source_database_name=source_database_name,
-                data_mesh_database_name=data_mesh_database_name,
-                producer_account_id=self._data_producer_account_id,
-                data_mesh_account_id=self._data_mesh_account_id,
-                create_public_metadata=create_public_metadata,
-                expose_table_references_with_suffix=expose_table_references_with_suffix
-            )
+        # tables commonly share buckets, so write each bucket policy once for all tables
+        table_args.get("bucket_policies").apply()
 
-            # propagate lakeformation tags and attach to table
-            if 'Tags' in table:
-                for tag in table.get('Tags').items():
-                    self._mesh_automator.attach_tag(database=data_mesh_database_name, table=table.get('Name'), tag=tag)
-
-            # add the domain tag
-            if domain is not None:
-                self._mesh_automator.attach_tag(
-                    database=data_mesh_database_name,
-                    table=table.get('Name'),
-                    tag=(DOMAIN_TAG_KEY, {'TagValues': [domain], 'ValidValues': [domain]})
-                )
-
-            # add the data product tag
-            if data_product_name is not None:
-                self._mesh_automator.attach_tag(
-                    database=data_mesh_database_name,
-                    table=table.get('Name'),
-                    tag=(DATA_PRODUCT_TAG_KEY, {'TagValues': [data_product_name], 'ValidValues': [data_product_name]})
-                )
-
-            # add a bucket policy entry allowing the data mesh lakeformation service linked role to perform GetObject*
-            table_bucket = table_s3_path.split("/")[2]
-            self._producer_automator.add_bucket_policy_entry(
-                principal_account=self._data_mesh_account_id,
-                access_path=table_bucket
-            )
+        failed = [r for r in results if r.get('Status') == DATA_PRODUCT_FAILED]
+        self._logger.info(
+            f"Processed {len(results)} Tables into {data_mesh_database_name} with {len(failed)} failures")
 
-            if sync_mesh_catalog_schedule is not None:
-                glue_crawler = self._producer_automator.create_crawler(
-                    database_name=data_mesh_database_name,
-                    table_name=created_table,
-                    s3_location=table_s3_path,
-                    crawler_role=sync_mesh_crawler_role_arn,
-                    sync_schedule=sync_mesh_catalog_schedule
-                )
+        return results
 
     def get_data_product(self, database_name: str, table_name_regex: str):
-        # generate a new glue client for the data mesh account
+        # get the shared glue client for the data mesh account
         data_mesh_glue_client = utils.generate_client('glue', region=self._current_region,
                                                       credentials=self._data_mesh_credentials)
         # grab the tables that match the regex
@@ -339,23 +477,22 @@ class DataMeshProducer:
         with close_access_request()
         :return:
         '''
-        me = self._sts_client.get_caller_identity().get('Account')
-        return self._subscription_tracker.list_subscriptions(owner_id=me, request_status=STATUS_PENDING)
+        me = self._data_producer_account_id
+        return {'Subscriptions': list(
+            self._subscription_tracker.iter_subscriptions(owner_id=me, request_status=STATUS_PENDING))}
 
-    def approve_access_request(self, request_id: str,
-                               grant_permissions: list = None,
-                               grantable_permissions: list = None,
-                               decision_notes: str = None):
+    def _plan_access_request(self, subscription: dict, grant_permissions: list = None,
+                             grantable_permissions: list = None, refresh_catalog: bool = False) -> dict:
         '''
-        API to close an access request as approved. Approvals must be accompanied by the
-        permissions to grant to the specified principal.
-        :param request_id:
+        Resolve the tables of a subscription and compute the deduplicated set of bucket policy entries and LakeFormation
+        grants required to approve it, along with the number of API calls the approval will make
+        :param subscription:
         :param grant_permissions:
-        :param decision_notes:
+        :param grantable_permissions:
         :return:
         '''
-        # load the subscription
-        subscription = self._subscription_tracker.get_subscription(subscription_id=request_id)
+        principal = subscription.get(SUBSCRIBER_PRINCIPAL)
+        database_name = subscription.get(DATABASE_NAME)
 
         # approver can override the requested grants
         if grant_permissions is None:
@@ -363,83 +500,225 @@ class DataMeshProducer:
         else:
             set_permissions = grant_permissions
 
-        # grant the approved permissions in lake formation
-        data_mesh_lf_client = utils.generate_client(service='lakeformation', region=self._current_region,
-                                                    credentials=self._data_mesh_credentials)
-        tables = subscription.get(TABLE_NAME)
-        ram_shares = {}
+        # resolve the original database name
+        original_db = database_name.replace(f"-{self._data_producer_account_id}", "")
 
-        table_arns = []
-        for t in tables:
-            # resolve the original database name
-            original_db = subscription.get(DATABASE_NAME).replace(f"-{self._data_producer_account_id}", "")
-
-            # get the catalog definition of this table including if its a regex subscription
-            all_tables = self._producer_automator.load_glue_tables(
+        # get the catalog definition of the tables including if they are regex subscriptions. The database listing is
+        # cached by the automator, so further approvals on this database in this session don't list it again
+        resolved_tables = {}
+        for resolved_table in self._producer_automator.resolve_glue_tables(
                 catalog_id=self._data_producer_account_id,
                 source_db_name=original_db,
-                table_name_regex=t,
-                load_lf_tags=False
+                table_name_patterns=subscription.get(TABLE_NAME),
+                refresh=refresh_catalog
+        ):
+            # get the data location for the table
+            resolved_tables[resolved_table.get('Name')] = resolved_table.get('StorageDescriptor').get('Location')
+
+        # the consumer needs bucket access once per bucket, database describe once, and one grant per table
+        buckets = sorted({table_s3_path.split("/")[2] for table_s3_path in resolved_tables.values()})
+        table_grants = []
+        for table_name in resolved_tables.keys():
+            table_grants.append({
+                "Principal": principal,
+                "DatabaseName": database_name,
+                "TableName": table_name,
+                "Permissions": list(set_permissions),
+                "GrantablePermissions": grantable_permissions
+            })
+
+        plan = {
+            SUBSCRIPTION_ID: subscription.get(SUBSCRIPTION_ID),
+            "Principal": principal,
+            "DatabaseName": database_name,
+            "Tables": [{"TableName": k, "Location": v} for k, v in resolved_tables.items()],
+            "BucketPolicyEntries": [{"Principal": principal, "Bucket": b} for b in buckets],
+            "DatabaseGrants": [{
+                "Principal": principal,
+                "DatabaseName": database_name,
+                "Permissions": ['DESCRIBE'],
+                "GrantablePermissions": None
+            }],
+            "TableGrants": table_grants,
+            "ResourcePolicyTables": subscription.get(TABLE_ARNS),
+            "PermittedGrants": grant_permissions
+        }
+        plan["ApiCalls"] = self._count_plan_api_calls(plan)
+
+        return plan
+
+    @staticmethod
+    def _count_plan_api_calls(plan: dict) -> dict:
+        '''
+        Count the API calls made by _execute_access_request_plan for a plan, when none of them have to be retried. Bucket
+        policies and the resource policy are only written if they don't already contain the grant, so their Put counts
+        are the most that will be made
+        :param plan:
+        :return: Dictionary of API name to the number of calls
+        '''
+        grant_count = len(plan.get("DatabaseGrants")) + len(plan.get("TableGrants"))
+        table_count = len(plan.get("TableGrants"))
+        bucket_count = len(plan.get("BucketPolicyEntries"))
+
+        return {
+            "GetBucketPolicy": bucket_count,
+            "PutBucketPolicy": bucket_count,
+            "BatchGrantPermissions": -(-grant_count // LF_GRANT_BATCH_SIZE),
+            # the RAM share of each table, and of the database along with the first table
+            "ListPermissions": table_count + 1 if table_count > 0 else 0,
+            # the resource policy for all of the plan's tables is read and written once
+            "GetResourcePolicy": 1,
+            "PutResourcePolicy": 1
+        }
+
+    def _execute_access_request_plan(self, plan: dict, decision_notes: str = None,
+                                     update_resource_policy: bool = True):
+        '''
+        Apply an approval plan, and mark the subscription as Active
+        :param plan:
+        :param decision_notes:
+        :param update_resource_policy: Add the consumer to the Glue Catalog resource policy. Set to False when the caller
+        has already written the resource policy for this plan
+        :return:
+        '''
+        principal = plan.get("Principal")
+        database_name = plan.get("DatabaseName")
+
+        # add a bucket policy entry allowing the consumer lakeformation service linked role to perform GetObject*
+        bucket_policies = self._producer_automator.bucket_policy_manager()
+        for entry in plan.get("BucketPolicyEntries"):
+            bucket_policies.add(
+                principal_account=entry.get("Principal"),
+                access_path=entry.get("Bucket")
             )
+        bucket_policies.apply()
+
+        # apply all the grants for the subscription in batches
+        grants = self._mesh_automator.lf_grant_accumulator(data_mesh_account_id=self._data_mesh_account_id)
+        for g in plan.get("DatabaseGrants") + plan.get("TableGrants"):
+            grants.add(
+                principal=g.get("Principal"),
+                database_name=g.get("DatabaseName"),
+                table_name=g.get("TableName"),
+                permissions=g.get("Permissions"),
+                grantable_permissions=g.get("GrantablePermissions")
+            )
+        grants.flush()
 
-            for resolved_table in all_tables:
-                table_name = resolved_table.get('Name')
-                # get the data location for the table
-                table_s3_path = resolved_table.get('StorageDescriptor').get('Location')
-
-                # add a bucket policy entry allowing the consumer lakeformation service linked role to perform GetObject*
-                table_bucket = table_s3_path.split("/")[2]
-                self._producer_automator.add_bucket_policy_entry(
-                    principal_account=subscription.get(SUBSCRIBER_PRINCIPAL),
-                    access_path=table_bucket
-                )
-
-                # grant describe on the database
-                self._mesh_automator.lf_grant_permissions(
-                    data_mesh_account_id=self._data_mesh_account_id,
-                    principal=subscription.get(SUBSCRIBER_PRINCIPAL),
-                    database_name=subscription.get(DATABASE_NAME),
-                    permissions=['DESCRIBE'],
-                    grantable_permissions=None
-                )
-
-                # grant validated permissions to object
-                self._mesh_automator.lf_grant_permissions(
-                    data_mesh_account_id=self._data_mesh_account_id,
-                    principal=subscription.get(SUBSCRIBER_PRINCIPAL),
-                    database_name=subscription.get(DATABASE_NAME),
-                    table_name=table_name,
-                    permissions=set_permissions,
-                    grantable_permissions=grantable_permissions
-                )
-
-                rs = utils.load_ram_shares(lf_client=data_mesh_lf_client,
-                                           data_mesh_account_id=self._data_mesh_account_id,
-                                           database_name=subscription.get(DATABASE_NAME), table_name=t,
-                                           target_principal=subscription.get(SUBSCRIBER_PRINCIPAL))
-                ram_shares.update(rs)
-
-                # add the shared table arn to the list of ARNs
-                table_arns.append(utils.get_table_arn(region_name=self._current_region,
-                                                      catalog_id=self._data_mesh_account_id,
-                                                      database_name=subscription.get(DATABASE_NAME),
-                                                      table_name=table_name))
-
-                self._logger.info("Subscription RAM Shares")
-                self._logger.info(ram_shares)
-
-            # apply a glue catalog resource policy allowing the consumer to access objects by tag
+        data_mesh_lf_client = self._mesh_automator._get_client('lakeformation')
+        ram_shares = {}
+        table_arns = []
+        for i, g in enumerate(plan.get("TableGrants")):
+            # the database share is the same for every table, so only load it once
+            rs = utils.load_ram_shares(lf_client=data_mesh_lf_client,
+                                       data_mesh_account_id=self._data_mesh_account_id,
+                                       database_name=database_name, table_name=g.get("TableName"),
+                                       target_principal=principal, load_database_share=(i == 0))
+            ram_shares.update(rs)
+
+            # add the shared table arn to the list of ARNs
+            table_arns.append(utils.get_table_arn(region_name=self._current_region,
+                                                  catalog_id=self._data_mesh_account_id,
+                                                  database_name=database_name,
+                                                  table_name=g.get("TableName")))
+
+        self._logger.info("Subscription RAM Shares")
+        self._logger.info(ram_shares)
+
+        status_update = {
+            "subscription_id": plan.get(SUBSCRIPTION_ID),
+            "status": STATUS_ACTIVE,
+            "permitted_grants": plan.get("PermittedGrants"),
+            "notes": decision_notes,
+            "ram_shares": ram_shares,
+            "table_arns": table_arns
+        }
+
+        # apply a glue catalog resource policy allowing the consumer to access objects by tag
+        if update_resource_policy is True:
             self.add_principal_to_glue_resource_policy(
-                database_name=subscription.get(DATABASE_NAME),
-                tables=subscription.get(TABLE_ARNS),
-                add_principal=subscription.get(SUBSCRIBER_PRINCIPAL)
+                database_name=database_name,
+                tables=plan.get("ResourcePolicyTables"),
+                add_principal=principal
             )
 
         # update the subscription to reflect the changes
-        self._subscription_tracker.update_status(
-            subscription_id=request_id, status=STATUS_ACTIVE,
-            permitted_grants=grant_permissions, notes=decision_notes, ram_shares=ram_shares, table_arns=table_arns
+        self._subscription_tracker.update_status(**status_update)
+
+    def approve_access_request(self, request_id: str,
+                               grant_permissions: list = None,
+                               grantable_permissions: list = None,
+                               decision_notes: str = None,
+                               dry_run: bool = False,
+                               refresh_catalog: bool = False):
+        '''
+        API to close an access request as approved. Approvals must be accompanied by the
+        permissions to grant to the specified principal.
+        :param request_id:
+        :param grant_permissions:
+        :param decision_notes:
+        :param dry_run: Return the approval plan, including the API calls it would make, without applying it
+        :param refresh_catalog: Re-list the source database rather than using the listing cached in this session
+        :return:
+        '''
+        # load the subscription
+        subscription = self._subscription_tracker.get_subscription(subscription_id=request_id)
+
+        plan = self._plan_access_request(subscription=subscription, grant_permissions=grant_permissions,
+                                         grantable_permissions=grantable_permissions, refresh_catalog=refresh_catalog)
+
+        if dry_run is True:
+            return plan
+
+        self._execute_access_request_plan(plan=plan, decision_notes=decision_notes)
+
+    def approve_access_requests(self, request_ids: list, decision_notes: str = None) -> dict:
+        '''
+        Approve a set of access requests with their requested permissions. The Glue Catalog resource policy grants for all
+        consumers are merged and written once, before any bucket policies or LakeFormation grants are applied, so that a
+        policy which can't be written leaves no access behind. Each subscription is then marked as Active as soon as its
+        grants have been applied. A plan which fails doesn't stop the others being applied, and once all plans have been
+        tried a single Exception is raised which lists the requests which were approved and those which failed. The
+        resource policy statements of failed requests only allow access by tag, so they grant nothing until the request
+        is approved again
+        :param request_ids:
+        :param decision_notes:
+        :return: Dictionary of request ID to the approval plan which was applied
+        '''
+        plans = {}
+        subscriptions = self._subscription_tracker.get_subscriptions(subscription_ids=request_ids)
+        for request_id, subscription in zip(request_ids, subscriptions):
+            if subscription is None:
+                raise Exception(f"Subscription {request_id} does not exist")
+
+            plans[request_id] = self._plan_access_request(subscription=subscription)
+
+        # the resource policy only allows access by tag once LakeFormation grants exist, so it is safe to write first.
+        # The merge, size check and conditional write all happen here, and raise before anything else is changed
+        resource_policies = self._mesh_automator.glue_resource_policy_manager(
+            region=self._current_region, producer_account_id=self._data_mesh_account_id
         )
+        for plan in plans.values():
+            resource_policies.add(consumer_account_id=plan.get("Principal"), database_name=plan.get("DatabaseName"),
+                                  tables=plan.get("ResourcePolicyTables"))
+        resource_policies.apply()
+
+        applied = []
+        failed = {}
+        for request_id, plan in plans.items():
+            try:
+                self._execute_access_request_plan(plan=plan, decision_notes=decision_notes,
+                                                  update_resource_policy=False)
+                applied.append(request_id)
+            except Exception as e:
+                self._logger.error(f"Unable to approve Subscription {request_id}: {e}")
+                failed[request_id] = str(e)
+
+        if len(failed) > 0:
+            raise Exception(f"Unable to approve {len(failed)} of {len(plans)} Subscriptions. Approved: {applied}. "
+                            f"Failed: {failed}")
+
+        return plans
 
     def add_principal_to_glue_resource_policy(self, database_name: str, tables: list, add_principal: str):
         self._mesh_automator.update_glue_catalog_resource_policy(
@@ -479,6 +758,30 @@ class DataMeshProducer:
     def get_subscription(self, request_id: str) -> dict:
         return self._subscription_tracker.get_subscription(subscription_id=request_id)
 
+    def enable_subscription_cache(self, max_age_seconds: float = SUBSCRIPTION_CACHE_MAX_AGE_SECONDS,
+                                  follow_stream: bool = True, stream_endpoint_url: str = None):
+        '''
+        Cache subscriptions in process, so that approval flows don't read the same subscription repeatedly. Cached
+        subscriptions are invalidated by changes read from the subscription table's DynamoDB stream
+        :param max_age_seconds: Staleness bound, after which a cached subscription is read again
+        :param follow_stream: Set to False to rely only on the staleness bound and this producer's own writes
+        :param stream_endpoint_url: Endpoint of DynamoDB Streams, such as a local DynamoDB
+        :return: SubscriptionCache
+        '''
+        return self._subscription_tracker.enable_cache(max_age_seconds=max_age_seconds, follow_stream=follow_stream,
+                                                       stream_endpoint_url=stream_endpoint_url)
+
+    def get_subscriptions(self, request_ids: list, projection: list = None, consistent_read: bool = True) -> list:
+        '''
+        Get many subscriptions in batches, rather than a call per subscription
+        :param request_ids:
+        :param projection: Attributes to return, or None for all attributes
+        :param consistent_read: Set to False for eventually consistent reads
+        :return: List of the subscriptions in the order of request_ids, with None for those which don't exist
+        '''
+        return self._subscription_tracker.get_subscriptions(subscription_ids=request_ids, projection=projection,
+                                                            consistent_read=consistent_read)
+
     def delete_subscription(self, subscription_id: str, reason: str):
         '''
         Soft delete a subscription
@@ -491,7 +794,7 @@ class DataMeshProducer:
         if subscription is None:
             raise Exception("No Subscription Found")
         else:
-            lf_client = self._data_mesh_session.client('lakeformation')
+            lf_client = self._mesh_automator._get_client('lakeformation')
 
             entries = []
             for t in subscription.get(TABLE_NAME):
@@ -500,7 +803,7 @@ class DataMeshProducer:
 
                 # revoke table level permissions minus SELECT
                 entries.append({
-                    'Id': shortuuid.uuid(),
+                    'Id': utils.generate_id(),
                     'Principal': {
                         'DataLakePrincipalIdentifier': subscription.get(SUBSCRIBER_PRINCIPAL)
                     },
@@ -515,7 +818,7 @@ class DataMeshProducer:
                 # revoke column level select permission
                 if 'SELECT' in subscription.get(PERMITTED_GRANTS):
                     entries.append({
-                        'Id': shortuuid.uuid(),
+                        'Id': utils.generate_id(),
                         'Principal': {
                             'DataLakePrincipalIdentifier': subscription.get(SUBSCRIBER_PRINCIPAL)
                         },
@@ -531,7 +834,7 @@ class DataMeshProducer:
 
             # add the database grant
             entries.append({
-                'Id': shortuuid.uuid(),
+                'Id': utils.generate_id(),
                 'Principal': {
                     'DataLakePrincipalIdentifier': subscription.get(SUBSCRIBER_PRINCIPAL)
                 },
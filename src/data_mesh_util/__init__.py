@@ -1 +1,20 @@
-# Implement your code here.
+import importlib
+
+# submodules are imported on first access, so that importing the package doesn't pay for boto3 and the other
+# dependencies of modules which aren't used
+_LAZY_SUBMODULES = ['DataMeshAdmin', 'DataMeshConsumer', 'DataMeshMacros', 'DataMeshProducer', 'lib']
+
+__all__ = list(_LAZY_SUBMODULES)
+
+
+def __getattr__(name: str):
+    if name in _LAZY_SUBMODULES:
+        module = importlib.import_module(f"{__name__}.{name}")
+        globals()[name] = module
+        return module
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(list(globals().keys()) + _LAZY_SUBMODULES)
@@ -1,14 +1,18 @@
-import sys
+import collections
+import fnmatch
 import logging
+import queue
+import re
+import threading
 import time
-
-import boto3
-import botocore.exceptions
-import shortuuid
+from concurrent.futures import ThreadPoolExecutor
 
 from data_mesh_util.lib.constants import *
 import json
 import data_mesh_util.lib.utils as utils
+from data_mesh_util.lib.BucketPolicyManager import BucketPolicyManager
+from data_mesh_util.lib.GlueResourcePolicyManager import GlueResourcePolicyManager
+from data_mesh_util.lib.GrantAccumulator import GrantAccumulator
 
 
 class ApiAutomator:
@@ -16,24 +20,41 @@ class ApiAutomator:
     _session = None
     _logger = None
     _logger = logging.getLogger("ApiAutomator")
-    # make sure we always log to standard out
-    _logger.addHandler(logging.StreamHandler(sys.stdout))
-    _clients = None
-
-    def __init__(self, target_account: str, session: boto3.session.Session, log_level: str = "INFO"):
+    _credentials = None
+    _client_lock = None
+    _bucket_policy_lock = None
+    _lf_tag_cache = None
+    _lf_tag_cache_lock = None
+    _lf_tag_cache_ttl = None
+    _validated_tags = None
+    _glue_table_cache = None
+
+    def __init__(self, target_account: str, session, log_level: str = "INFO",
+                 lf_tag_cache_ttl: int = LF_TAG_CACHE_TTL_SECONDS):
         self._target_account = target_account
         self._session = session
-        self._logger.setLevel(log_level)
-        self._clients = {}
+        utils.configure_logger(self._logger, log_level)
+        self._client_lock = threading.Lock()
+        self._bucket_policy_lock = threading.Lock()
+        # map of LF Tag Key to a tuple of valid values and the time at which they expire
+        self._lf_tag_cache = {}
+        self._lf_tag_cache_lock = threading.Lock()
+        self._lf_tag_cache_ttl = lf_tag_cache_ttl
+        # map of LF Tag Key to the set of values known to be valid during this session
+        self._validated_tags = {}
+        # map of (catalog, database) to a snapshot of its Glue tables, used to resolve table patterns locally
+        self._glue_table_cache = {}
 
     def _get_client(self, client_name):
-        client = self._clients.get(client_name)
+        # clients come from the process-wide client registry, so they are shared by all threads and by every automator
+        # using the same credentials. Resolving the session's credentials is not thread safe, so it is done once
+        if self._credentials is None:
+            with self._client_lock:
+                if self._credentials is None:
+                    self._credentials = self._session.get_credentials()
 
-        if client is None:
-            client = self._session.client(client_name)
-            self._clients[client_name] = client
-
-        return client
+        return utils.generate_client(service=client_name, region=self._session.region_name,
+                                     credentials=self._credentials)
 
     def _get_bucket_name(self, bucket_value):
         if 's3://' in bucket_value:
@@ -65,7 +86,71 @@ class ApiAutomator:
 
         self._logger.info("Enabled Account %s to assume %s" % (account_id_to_trust, update_role_name))
 
+    def _cache_lf_tag(self, tag_key: str, tag_values: list) -> None:
+        with self._lf_tag_cache_lock:
+            self._lf_tag_cache[tag_key] = (tag_values, time.monotonic() + self._lf_tag_cache_ttl)
+
+    def invalidate_lf_tag_cache(self, tag_key: str = None) -> None:
+        '''
+        Remove a tag definition from the LF Tag cache, or all tag definitions if no key is provided
+        :param tag_key:
+        :return:
+        '''
+        with self._lf_tag_cache_lock:
+            if tag_key is None:
+                self._lf_tag_cache.clear()
+            else:
+                self._lf_tag_cache.pop(tag_key, None)
+
+    def load_lf_tag_definitions(self) -> dict:
+        '''
+        Load all LF Tag definitions in the account into the LF Tag cache
+        :return: Dictionary of Tag Key to valid Tag Values
+        '''
+        lf_client = self._get_client('lakeformation')
+
+        definitions = {}
+        args = {}
+        while True:
+            response = lf_client.list_lf_tags(**args)
+            for tag in response.get('LFTags', []):
+                definitions[tag.get('TagKey')] = tag.get('TagValues')
+
+            if response.get('NextToken') is not None:
+                args['NextToken'] = response.get('NextToken')
+            else:
+                break
+
+        for tag_key, tag_values in definitions.items():
+            self._cache_lf_tag(tag_key, tag_values)
+
+        self._logger.debug(f"Loaded {len(definitions)} LF Tag definitions")
+
+        return definitions
+
+    def get_lf_tag_values(self, tag_key: str) -> list:
+        '''
+        Get the valid values for an LF Tag, using the LF Tag cache where the definition has not expired
+        :param tag_key:
+        :return:
+        '''
+        with self._lf_tag_cache_lock:
+            cached = self._lf_tag_cache.get(tag_key)
+
+        if cached is not None and cached[1] > time.monotonic():
+            return cached[0]
+
+        tag_values = self._get_client('lakeformation').get_lf_tag(TagKey=tag_key).get('TagValues')
+        self._cache_lf_tag(tag_key, tag_values)
+
+        return tag_values
+
     def _validate_tag(self, tag_key: str, tag_body: dict) -> None:
+        # tag values which have already been validated in this session need no further API calls
+        with self._lf_tag_cache_lock:
+            if set(tag_body.get('TagValues')).issubset(self._validated_tags.get(tag_key, set())):
+                return
+
         lf_client = self._get_client('lakeformation')
 
         # create the tag or validate it exists
@@ -74,6 +159,7 @@ class ApiAutomator:
                 TagKey=tag_key,
                 TagValues=tag_body.get('ValidValues')
             )
+            self.invalidate_lf_tag_cache(tag_key)
         except lf_client.exceptions.AlreadyExistsException:
             pass
         except lf_client.exceptions.InvalidInputException as e:
@@ -83,9 +169,7 @@ class ApiAutomator:
                 raise e
 
         # add all missing tag values to valid values (as they must have existed somewhere to be assigned)
-        current_tag_values = lf_client.get_lf_tag(
-            TagKey=tag_key
-        ).get('TagValues')
+        current_tag_values = self.get_lf_tag_values(tag_key)
         missing_tag_values = []
         for value in tag_body.get('TagValues'):
             if value not in current_tag_values:
@@ -96,14 +180,30 @@ class ApiAutomator:
                 TagKey=tag_key,
                 TagValuesToAdd=missing_tag_values
             )
+            self.invalidate_lf_tag_cache(tag_key)
+
+        with self._lf_tag_cache_lock:
+            self._validated_tags.setdefault(tag_key, set()).update(current_tag_values, missing_tag_values)
 
     def attach_tag(self, database: str, table: str, tag: tuple):
-        # create the tag or make sure it already exists
-        tag_key = tag[0]
-        tag_body = tag[1]
-        self._validate_tag(tag_key=tag_key, tag_body=tag_body)
+        self.attach_tags(database=database, table=table, tags={tag[0]: tag[1]})
 
-        # attach the tag to the table
+    def attach_tags(self, database: str, table: str, tags: dict):
+        '''
+        Attach a set of LF Tags to a table with a single call
+        :param database:
+        :param table:
+        :param tags: Dictionary of Tag Key to a Tag Body containing TagValues and ValidValues
+        :return:
+        '''
+        if tags is None or len(tags) == 0:
+            return
+
+        # create the tags or make sure they already exist
+        for tag_key, tag_body in tags.items():
+            self._validate_tag(tag_key=tag_key, tag_body=tag_body)
+
+        # attach the tags to the table
         lf_client = self._get_client('lakeformation')
         try:
             args = {
@@ -113,14 +213,13 @@ class ApiAutomator:
                         'Name': table
                     }
                 },
-                "LFTags": [
-                    {
-                        'TagKey': tag_key,
-                        'TagValues': tag_body.get('TagValues')
-                    },
-                ]
+                "LFTags": [{'TagKey': tag_key, 'TagValues': tag_body.get('TagValues')} for tag_key, tag_body in
+                           tags.items()]
             }
-            lf_client.add_lf_tags_to_resource(**args)
+            response = lf_client.add_lf_tags_to_resource(**args)
+
+            for f in response.get('Failures', []):
+                self._logger.error(f"Unable to attach LF Tag {f.get('LFTag')} to {database}.{table}: {f.get('Error')}")
         except lf_client.exceptions.AlreadyExistsException:
             pass
 
@@ -358,25 +457,93 @@ class ApiAutomator:
                 else:
                     raise iie
 
-    def get_table_partitions(self, database_name: str, table_name: str) -> list:
-        # load the partitions for the table if there are any
-        glue_client = self._get_client('glue')
-        all_partitions = []
+    def _read_partition_pages(self, glue_client, database_name: str, table_name: str, segment: dict = None):
         partition_args = {
             "DatabaseName": database_name,
             "TableName": table_name,
             "ExcludeColumnSchema": False
         }
+        if segment is not None:
+            partition_args['Segment'] = segment
+
         has_more_partitions = True
         while has_more_partitions is True:
             partitions = glue_client.get_partitions(**partition_args)
-            all_partitions.extend(partitions.get('Partitions'))
+            yield partitions.get('Partitions')
 
             if 'NextToken' in partitions:
                 partition_args['NextToken'] = partitions.get('NextToken')
             else:
                 has_more_partitions = False
 
+    def iter_table_partitions(self, database_name: str, table_name: str, total_segments: int = 1):
+        '''
+        Generator which yields pages of partitions for a table as they are read from Glue, so that callers never have to
+        hold all partitions in memory. When total_segments is greater than 1, the segments are read in parallel and
+        pages are yielded in the order they arrive
+        :param database_name:
+        :param table_name:
+        :param total_segments: Number of Glue partition segments to read in parallel (1-10)
+        :return:
+        '''
+        if total_segments < 1 or total_segments > GLUE_MAX_PARTITION_SEGMENTS:
+            raise Exception(f"Partition Segments must be between 1 and {GLUE_MAX_PARTITION_SEGMENTS}")
+
+        glue_client = self._get_client('glue')
+
+        if total_segments == 1:
+            yield from self._read_partition_pages(glue_client, database_name, table_name)
+            return
+
+        # bound the number of pages buffered so memory stays proportional to page size
+        pages = queue.Queue(maxsize=total_segments * 2)
+        stop = threading.Event()
+        end_of_segment = object()
+
+        def _put(item) -> bool:
+            while not stop.is_set():
+                try:
+                    pages.put(item, timeout=1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def _read_segment(segment_number: int):
+            try:
+                for page in self._read_partition_pages(glue_client, database_name, table_name,
+                                                       segment={'SegmentNumber': segment_number,
+                                                                'TotalSegments': total_segments}):
+                    if not _put(page):
+                        return
+                _put(end_of_segment)
+            except Exception as e:
+                _put(e)
+
+        workers = [threading.Thread(target=_read_segment, args=(n,), daemon=True) for n in range(total_segments)]
+        for w in workers:
+            w.start()
+
+        try:
+            finished_segments = 0
+            while finished_segments < total_segments:
+                page = pages.get()
+                if page is end_of_segment:
+                    finished_segments += 1
+                elif isinstance(page, Exception):
+                    raise page
+                else:
+                    yield page
+        finally:
+            # release any readers that are still blocked if the consumer stopped early
+            stop.set()
+
+    def get_table_partitions(self, database_name: str, table_name: str) -> list:
+        # load the partitions for the table if there are any
+        all_partitions = []
+        for page in self.iter_table_partitions(database_name=database_name, table_name=table_name):
+            all_partitions.extend(page)
+
         return all_partitions
 
     def enable_crawler_role(self, crawler_role_arn: str, grant_to_role_name: str):
@@ -412,30 +579,237 @@ class ApiAutomator:
 
         self._logger.info(f"Enabled {grant_to_role_name} to pass role {crawler_role_name} to Glue Crawlers")
 
-    def create_table_partition_metadata(self, database_name: str, table_name: str, partition_input_list: list):
+    def _run_partition_batch(self, glue_call, request_args: dict, entry_arg: str, entries: list,
+                             get_entry_values, action: str) -> tuple:
+        '''
+        Run a Glue batch partition operation, retrying throttled calls and throttled entries with backoff
+        :return: Tuple of the number of succeeded, already existing, and failed entries
+        '''
+        import botocore.exceptions
+
+        succeeded = 0
+        existing = 0
+        failed = 0
+        pending = entries
+        retries = 0
+        while len(pending) > 0:
+            try:
+                response = glue_call(**request_args, **{entry_arg: pending})
+            except botocore.exceptions.ClientError as ce:
+                if ce.response.get('Error', {}).get('Code') in THROTTLING_ERROR_CODES and retries < MAX_API_RETRIES:
+                    retries += 1
+                    time.sleep(min(2 ** retries * 0.1, 5))
+                    continue
+                else:
+                    raise ce
+
+            # work out which entries failed, and retry only those which were throttled
+            throttled_values = []
+            for e in response.get('Errors', []):
+                code = e.get('ErrorDetail', {}).get('ErrorCode')
+                values = e.get('PartitionValues', e.get('PartitionValueList'))
+                if code == 'AlreadyExistsException':
+                    existing += 1
+                elif code in THROTTLING_ERROR_CODES and retries < MAX_API_RETRIES:
+                    throttled_values.append(values)
+                else:
+                    failed += 1
+                    self._logger.error(
+                        f"Unable to {action} Partition {values} on {request_args.get('DatabaseName')}.{request_args.get('TableName')}: {e.get('ErrorDetail')}")
+
+            succeeded += len(pending) - len(response.get('Errors', []))
+
+            pending = [p for p in pending if get_entry_values(p) in throttled_values]
+            if len(pending) > 0:
+                retries += 1
+                time.sleep(min(2 ** retries * 0.1, 5))
+
+        return succeeded, existing, failed
+
+    def _batch_create_partition_chunk(self, glue_client, database_name: str, table_name: str,
+                                      partitions: list) -> dict:
+        created, existing, failed = self._run_partition_batch(
+            glue_call=glue_client.batch_create_partition,
+            request_args={"DatabaseName": database_name, "TableName": table_name},
+            entry_arg='PartitionInputList', entries=partitions,
+            get_entry_values=lambda p: p.get('Values'), action='create'
+        )
+
+        return {PARTITIONS_CREATED: created, PARTITIONS_EXISTING: existing, PARTITIONS_FAILED: failed}
+
+    def create_table_partition_metadata(self, database_name: str, table_name: str, partition_input_list,
+                                        max_workers: int = GLUE_PARTITION_WORKERS) -> dict:
+        '''
+        Create partitions on a table using BatchCreatePartition. Partitions which already exist are skipped
+        :param database_name:
+        :param table_name:
+        :param partition_input_list: List or Iterable of Partitions. Iterables are consumed lazily
+        :param max_workers:
+        :return: Dictionary of the number of partitions Created, AlreadyExisting, and Failed
+        '''
+        keys = [
+            'DatabaseName', 'TableName', 'CreationTime', 'LastAnalyzedTime', 'CatalogId'
+        ]
+
+        # the chunk workers share the automator's client
         glue_client = self._get_client('glue')
 
-        partitions_created = 0
-        for p in partition_input_list:
-            keys = [
-                'DatabaseName', 'TableName', 'CreationTime', 'LastAnalyzedTime', 'CatalogId'
-            ]
-            p = utils.remove_dict_keys(input_dict=p, remove_keys=keys)
+        counts = {PARTITIONS_CREATED: 0, PARTITIONS_EXISTING: 0, PARTITIONS_FAILED: 0}
 
-            try:
-                glue_client.create_partition(
-                    DatabaseName=database_name,
-                    TableName=table_name,
-                    PartitionInput=p
+        def _add_counts(future):
+            for k, v in future.result().items():
+                counts[k] += v
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            in_flight = collections.deque()
+
+            def _submit(c: list):
+                # only keep a bounded number of chunks in flight so that streamed input stays streamed
+                if len(in_flight) >= max_workers * 2:
+                    _add_counts(in_flight.popleft())
+                in_flight.append(executor.submit(self._batch_create_partition_chunk, glue_client, database_name,
+                                                 table_name, c))
+
+            chunk = []
+            for p in partition_input_list:
+                chunk.append(utils.remove_dict_keys(input_dict=p, remove_keys=keys))
+                if len(chunk) == GLUE_PARTITION_BATCH_SIZE:
+                    _submit(chunk)
+                    chunk = []
+            if len(chunk) > 0:
+                _submit(chunk)
+
+            while len(in_flight) > 0:
+                _add_counts(in_flight.popleft())
+
+        self._logger.info(
+            f"Create {counts[PARTITIONS_CREATED]} new Table Partitions ({counts[PARTITIONS_EXISTING]} already existed, {counts[PARTITIONS_FAILED]} failed)")
+
+        return counts
+
+    def get_partition_index(self, database_name: str, table_name: str,
+                            total_segments: int = GLUE_PARTITION_READ_SEGMENTS) -> dict:
+        '''
+        Build an index of the partitions of a table, keyed by partition values, holding only a fingerprint of each
+        partition's location and schema
+        :param database_name:
+        :param table_name:
+        :param total_segments:
+        :return: Dictionary of tuple(partition values) to fingerprint
+        '''
+        partition_index = {}
+        for page in self.iter_table_partitions(database_name=database_name, table_name=table_name,
+                                               total_segments=total_segments):
+            for p in page:
+                partition_index[tuple(p.get('Values'))] = utils.get_partition_fingerprint(p)
+
+        return partition_index
+
+    def _diff_partition_page(self, partition_index: dict, page: list) -> tuple:
+        '''
+        Compare a page of source partitions with the index of target partitions. Matched partitions are removed from the
+        index, so that after all pages have been compared the index contains only the partitions to be removed
+        :param partition_index:
+        :param page:
+        :return: Tuple of the partitions to create, partitions to update, and number of partitions unchanged
+        '''
+        to_create = []
+        to_update = []
+        unchanged = 0
+        for p in page:
+            values = tuple(p.get('Values'))
+            current = partition_index.pop(values, None)
+            if current is None:
+                to_create.append(p)
+            elif current != utils.get_partition_fingerprint(p):
+                to_update.append(p)
+            else:
+                unchanged += 1
+
+        return to_create, to_update, unchanged
+
+    def sync_table_partitions(self, database_name: str, table_name: str, source_partition_pages,
+                              delete_missing: bool = False, max_workers: int = GLUE_PARTITION_WORKERS) -> dict:
+        '''
+        Incrementally synchronise the partitions of a table in this account with a source set of partitions. Only
+        partitions which were added, changed (location or schema), or removed in the source are written
+        :param database_name:
+        :param table_name:
+        :param source_partition_pages: Iterable of pages (lists) of source partitions, such as iter_table_partitions()
+        :param delete_missing: Delete partitions which no longer exist in the source. Only use this when the source
+        pages are the complete set of partitions of the source table
+        :param max_workers:
+        :return: Dictionary of the number of partitions Created, Updated, Deleted, Unchanged, AlreadyExisting and Failed
+        '''
+        glue_client = self._get_client('glue')
+        keys = [
+            'DatabaseName', 'TableName', 'CreationTime', 'LastAnalyzedTime', 'CatalogId'
+        ]
+
+        partition_index = self.get_partition_index(database_name=database_name, table_name=table_name)
+
+        counts = {PARTITIONS_UPDATED: 0, PARTITIONS_DELETED: 0, PARTITIONS_UNCHANGED: 0, PARTITIONS_FAILED: 0}
+        to_update = []
+
+        def _flush_updates():
+            entries = [{
+                'PartitionValueList': p.get('Values'),
+                'PartitionInput': utils.remove_dict_keys(input_dict=p, remove_keys=keys)
+            } for p in to_update[:GLUE_PARTITION_BATCH_SIZE]]
+            del to_update[:GLUE_PARTITION_BATCH_SIZE]
+
+            updated, _, failed = self._run_partition_batch(
+                glue_call=glue_client.batch_update_partition,
+                request_args={"DatabaseName": database_name, "TableName": table_name},
+                entry_arg='Entries', entries=entries,
+                get_entry_values=lambda e: e.get('PartitionValueList'), action='update'
+            )
+            counts[PARTITIONS_UPDATED] += updated
+            counts[PARTITIONS_FAILED] += failed
+
+        def _partitions_to_create():
+            for page in source_partition_pages:
+                page_create, page_update, page_unchanged = self._diff_partition_page(partition_index, page)
+                counts[PARTITIONS_UNCHANGED] += page_unchanged
+
+                # changed partitions are written as soon as a full batch is available, so that at most one batch is
+                # held in memory
+                to_update.extend(page_update)
+                while len(to_update) >= GLUE_PARTITION_BATCH_SIZE:
+                    _flush_updates()
+
+                yield from page_create
+
+        # new partitions are streamed into the batched writer
+        created = self.create_table_partition_metadata(database_name=database_name, table_name=table_name,
+                                                       partition_input_list=_partitions_to_create(),
+                                                       max_workers=max_workers)
+        counts[PARTITIONS_CREATED] = created.get(PARTITIONS_CREATED)
+        counts[PARTITIONS_EXISTING] = created.get(PARTITIONS_EXISTING)
+        counts[PARTITIONS_FAILED] += created.get(PARTITIONS_FAILED)
+
+        while len(to_update) > 0:
+            _flush_updates()
+
+        if delete_missing is True:
+            removed = [{'Values': list(values)} for values in partition_index.keys()]
+            for i in range(0, len(removed), GLUE_PARTITION_DELETE_BATCH_SIZE):
+                deleted, _, failed = self._run_partition_batch(
+                    glue_call=glue_client.batch_delete_partition,
+                    request_args={"DatabaseName": database_name, "TableName": table_name},
+                    entry_arg='PartitionsToDelete', entries=removed[i:i + GLUE_PARTITION_DELETE_BATCH_SIZE],
+                    get_entry_values=lambda e: e.get('Values'), action='delete'
                 )
-                partitions_created += 1
-            except glue_client.exceptions.AlreadyExistsException:
-                pass
+                counts[PARTITIONS_DELETED] += deleted
+                counts[PARTITIONS_FAILED] += failed
+
+        self._logger.info(
+            f"Synchronised Partitions on {database_name}.{table_name}: {counts[PARTITIONS_CREATED]} created, {counts[PARTITIONS_UPDATED]} updated, {counts[PARTITIONS_DELETED]} deleted, {counts[PARTITIONS_UNCHANGED]} unchanged")
 
-        self._logger.info(f"Create {partitions_created} new Table Partitions")
+        return counts
 
     def load_glue_tables(self, catalog_id: str, source_db_name: str,
-                         table_name_regex: str, load_lf_tags: bool = True):
+                         table_name_regex: str, load_lf_tags: bool = True, bulk_load_lf_tags: bool = False):
         glue_client = self._get_client('glue')
         lf_client = self._get_client('lakeformation')
 
@@ -482,141 +856,173 @@ class ApiAutomator:
         self._logger.info(f"Loaded {len(all_tables)} tables matching {table_name_regex} from Glue")
 
         # now load all lakeformation tags for the supplied objects
-        if load_lf_tags is True:
+        if load_lf_tags is True and len(all_tables) > 0:
+            # fetch all tag definitions upfront, so that each table only costs a call for its assigned tags
+            tag_definitions = self.load_lf_tag_definitions()
+
+            searched_tags = {}
+            # the search can't be scoped to a database, so it only saves calls when the database has more tables than
+            # the search makes requests
+            search_calls = sum(-(-len(v) // LF_TAG_SEARCH_MAX_VALUES) for v in tag_definitions.values())
+            if bulk_load_lf_tags is True and len(all_tables) > search_calls:
+                searched_tags = self._search_table_lf_tags(catalog_id=catalog_id, database_name=source_db_name,
+                                                           tag_definitions=tag_definitions,
+                                                           table_names={t.get('Name') for t in all_tables}) or {}
+
             for t in all_tables:
-                tags = lf_client.get_resource_lf_tags(
-                    CatalogId=catalog_id,
-                    Resource={
-                        'Table': {
-                            'CatalogId': catalog_id,
-                            'DatabaseName': t.get('DatabaseName'),
-                            'Name': t.get('Name')
-                        }
-                    },
-                    ShowAssignedLFTags=True
-                )
-                key = 'LFTagsOnTable'
+                if t.get('Name') in searched_tags:
+                    table_tags = searched_tags.get(t.get('Name'))
+                else:
+                    # the search only finds tables with tags defined in this account which the caller can see, so
+                    # tables it didn't return may still have tags
+                    table_tags = lf_client.get_resource_lf_tags(
+                        CatalogId=catalog_id,
+                        Resource={
+                            'Table': {
+                                'CatalogId': catalog_id,
+                                'DatabaseName': t.get('DatabaseName'),
+                                'Name': t.get('Name')
+                            }
+                        },
+                        ShowAssignedLFTags=True
+                    ).get('LFTagsOnTable')
+
                 use_tags = {}
-                if tags.get(key) is not None and len(tags.get(key)) > 0:
-                    for table_tag in tags.get(key):
+                if table_tags is not None and len(table_tags) > 0:
+                    for table_tag in table_tags:
                         # get all the valid values for the tag in LF
-                        lf_tag = lf_client.get_lf_tag(TagKey=table_tag.get('TagKey'))
                         use_tags[table_tag.get('TagKey')] = {
                             'TagValues': table_tag.get('TagValues'),
-                            'ValidValues': lf_tag.get('TagValues')
+                            'ValidValues': self.get_lf_tag_values(table_tag.get('TagKey'))
                         }
                     t['Tags'] = use_tags
 
+            if len(searched_tags) > 0:
+                self._logger.info(
+                    f"Loaded LF Tags for {len(searched_tags)} of {len(all_tables)} tables by search")
+
         return all_tables
 
-    def update_glue_catalog_resource_policy(self, region: str, producer_account_id: str, consumer_account_id: str,
-                                            database_name: str, tables: list):
-        glue_client = self._get_client('glue')
-        new_resource_policy = None
-        current_resource_policy = None
+    def _compile_table_pattern(self, table_name_pattern: str):
+        # match with the semantics of the Glue GetTables Expression, where '*' is a wildcard, so 'usecase*' matches
+        # 'usecase_orders'. '.*' and escaped '\*' are left as they are
         try:
-            current_resource_policy = glue_client.get_resource_policy()
-        except glue_client.exceptions.EntityNotFoundException:
-            pass
+            return re.compile(re.sub(r'(?<![.\\])\*', '.*', table_name_pattern))
+        except re.error:
+            # glob style patterns such as '*' are not valid regular expressions
+            return re.compile(fnmatch.translate(table_name_pattern))
 
-        cf = {
-            'region': region,
-            'producer_account_id': producer_account_id,
-            'consumer_account_id': consumer_account_id,
-            "database_name": database_name,
-            'tables': tables
-        }
+    def invalidate_glue_table_cache(self, catalog_id: str = None, source_db_name: str = None) -> None:
+        '''
+        Discard cached Glue table snapshots, for a single database or for all databases
+        :param catalog_id:
+        :param source_db_name:
+        :return:
+        '''
+        if catalog_id is None or source_db_name is None:
+            self._glue_table_cache.clear()
+        else:
+            self._glue_table_cache.pop((catalog_id, source_db_name), None)
 
-        # add the table list and generate full policy
-        cf['table_list'] = tables
-        policy = json.loads(utils.generate_policy('lf_cross_account_tbac.pystache', config=cf))
+    def resolve_glue_tables(self, catalog_id: str, source_db_name: str, table_name_patterns: list,
+                            refresh: bool = False) -> list:
+        '''
+        Resolve a list of table names or regular expressions against a database. The database is listed once and cached,
+        so that several resolutions in one session only list the catalog once
+        :param catalog_id:
+        :param source_db_name:
+        :param table_name_patterns:
+        :param refresh: Discard any cached snapshot of the database and list it again
+        :return: List of matched Glue tables, without duplicates, in catalog order
+        '''
+        cache_key = (catalog_id, source_db_name)
+        all_tables = self._glue_table_cache.get(cache_key)
+        listed = False
+        if all_tables is None or refresh is True:
+            all_tables = self.load_glue_tables(catalog_id=catalog_id, source_db_name=source_db_name,
+                                               table_name_regex=None, load_lf_tags=False)
+            self._glue_table_cache[cache_key] = all_tables
+            listed = True
+
+        matched_names = set()
+        for pattern in table_name_patterns:
+            compiled = self._compile_table_pattern(pattern)
+            matches = [t.get('Name') for t in all_tables if compiled.fullmatch(t.get('Name')) is not None]
+
+            if len(matches) == 0 and not listed:
+                # the table may have been created since the database was cached, so list it again once
+                return self.resolve_glue_tables(catalog_id=catalog_id, source_db_name=source_db_name,
+                                                table_name_patterns=table_name_patterns, refresh=True)
+
+            if len(matches) == 0:
+                raise Exception("Unable to find any Tables matching %s in Database %s" % (pattern, source_db_name))
+
+            matched_names.update(matches)
+
+        return [t for t in all_tables if t.get('Name') in matched_names]
+
+    def _search_table_lf_tags(self, catalog_id: str, database_name: str, tag_definitions: dict,
+                              table_names: set) -> dict:
+        '''
+        Load the LF Tags on the tables of a database with paginated SearchTablesByLFTags calls per Tag Key, rather than
+        one call per table. Each search returns all of the tags on a matched table, so searching stops once every table
+        in the database has been found. Only tags in tag_definitions are searched, so tables whose tags were shared
+        from another account, or can't be seen by the caller, are not returned and must be loaded individually
+        :param catalog_id:
+        :param database_name:
+        :param tag_definitions: Dictionary of Tag Key to all valid Tag Values
+        :param table_names: Names of the tables in the database
+        :return: Dictionary of Table Name to the list of LF Tags on the Table, for the tables which were found, or None
+        if the search could not be completed
+        '''
+        import botocore.exceptions
 
-        policy_condition = None
-        if current_resource_policy is None:
-            new_resource_policy = {
-                "Version": "2012-10-17",
-                "Statement": [policy]
-            }
-            glue_client.put_resource_policy(
-                PolicyInJson=json.dumps(new_resource_policy),
-                PolicyExistsCondition='NOT_EXIST',
-                EnableHybrid='TRUE'
-            )
-            self._logger.info(
-                f"Created new Catalog Resource Policy on {producer_account_id} allowing Tag Based Access by {consumer_account_id}")
-        else:
-            new_resource_policy = json.loads(current_resource_policy.get('PolicyInJson'))
-            current_hash = current_resource_policy.get('PolicyHash')
-
-            update_statement, policy_index, did_modification = self._get_glue_resource_policy_statement_to_modify(
-                region=region,
-                policy=new_resource_policy, producer_account_id=producer_account_id,
-                consumer_account_id=consumer_account_id,
-                database_name=database_name, tables=tables
-            )
+        lf_client = self._get_client('lakeformation')
 
-            # add the new statement
-            if update_statement is None:
-                new_resource_policy['Statement'].append(policy)
-                did_modification = True
-            elif update_statement is not None:
-                new_resource_policy['Statement'][policy_index] = update_statement
-
-            if did_modification is True:
-                glue_client.put_resource_policy(
-                    PolicyInJson=json.dumps(new_resource_policy),
-                    PolicyHashCondition=current_hash,
-                    PolicyExistsCondition='MUST_EXIST',
-                    EnableHybrid='TRUE'
-                )
-                self._logger.info(
-                    f"Updated Catalog Resource Policy on {producer_account_id} allowing Tag Based Access by {consumer_account_id}")
-
-    def _get_glue_resource_policy_statement_to_modify(self, region: str, policy: dict, producer_account_id: str,
-                                                      consumer_account_id: str,
-                                                      database_name: str, tables: list) -> tuple:
-        # go through the policy to find if there's a match on region, consumer principal, and database
-        target_statement_index = 0
-        statement_match = None
-        missing_tables = []
-        if tables is not None:
-            missing_tables = tables.copy()
-
-        for i, statement in enumerate(policy.get('Statement')):
-            if statement is not None and 'AWS' in statement.get('Principal') and consumer_account_id in statement.get(
-                    'Principal').get('AWS'):
-                # go through the resources to get region and DB match
-                for j, resource in enumerate(statement.get('Resource')):
-                    # resources will be in format:
-                    #
-                    # "arn:aws:glue:<region>:<account-id>:table/*",
-                    # "arn:aws:glue:<region>:<account-id>:database/*",
-                    # "arn:aws:glue:<region>:<account-id>:catalog"
-                    if region in resource and producer_account_id in resource and (
-                            ':database' in resource and database_name in resource):
-                        # this statement is a match
-                        target_statement_index = i
-                        statement_match = statement
-                        break
-
-        did_modification = False
-        if statement_match is not None:
-            for k, resource in enumerate(statement_match.get('Resource')):
-                resource_name = resource.split("/")[-1]
-                try:
-                    resource_index = missing_tables.index(resource_name)
-                    del missing_tables[resource_index]
-                except ValueError:
-                    pass
+        table_tags = {}
+        remaining = set(table_names)
+        try:
+            for tag_key, tag_values in tag_definitions.items():
+                # SearchTablesByLFTags accepts a limited number of values per expression
+                for i in range(0, len(tag_values), LF_TAG_SEARCH_MAX_VALUES):
+                    args = {
+                        "CatalogId": catalog_id,
+                        "Expression": [{'TagKey': tag_key, 'TagValues': tag_values[i:i + LF_TAG_SEARCH_MAX_VALUES]}]
+                    }
+                    while len(remaining) > 0:
+                        response = lf_client.search_tables_by_lf_tags(**args)
+                        for tagged_table in response.get('TableList', []):
+                            table = tagged_table.get('Table')
+                            if table.get('DatabaseName') == database_name and table.get('Name') in remaining:
+                                table_tags[table.get('Name')] = tagged_table.get('LFTagsOnTable', [])
+                                remaining.discard(table.get('Name'))
+
+                        if response.get('NextToken') is not None:
+                            args['NextToken'] = response.get('NextToken')
+                        else:
+                            break
+        except botocore.exceptions.ClientError as ce:
+            self._logger.warning(
+                f"Unable to search LF Tags in Database {database_name}, loading Tags for each Table: {ce}")
+            return None
 
-            # add the tables that were missing
-            if len(missing_tables) > 0:
-                statement_match['Resource'].extend(missing_tables)
-                did_modification = True
+        return table_tags
 
-            return statement_match, target_statement_index, did_modification
-        else:
-            return None, None, None
+    def glue_resource_policy_manager(self, region: str, producer_account_id: str) -> GlueResourcePolicyManager:
+        '''
+        Create a manager which merges consumer grants into the Glue Catalog resource policy with a single write
+        :param region:
+        :param producer_account_id: The account which owns the catalog
+        :return:
+        '''
+        return GlueResourcePolicyManager(automator=self, region=region, producer_account_id=producer_account_id,
+                                         logger=self._logger)
+
+    def update_glue_catalog_resource_policy(self, region: str, producer_account_id: str, consumer_account_id: str,
+                                            database_name: str, tables: list):
+        resource_policies = self.glue_resource_policy_manager(region=region, producer_account_id=producer_account_id)
+        resource_policies.add(consumer_account_id=consumer_account_id, database_name=database_name, tables=tables)
+        resource_policies.apply()
 
     def assert_is_data_lake_admin(self, principal):
         lf_client = self._get_client('lakeformation')
@@ -713,49 +1119,81 @@ class ApiAutomator:
 
         return table.get('Table')
 
-    def lf_grant_permissions(self, data_mesh_account_id: str, principal: str, database_name: str,
-                             table_name: str = None,
-                             permissions: list = ['ALL'],
-                             grantable_permissions: list = ['ALL']):
-        lf_client = self._get_client('lakeformation')
+    def _build_lf_grant(self, data_mesh_account_id: str, principal: str, database_name: str, table_name: str = None,
+                        permissions: list = None, grantable_permissions: list = None) -> dict:
+        '''
+        Build the Principal, Resource, and Permissions of a LakeFormation grant
+        '''
+        # always grant describe even if not requested, without changing the caller's list
+        permissions = list(permissions)
+        if 'DESCRIBE' not in permissions:
+            permissions.append('DESCRIBE')
+
+        grant = {
+            "Principal": {
+                'DataLakePrincipalIdentifier': principal
+            },
+            "Permissions": permissions
+        }
 
-        try:
-            args = {
-                "CatalogId": data_mesh_account_id,
-                "Principal": {
-                    'DataLakePrincipalIdentifier': principal
-                },
-                "Permissions": permissions
+        if table_name is not None:
+            db_spec = {
+                'CatalogId': data_mesh_account_id,
+                'DatabaseName': database_name
             }
+            if table_name == "*":
+                db_spec['TableWildcard'] = {}
+            else:
+                db_spec['Name'] = table_name
 
-            if table_name is not None:
-                db_spec = {
+            grant["Resource"] = {
+                'Table': db_spec
+            }
+        else:
+            # create a database grant
+            grant['Resource'] = {
+                'Database': {
                     'CatalogId': data_mesh_account_id,
-                    'DatabaseName': database_name
+                    'Name': database_name
                 }
-                if table_name == "*":
-                    db_spec['TableWildcard'] = {}
-                else:
-                    db_spec['Name'] = table_name
+            }
 
-                args["Resource"] = {
-                    'Table': db_spec
-                }
-            else:
-                # create a database grant
-                args['Resource'] = {
-                    'Database': {
-                        'CatalogId': data_mesh_account_id,
-                        'Name': database_name
-                    }
-                }
+        if grantable_permissions is not None:
+            grant["PermissionsWithGrantOption"] = grantable_permissions
 
-            # always grant describe even if not requested
-            if 'DESCRIBE' not in permissions:
-                permissions.append('DESCRIBE')
+        return grant
 
-            if grantable_permissions is not None:
-                args["PermissionsWithGrantOption"] = grantable_permissions
+    def _is_existing_grant_error(self, error_code: str, error_message: str) -> bool:
+        if error_code == 'AlreadyExistsException':
+            return True
+        elif "Permissions modification is invalid" in error_message:
+            # this is an error thrown when you try to create the same permissions that already exist :(
+            return True
+        elif "Please revoke permission(s) for IAM_ALLOWED_PRINCIPALS on the table" in error_message:
+            # this occurs because we are granting any IAM principal to describe the table, which means that the previous creation of the grant is already in place. ignore
+            return True
+        else:
+            return False
+
+    def lf_grant_accumulator(self, data_mesh_account_id: str) -> GrantAccumulator:
+        '''
+        Create an accumulator which collects LakeFormation grants and applies them with BatchGrantPermissions
+        :param data_mesh_account_id:
+        :return:
+        '''
+        return GrantAccumulator(automator=self, catalog_id=data_mesh_account_id, logger=self._logger)
+
+    def lf_grant_permissions(self, data_mesh_account_id: str, principal: str, database_name: str,
+                             table_name: str = None,
+                             permissions: list = ['ALL'],
+                             grantable_permissions: list = ['ALL']):
+        lf_client = self._get_client('lakeformation')
+
+        try:
+            args = self._build_lf_grant(data_mesh_account_id=data_mesh_account_id, principal=principal,
+                                        database_name=database_name, table_name=table_name,
+                                        permissions=permissions, grantable_permissions=grantable_permissions)
+            args["CatalogId"] = data_mesh_account_id
 
             self._logger.debug(args)
 
@@ -772,11 +1210,7 @@ class ApiAutomator:
         except lf_client.exceptions.from_code('AlreadyExistsException') as aee:
             return None
         except lf_client.exceptions.InvalidInputException as iie:
-            if "Permissions modification is invalid" in str(iie):
-                # this is an error thrown when you try to create the same permissions that already exist :(
-                return None
-            elif "Please revoke permission(s) for IAM_ALLOWED_PRINCIPALS on the table" in str(iie):
-                # this occurs because we are granting any IAM principal to describe the table, which means that the previous creation of the grant is already in place. ignore
+            if self._is_existing_grant_error(error_code=None, error_message=str(iie)):
                 return None
             else:
                 self._logger.error(
@@ -934,17 +1368,17 @@ class ApiAutomator:
         policy_sid = f"{BUCKET_POLICY_STATEMENT_SID}-{use_bucket_name}"
 
         # generate a new bucket policy from the template
-        s3_path = self._get_s3_path_prefix(access_path)
-        base_policy = json.loads(utils.generate_policy(template_file='producer_bucket_policy.pystache', config={
+        s3_path = access_path.replace('s3://', '')
+        base_policy = utils.generate_policy_dict(template_file='producer_bucket_policy.pystache', config={
             'account_id': principal_account,
             'access_path': s3_path,
             'sid': policy_sid
-        }))
+        })
 
         if bucket_policy is None:
             generated_policy = {
                 "Version": "2012-10-17",
-                "Id": shortuuid.uuid(),
+                "Id": utils.generate_id(),
                 "Statement": [
                     base_policy
                 ]
@@ -991,6 +1425,8 @@ class ApiAutomator:
             return bucket_policy
 
     def _get_current_bucket_policy(self, s3_client, bucket_name: str):
+        import botocore.exceptions
+
         try:
             current_policy = s3_client.get_bucket_policy(Bucket=bucket_name)
             return current_policy
@@ -1000,26 +1436,17 @@ class ApiAutomator:
             else:
                 raise ce
 
-    def add_bucket_policy_entry(self, principal_account: str, access_path: str):
-        s3_client = self._get_client('s3')
-
-        bucket_name = self._get_bucket_name(access_path)
-
-        # get the existing policy, if there is one
-        current_policy = self._get_current_bucket_policy(s3_client, bucket_name)
-
-        bucket_policy = None
-        if current_policy is not None:
-            bucket_policy = json.loads(current_policy.get('Policy'))
-
-        # transform the existing or None policy into the desired target lakeformation policy
-        new_policy = self._transform_bucket_policy(
-            bucket_policy=bucket_policy, principal_account=principal_account,
-            access_path=access_path
-        )
+    def bucket_policy_manager(self) -> BucketPolicyManager:
+        '''
+        Create a manager which collects bucket policy entries and applies them with one read and write per bucket
+        :return:
+        '''
+        return BucketPolicyManager(automator=self, logger=self._logger)
 
-        # put the policy back into the bucket store
-        s3_client.put_bucket_policy(Bucket=bucket_name, Policy=json.dumps(new_policy))
+    def add_bucket_policy_entry(self, principal_account: str, access_path: str):
+        policies = self.bucket_policy_manager()
+        policies.add(principal_account=principal_account, access_path=access_path)
+        policies.apply()
 
     def accept_pending_lf_resource_shares(self, sender_account: str, filter_resource_arn: str = None):
         ram_client = self._get_client('ram')
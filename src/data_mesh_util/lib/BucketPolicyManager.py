@@ -0,0 +1,78 @@
+import copy
+import json
+import threading
+
+
+class BucketPolicyManager:
+    '''
+    Collects principal and path grants for S3 bucket policies, and applies them with a single read-transform-write per
+    bucket. Buckets whose policy is unchanged by the grants are not written
+    '''
+    _automator = None
+    _logger = None
+    _entries = None
+    _lock = None
+
+    def __init__(self, automator, logger):
+        self._automator = automator
+        self._logger = logger
+        # map of bucket name to the list of (principal account, access path) grants to apply
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, principal_account: str, access_path: str) -> None:
+        '''
+        Add a grant allowing the LakeFormation service linked role of the principal account to read the access path
+        :param principal_account:
+        :param access_path:
+        :return:
+        '''
+        bucket_name = self._automator._get_bucket_name(access_path)
+        with self._lock:
+            bucket_entries = self._entries.setdefault(bucket_name, [])
+            if (principal_account, access_path) not in bucket_entries:
+                bucket_entries.append((principal_account, access_path))
+
+    def apply(self) -> dict:
+        '''
+        Apply all pending grants, one bucket at a time
+        :return: Dictionary of bucket name to True if the bucket policy was written, or False if it was unchanged
+        '''
+        with self._lock:
+            pending = self._entries
+            self._entries = {}
+
+        s3_client = self._automator._get_client('s3')
+
+        result = {}
+        for bucket_name, bucket_entries in pending.items():
+            # bucket policies are read-modify-write, so don't let concurrent writers overwrite each other
+            with self._automator._bucket_policy_lock:
+                # get the existing policy, if there is one
+                current_policy = self._automator._get_current_bucket_policy(s3_client, bucket_name)
+
+                bucket_policy = None
+                if current_policy is not None:
+                    bucket_policy = json.loads(current_policy.get('Policy'))
+                original_policy = copy.deepcopy(bucket_policy)
+
+                # transform the existing or None policy into the desired target lakeformation policy
+                new_policy = bucket_policy
+                for principal_account, access_path in bucket_entries:
+                    new_policy = self._automator._transform_bucket_policy(
+                        bucket_policy=new_policy, principal_account=principal_account,
+                        access_path=access_path
+                    )
+
+                if new_policy == original_policy:
+                    self._logger.info(f"Bucket Policy for {bucket_name} already contains all grants. No action required.")
+                    result[bucket_name] = False
+                else:
+                    # put the policy back into the bucket store
+                    s3_client.put_bucket_policy(Bucket=bucket_name, Policy=json.dumps(new_policy))
+                    result[bucket_name] = True
+
+        return result
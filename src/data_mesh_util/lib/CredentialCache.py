@@ -0,0 +1,185 @@
+import datetime
+import json
+import os
+import tempfile
+import threading
+
+from data_mesh_util.lib.constants import *
+
+
+class CredentialCache:
+    '''
+    Caches assumed role credentials by (source identity, role ARN), so that unexpired credentials are reused rather than
+    calling sts:AssumeRole again. Credentials are returned as botocore RefreshableCredentials, which assume the role again
+    shortly before they expire. Credentials may optionally be persisted to a Fernet encrypted file, so they can be
+    reused across processes
+    '''
+    _entries = None
+    _lock = None
+    _cache_file = None
+    _fernet = None
+    _loaded = False
+    _logger = None
+
+    def __init__(self, cache_file: str = None, encryption_key: str = None, logger=None):
+        '''
+        :param cache_file: Path of the encrypted file to persist credentials to, or None to only cache in memory
+        :param encryption_key: Fernet key used to encrypt the cache file. Defaults to the value of the
+        DATA_MESH_CREDENTIAL_CACHE_KEY environment variable
+        :param logger:
+        '''
+        # map of (source identity, role arn) to credential metadata
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._logger = logger
+
+        if cache_file is not None:
+            try:
+                from cryptography.fernet import Fernet
+            except ImportError:
+                # persisting credentials to disk is optional, and requires the cryptography module
+                raise Exception("Persisting the Credential Cache requires the cryptography module")
+
+            use_key = encryption_key if encryption_key is not None else os.getenv(CREDENTIAL_CACHE_KEY_ENV)
+            if use_key is None:
+                raise Exception(
+                    f"Persisting the Credential Cache requires an encryption key, or environment variable {CREDENTIAL_CACHE_KEY_ENV}")
+
+            self._cache_file = cache_file
+            self._fernet = Fernet(use_key)
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _is_current(metadata: dict) -> bool:
+        expiry = datetime.datetime.fromisoformat(metadata.get('expiry_time').replace('Z', '+00:00'))
+        # botocore refreshes credentials 15 minutes before they expire, so these must be replaced rather than reused
+        return expiry - datetime.timedelta(seconds=CREDENTIAL_REFRESH_MARGIN_SECONDS) > datetime.datetime.now(
+            tz=datetime.timezone.utc)
+
+    @staticmethod
+    def _to_metadata(credentials: dict) -> dict:
+        expiry = credentials.get('Expiration')
+        return {
+            'access_key': credentials.get('AccessKeyId'),
+            'secret_key': credentials.get('SecretAccessKey'),
+            'token': credentials.get('SessionToken'),
+            'expiry_time': expiry.isoformat() if isinstance(expiry, datetime.datetime) else expiry
+        }
+
+    @staticmethod
+    def _key(source_identity: str, role_arn: str) -> str:
+        return f"{source_identity}|{role_arn}"
+
+    def _load(self) -> None:
+        # must be called holding the lock
+        if self._loaded or self._cache_file is None:
+            return
+
+        self._loaded = True
+        if not os.path.exists(self._cache_file):
+            return
+
+        from cryptography.fernet import InvalidToken
+        try:
+            with open(self._cache_file, 'rb') as f:
+                stored = json.loads(self._fernet.decrypt(f.read()))
+        except (InvalidToken, ValueError):
+            # written with a different key or corrupt, so it will be overwritten
+            if self._logger is not None:
+                self._logger.debug(f"Ignoring unreadable Credential Cache {self._cache_file}")
+            return
+
+        for k, v in stored.items():
+            if self._is_current(v):
+                self._entries.setdefault(k, v)
+
+    def _persist(self) -> None:
+        # must be called holding the lock
+        if self._cache_file is None:
+            return
+
+        current = {k: v for k, v in self._entries.items() if self._is_current(v)}
+        cache_dir = os.path.dirname(os.path.abspath(self._cache_file))
+        os.makedirs(cache_dir, exist_ok=True)
+
+        # write and rename, so concurrent processes never read a partial file
+        fd, tmp = tempfile.mkstemp(dir=cache_dir)
+        try:
+            os.chmod(tmp, 0o600)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(self._fernet.encrypt(json.dumps(current).encode('utf-8')))
+            os.replace(tmp, self._cache_file)
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def get(self, source_identity: str, role_arn: str) -> dict:
+        '''
+        Get cached credential metadata which won't expire shortly
+        :param source_identity:
+        :param role_arn:
+        :return: Metadata in the format used by botocore RefreshableCredentials, or None
+        '''
+        with self._lock:
+            self._load()
+            metadata = self._entries.get(self._key(source_identity, role_arn))
+
+            if metadata is not None and self._is_current(metadata):
+                return metadata
+            else:
+                return None
+
+    def put(self, source_identity: str, role_arn: str, credentials: dict) -> dict:
+        '''
+        Add the Credentials returned by sts:AssumeRole to the cache
+        :param source_identity:
+        :param role_arn:
+        :param credentials:
+        :return: Metadata in the format used by botocore RefreshableCredentials
+        '''
+        metadata = self._to_metadata(credentials)
+        with self._lock:
+            self._load()
+            self._entries[self._key(source_identity, role_arn)] = metadata
+            self._persist()
+
+        return metadata
+
+    def invalidate(self, source_identity: str = None, role_arn: str = None) -> None:
+        '''
+        Remove cached credentials for a source identity and role, or all credentials if neither is provided
+        '''
+        with self._lock:
+            self._load()
+            if source_identity is None and role_arn is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(self._key(source_identity, role_arn), None)
+            self._persist()
+
+    def assume_role(self, sts_client, source_identity: str, role_arn: str, session_name: str):
+        '''
+        Get credentials for a role, assuming it only if there are no current credentials in the cache
+        :param sts_client: STS Client for the source identity, which is used to assume the role and to refresh it
+        :param source_identity: ARN of the identity assuming the role
+        :param role_arn:
+        :param session_name:
+        :return: botocore RefreshableCredentials
+        '''
+        from botocore.credentials import RefreshableCredentials
+
+        def _refresh() -> dict:
+            metadata = self.get(source_identity, role_arn)
+            if metadata is None:
+                if self._logger is not None:
+                    self._logger.debug(f"Assuming Role {role_arn} from {source_identity}")
+                response = sts_client.assume_role(RoleArn=role_arn, RoleSessionName=session_name)
+                metadata = self.put(source_identity, role_arn, response.get('Credentials'))
+
+            return metadata
+
+        return RefreshableCredentials.create_from_metadata(metadata=_refresh(), refresh_using=_refresh,
+                                                           method='assume-role')
@@ -0,0 +1,161 @@
+import collections
+
+GlueArn = collections.namedtuple('GlueArn', ['partition', 'service', 'region', 'account', 'resource_type', 'resource'])
+
+
+class GlueResourcePolicy:
+    '''
+    Parsed model of a Glue Catalog resource policy. Statements are indexed by (principal, region, account, database)
+    parsed from their database ARNs, and each statement's resources are held in a set, so that finding a consumer's
+    statement and adding tables to it doesn't require scanning the whole policy
+    '''
+    _document = None
+    _statements = None
+    _resource_sets = None
+    _index = None
+
+    def __init__(self, policy: dict = None):
+        # top level policy elements other than the statements are carried through unchanged
+        self._document = {"Version": "2012-10-17"}
+        if policy is not None:
+            self._document.update({k: v for k, v in policy.items() if k != 'Statement'})
+        self._statements = []
+        self._resource_sets = []
+        self._index = {}
+
+        for statement in [] if policy is None else policy.get('Statement', []):
+            self.append_statement(statement)
+
+    def __len__(self):
+        return len(self._statements)
+
+    @staticmethod
+    def parse_arn(arn: str):
+        '''
+        Parse a Glue resource ARN such as arn:aws:glue:<region>:<account-id>:table/<database>/<table>
+        :param arn:
+        :return: GlueArn, or None if the value is not an ARN
+        '''
+        if not isinstance(arn, str):
+            return None
+
+        tokens = arn.split(':', 5)
+        if len(tokens) != 6 or tokens[0] != 'arn':
+            return None
+
+        resource_type, _, resource = tokens[5].partition('/')
+        return GlueArn(tokens[1], tokens[2], tokens[3], tokens[4], resource_type, resource)
+
+    @staticmethod
+    def statement_principals(statement: dict) -> list:
+        principal = statement.get('Principal') if statement is not None else None
+        if not isinstance(principal, dict):
+            return []
+
+        principals = principal.get('AWS', [])
+        return principals if isinstance(principals, list) else [principals]
+
+    @staticmethod
+    def _resources(statement: dict) -> list:
+        resources = statement.get('Resource', [])
+        return resources if isinstance(resources, list) else [resources]
+
+    def _statement_keys(self, statement: dict, resources: set) -> list:
+        # only database resources are parsed, as ARNs are compared by value everywhere else
+        databases = [(arn.region, arn.account, arn.resource) for arn in
+                     (self.parse_arn(r) for r in resources if ':database/' in r) if
+                     arn is not None and arn.resource_type == 'database']
+        return [(principal, region, account, database) for principal in self.statement_principals(statement) for
+                (region, account, database) in databases]
+
+    def append_statement(self, statement: dict) -> int:
+        '''
+        Add a statement to the end of the policy, removing any duplicate resources it contains
+        :param statement:
+        :return: The position of the statement in the policy
+        '''
+        position = len(self._statements)
+        resource_set = set()
+        if statement is not None and 'Resource' in statement:
+            resources = []
+            for r in self._resources(statement):
+                if r not in resource_set:
+                    resource_set.add(r)
+                    resources.append(r)
+            statement['Resource'] = resources
+
+        self._statements.append(statement)
+        self._resource_sets.append(resource_set)
+
+        if statement is not None:
+            for key in self._statement_keys(statement, resource_set):
+                self._index.setdefault(key, []).append(position)
+
+        return position
+
+    def find_statement(self, principal: str, region: str, account: str, database: str, matches=None):
+        '''
+        Find the statement which grants the principal access to the database
+        :param principal:
+        :param region:
+        :param account:
+        :param database:
+        :param matches: Function returning True for statements which may be returned, such as those with a particular
+        Effect and Action
+        :return: The position of the first matching statement in the policy, or None if there is no match
+        '''
+        for position in self._index.get((principal, region, account, database), []):
+            if matches is None or matches(self._statements[position]):
+                return position
+
+        return None
+
+    def get_statement(self, position: int) -> dict:
+        return self._statements[position]
+
+    def add_resources(self, position: int, resources: list) -> bool:
+        '''
+        Add resources to a statement, ignoring any it already contains
+        :param position:
+        :param resources:
+        :return: True if the statement was modified
+        '''
+        statement = self._statements[position]
+        resource_set = self._resource_sets[position]
+        modified = False
+        for r in resources if resources is not None else []:
+            if r not in resource_set:
+                resource_set.add(r)
+                statement['Resource'].append(r)
+                modified = True
+
+        return modified
+
+    def compact(self, is_mergeable) -> int:
+        '''
+        Fold statements for the same principal and database into the first such statement
+        :param is_mergeable: Function returning True for statements which may be folded together. It must only accept
+        statements with the same Effect, Action and Condition, as these are taken from the first statement
+        :return: Number of statements which were removed
+        '''
+        retained = []
+        targets = {}
+        for statement, resource_set in zip(self._statements, self._resource_sets):
+            if statement is not None and is_mergeable(statement):
+                keys = self._statement_keys(statement, resource_set)
+                if len(keys) == 1:
+                    if keys[0] in targets:
+                        targets[keys[0]].extend(self._resources(statement))
+                        continue
+                    targets[keys[0]] = self._resources(statement)
+
+            retained.append(statement)
+
+        removed = len(self._statements) - len(retained)
+        if removed > 0:
+            self.__init__({**self._document, 'Statement': retained})
+
+        return removed
+
+    def to_dict(self) -> dict:
+        return {**self._document, "Statement": self._statements}
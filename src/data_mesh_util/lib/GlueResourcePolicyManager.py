@@ -0,0 +1,143 @@
+import json
+import random
+import time
+
+import data_mesh_util.lib.utils as utils
+from data_mesh_util.lib.GlueResourcePolicy import GlueResourcePolicy
+from data_mesh_util.lib.constants import *
+
+
+class GlueResourcePolicyManager:
+    '''
+    Collects consumer grants for the Glue Catalog resource policy, and applies them for all consumers with a single
+    write. Writes are conditional on the hash of the policy which was read, and are re-read and re-merged when another
+    writer has changed the policy in the meantime
+    '''
+    _automator = None
+    _region = None
+    _producer_account_id = None
+    _logger = None
+    _pending = None
+    _managed_template = None
+
+    def __init__(self, automator, region: str, producer_account_id: str, logger):
+        self._automator = automator
+        self._region = region
+        self._producer_account_id = producer_account_id
+        self._logger = logger
+        # map of (consumer account, database) to the list of table resources to add
+        self._pending = {}
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, consumer_account_id: str, database_name: str, tables: list = None) -> None:
+        '''
+        Add a consumer grant to be applied on the next call to apply()
+        :param consumer_account_id:
+        :param database_name:
+        :param tables: List of table ARNs to add to the consumer's statement
+        :return:
+        '''
+        pending_tables = self._pending.setdefault((consumer_account_id, database_name), [])
+        for t in tables if tables is not None else []:
+            if t not in pending_tables:
+                pending_tables.append(t)
+
+    def _new_statement(self, consumer_account_id: str, database_name: str, tables: list) -> dict:
+        return utils.generate_policy_dict('lf_cross_account_tbac.pystache', config={
+            'region': self._region,
+            'producer_account_id': self._producer_account_id,
+            'consumer_account_id': consumer_account_id,
+            'database_name': database_name,
+            'table_list': tables
+        })
+
+    @staticmethod
+    def _as_list(value) -> list:
+        return sorted(value) if isinstance(value, list) else [value]
+
+    def _is_managed_statement(self, statement: dict) -> bool:
+        # statements created from the lf_cross_account_tbac template grant a single consumer access by tag. Statements
+        # with any other Effect, Action or Condition were written by someone else, and are never merged or extended
+        if self._managed_template is None:
+            self._managed_template = self._new_statement('', '', [])
+
+        return statement.get('Effect') == self._managed_template.get('Effect') and \
+            self._as_list(statement.get('Action')) == self._as_list(self._managed_template.get('Action')) and \
+            statement.get('Condition') == self._managed_template.get('Condition') and \
+            'NotAction' not in statement and 'NotResource' not in statement and \
+            len(GlueResourcePolicy.statement_principals(statement)) == 1
+
+    def _merge(self, policy: dict) -> dict:
+        # managed statements for the same consumer and database are folded together, and statements which weren't
+        # created by this utility are left untouched
+        model = GlueResourcePolicy(policy)
+        model.compact(self._is_managed_statement)
+
+        for (consumer_account_id, database_name), tables in self._pending.items():
+            # adds any missing tables to the consumer's existing statement for the database
+            position = model.find_statement(principal=consumer_account_id, region=self._region,
+                                            account=self._producer_account_id, database=database_name,
+                                            matches=self._is_managed_statement)
+            if position is None:
+                model.append_statement(self._new_statement(consumer_account_id, database_name, tables))
+            else:
+                model.add_resources(position, tables)
+
+        return model.to_dict()
+
+    def apply(self, max_retries: int = MAX_API_RETRIES) -> bool:
+        '''
+        Merge all pending consumer grants into the Glue Catalog resource policy and write it once
+        :param max_retries: Number of times to re-read and re-merge the policy if it was changed by another writer
+        :return: True if the policy was written, False if it already contained all grants
+        '''
+        if len(self._pending) == 0:
+            return False
+
+        glue_client = self._automator._get_client('glue')
+
+        retries = 0
+        while True:
+            current_resource_policy = None
+            try:
+                current_resource_policy = glue_client.get_resource_policy()
+            except glue_client.exceptions.EntityNotFoundException:
+                pass
+
+            current_policy = None
+            args = {'EnableHybrid': 'TRUE'}
+            if current_resource_policy is None or current_resource_policy.get('PolicyInJson') is None:
+                args['PolicyExistsCondition'] = 'NOT_EXIST'
+            else:
+                current_policy = json.loads(current_resource_policy.get('PolicyInJson'))
+                args['PolicyExistsCondition'] = 'MUST_EXIST'
+                args['PolicyHashCondition'] = current_resource_policy.get('PolicyHash')
+
+            new_policy = self._merge(json.loads(json.dumps(current_policy)) if current_policy is not None else None)
+            if new_policy == current_policy:
+                self._logger.info(
+                    f"Catalog Resource Policy on {self._producer_account_id} already allows all {len(self._pending)} consumer grants")
+                self._pending = {}
+                return False
+
+            args['PolicyInJson'] = json.dumps(new_policy)
+            if len(args['PolicyInJson'].encode('utf-8')) > GLUE_RESOURCE_POLICY_MAX_BYTES:
+                raise Exception(
+                    f"Catalog Resource Policy on {self._producer_account_id} would exceed {GLUE_RESOURCE_POLICY_MAX_BYTES} bytes")
+
+            try:
+                glue_client.put_resource_policy(**args)
+                self._logger.info(
+                    f"Updated Catalog Resource Policy on {self._producer_account_id} allowing Tag Based Access by {sorted({k[0] for k in self._pending.keys()})}")
+                self._pending = {}
+                return True
+            except glue_client.exceptions.ConditionCheckFailureException as ccfe:
+                # another writer changed the policy since we read it, so re-read and merge again
+                if retries >= max_retries:
+                    raise ccfe
+                retries += 1
+                backoff = min(2 ** retries * 0.1, 5)
+                self._logger.info(f"Catalog Resource Policy changed during update. Retrying in {backoff:.1f}s")
+                time.sleep(backoff + random.uniform(0, backoff))
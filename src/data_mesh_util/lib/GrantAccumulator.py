@@ -0,0 +1,95 @@
+import json
+
+from data_mesh_util.lib.constants import *
+import data_mesh_util.lib.utils as utils
+
+
+class GrantAccumulator:
+    '''
+    Collects LakeFormation grants and applies them in BatchGrantPermissions calls. Each grant is identified by the ID
+    returned from add(), which can be used to find its outcome in the result of flush()
+    '''
+    _automator = None
+    _catalog_id = None
+    _logger = None
+    _entries = None
+    _entry_ids = None
+
+    def __init__(self, automator, catalog_id: str, logger):
+        self._automator = automator
+        self._catalog_id = catalog_id
+        self._logger = logger
+        self._entries = []
+        self._entry_ids = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, principal: str, database_name: str, table_name: str = None, permissions: list = ['ALL'],
+            grantable_permissions: list = None) -> str:
+        '''
+        Add a grant to be applied on the next flush. Identical grants are only applied once, and return the same ID
+        :param principal:
+        :param database_name:
+        :param table_name:
+        :param permissions:
+        :param grantable_permissions:
+        :return: ID of the grant entry
+        '''
+        grant = self._automator._build_lf_grant(data_mesh_account_id=self._catalog_id, principal=principal,
+                                                database_name=database_name, table_name=table_name,
+                                                permissions=list(permissions),
+                                                grantable_permissions=grantable_permissions)
+        grant_key = json.dumps(grant, sort_keys=True)
+
+        entry_id = self._entry_ids.get(grant_key)
+        if entry_id is None:
+            entry_id = utils.generate_id()
+            grant['Id'] = entry_id
+            self._entries.append(grant)
+            self._entry_ids[grant_key] = entry_id
+
+        return entry_id
+
+    def flush(self, raise_on_failure: bool = True) -> dict:
+        '''
+        Apply all pending grants in batches
+        :param raise_on_failure: Raise an Exception after all batches have been sent if any grant failed
+        :return: Dictionary of Granted and Suppressed (already existing) grant IDs, and Failed grant IDs to error
+        '''
+        lf_client = self._automator._get_client('lakeformation')
+
+        result = {GRANTS_GRANTED: [], GRANTS_SUPPRESSED: [], GRANTS_FAILED: {}}
+        pending = self._entries
+        self._entries = []
+        self._entry_ids = {}
+
+        for i in range(0, len(pending), LF_GRANT_BATCH_SIZE):
+            batch = pending[i:i + LF_GRANT_BATCH_SIZE]
+            response = lf_client.batch_grant_permissions(
+                CatalogId=self._catalog_id,
+                Entries=batch
+            )
+
+            failed_ids = set()
+            for f in response.get('Failures', []):
+                entry_id = f.get('RequestEntry').get('Id')
+                error = f.get('Error', {})
+                failed_ids.add(entry_id)
+                if self._automator._is_existing_grant_error(error_code=error.get('ErrorCode'),
+                                                            error_message=error.get('ErrorMessage', '')):
+                    result[GRANTS_SUPPRESSED].append(entry_id)
+                else:
+                    result[GRANTS_FAILED][entry_id] = f"{error.get('ErrorCode')}: {error.get('ErrorMessage')}"
+                    self._logger.error(
+                        f"Exception while granting LakeFormation Permissions {f.get('RequestEntry')}: {error}")
+
+            result[GRANTS_GRANTED].extend([e.get('Id') for e in batch if e.get('Id') not in failed_ids])
+
+        self._logger.info(
+            f"Granted {len(result[GRANTS_GRANTED])} LakeFormation Permissions in {-(-len(pending) // LF_GRANT_BATCH_SIZE)} batches ({len(result[GRANTS_SUPPRESSED])} already existed, {len(result[GRANTS_FAILED])} failed)")
+
+        if raise_on_failure is True and len(result[GRANTS_FAILED]) > 0:
+            raise Exception(f"Unable to apply LakeFormation Grants {result[GRANTS_FAILED]}")
+
+        return result
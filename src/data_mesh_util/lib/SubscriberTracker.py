@@ -1,9 +1,12 @@
+import copy
+import json
 import logging
-import sys
+import queue
 import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from data_mesh_util.lib.constants import *
-from boto3.dynamodb.conditions import Attr, Or, And, Key
-import shortuuid
 from datetime import datetime
 import data_mesh_util.lib.utils as utils
 from enum import Enum
@@ -29,6 +32,16 @@ TABLE_ARNS = 'GrantedTableARNs'
 RAM_SHARES = 'RamShares'
 NOTES = 'Notes'
 
+# secondary indexes as (index suffix, hash key, range key). Where more than one index can serve a query equally well,
+# the first in this list is used, so owner queries without a status are returned in order of creation
+SECONDARY_INDEXES = [
+    ('SubscriberStatus', SUBSCRIBER_PRINCIPAL, STATUS),
+    ('OwnerCreated', OWNER_PRINCIPAL, CREATION_DATE),
+    ('Owner', OWNER_PRINCIPAL, STATUS),
+    ('Subscriber', SUBSCRIBER_PRINCIPAL, None),
+    ('Database', DATABASE_NAME, None)
+]
+
 
 class SubType(Enum):
     DATABASE = 1
@@ -37,8 +50,18 @@ class SubType(Enum):
     DOMAIN = 4
 
 
-def _generate_id():
-    return shortuuid.uuid()
+def _generate_id(name: str = None):
+    return utils.generate_id(name=name)
+
+
+def _subscription_key(principal: str, owner_account_id: str, subscription_type, database_name: str = None,
+                      tables: list = None, domain: str = None, data_product_name: str = None,
+                      request_grants: list = None) -> str:
+    # canonical form of a request, so that the same request always generates the same subscription id
+    return json.dumps([principal, owner_account_id, None if subscription_type is None else subscription_type.name,
+                       database_name,
+                       sorted(tables) if tables is not None else None, domain, data_product_name,
+                       sorted(request_grants) if request_grants is not None else None])
 
 
 def _format_time_now():
@@ -55,6 +78,9 @@ class SubscriberTracker:
     _table = None
     _logger = None
     _region = None
+    _credentials = None
+    _active_indexes = None
+    _cache = None
 
     def __init__(self, credentials, data_mesh_account_id: str, region_name: str, log_level: str = "INFO"):
         '''
@@ -65,6 +91,7 @@ class SubscriberTracker:
         '''
         self._data_mesh_account_id = data_mesh_account_id
         self._region = region_name
+        self._credentials = credentials
         self._dynamo_client = utils.generate_client(service='dynamodb', region=region_name,
                                                     credentials=credentials)
         self._dynamo_resource = utils.generate_resource(service='dynamodb', region=region_name,
@@ -79,16 +106,14 @@ class SubscriberTracker:
         # validate that we are running from within the mesh
         utils.validate_correct_account(credentials=credentials, account_id=data_mesh_account_id)
 
-        self._table_info = self._init_table()
-
-        _logger = logging.getLogger("SubscriberTracker")
-
         # make sure we always log to standard out
-        _logger.addHandler(logging.StreamHandler(sys.stdout))
-        _logger.setLevel(log_level)
+        self._logger = utils.configure_logger(logging.getLogger("SubscriberTracker"), log_level)
+
+        self._table_info = self._init_table()
 
     def _who_am_i(self):
-        return self._sts_client.get_caller_identity().get('Arn')
+        # cached for the credentials, so writes don't call sts:GetCallerIdentity
+        return utils.whoami(credentials=self._credentials, region=self._region).get('Arn')
 
     def _add_www(self, item: dict, new: bool = True, notes: str = None):
         '''
@@ -137,8 +162,12 @@ class SubscriberTracker:
             )
 
             t = response.get('Table')
+
+            # tables created by earlier versions won't have all the secondary indexes until migrate_indexes is run
+            self._active_indexes = self._read_active_indexes(t)
         except self._dynamo_client.exceptions.ResourceNotFoundException:
             t = self._create_table()
+            self._active_indexes = set(self._indexname(i[0]) for i in SECONDARY_INDEXES)
 
         self._table = self._dynamo_resource.Table(SUBSCRIPTIONS_TRACKER_TABLE)
 
@@ -147,69 +176,109 @@ class SubscriberTracker:
             'Stream': t.get('LatestStreamArn')
         }
 
+    def _indexname(self, suffix: str):
+        return "%s-%s" % (SUBSCRIPTIONS_TRACKER_TABLE, suffix)
+
     def subscriber_indexname(self):
-        return "%s-%s" % (SUBSCRIPTIONS_TRACKER_TABLE, 'Subscriber')
+        return self._indexname('Subscriber')
 
     def owner_indexname(self):
-        return "%s-%s" % (SUBSCRIPTIONS_TRACKER_TABLE, 'Owner')
+        return self._indexname('Owner')
+
+    def subscriber_status_indexname(self):
+        return self._indexname('SubscriberStatus')
+
+    def database_indexname(self):
+        return self._indexname('Database')
+
+    def owner_created_indexname(self):
+        return self._indexname('OwnerCreated')
+
+    def _index_definition(self, suffix: str, hash_key: str, range_key: str = None) -> dict:
+        key_schema = [{
+            'AttributeName': hash_key,
+            'KeyType': 'HASH'
+        }]
+        if range_key is not None:
+            key_schema.append({
+                'AttributeName': range_key,
+                'KeyType': 'RANGE'
+            })
+
+        return {
+            'IndexName': self._indexname(suffix),
+            'KeySchema': key_schema,
+            'Projection': {
+                'ProjectionType': 'ALL'
+            }
+        }
+
+    def _attribute_definitions(self, indexes: list) -> list:
+        attributes = [SUBSCRIPTION_ID]
+        for (suffix, hash_key, range_key) in indexes:
+            for a in [hash_key, range_key]:
+                if a is not None and a not in attributes:
+                    attributes.append(a)
+
+        return [{'AttributeName': a, 'AttributeType': 'S'} for a in attributes]
+
+    def _read_active_indexes(self, table: dict) -> set:
+        index_status = {i.get('IndexName'): i.get('IndexStatus') for i in table.get('GlobalSecondaryIndexes', [])}
+        missing = [self._indexname(i[0]) for i in SECONDARY_INDEXES if self._indexname(i[0]) not in index_status]
+        if len(missing) > 0:
+            self._logger.info(f"{SUBSCRIPTIONS_TRACKER_TABLE} is missing Indexes {missing}, which are created by "
+                              f"DataMeshAdmin.migrate_subscription_indexes")
+
+        return set(k for k, v in index_status.items() if v == 'ACTIVE')
+
+    def migrate_indexes(self) -> list:
+        '''
+        Create any secondary indexes which are missing from a table created by an earlier version. DynamoDB only allows
+        one index to be created at a time, so at most one is added per call, and the rest are added by later calls once
+        it has been backfilled. Queries only use indexes which are ACTIVE
+        :return: Names of the indexes which were created
+        '''
+        import botocore.exceptions
+
+        table = self._dynamo_client.describe_table(TableName=SUBSCRIPTIONS_TRACKER_TABLE).get('Table')
+        index_status = {i.get('IndexName'): i.get('IndexStatus') for i in table.get('GlobalSecondaryIndexes', [])}
+        self._active_indexes = self._read_active_indexes(table)
+
+        missing = [i for i in SECONDARY_INDEXES if self._indexname(i[0]) not in index_status]
+        if len(missing) == 0:
+            return []
+        if table.get('TableStatus') != 'ACTIVE' or len(self._active_indexes) != len(index_status):
+            self._logger.info(f"Waiting for {SUBSCRIPTIONS_TRACKER_TABLE} to finish updating before creating Index "
+                              f"{self._indexname(missing[0][0])}")
+            return []
+
+        create = missing[0]
+        try:
+            self._dynamo_client.update_table(
+                TableName=SUBSCRIPTIONS_TRACKER_TABLE,
+                AttributeDefinitions=self._attribute_definitions([create]),
+                GlobalSecondaryIndexUpdates=[{'Create': self._index_definition(*create)}]
+            )
+            self._logger.info(f"Creating Index {self._indexname(create[0])} on {SUBSCRIPTIONS_TRACKER_TABLE}")
+
+            return [self._indexname(create[0])]
+        except botocore.exceptions.ClientError as e:
+            # queries continue to use the indexes which exist
+            self._logger.warning(f"Unable to create Index {self._indexname(create[0])}: {e}")
+
+            return []
 
     def _create_table(self):
         response = self._dynamo_client.create_table(
             TableName=SUBSCRIPTIONS_TRACKER_TABLE,
-            AttributeDefinitions=[
-                {
-                    'AttributeName': SUBSCRIPTION_ID,
-                    'AttributeType': 'S'
-                },
-                {
-                    'AttributeName': SUBSCRIBER_PRINCIPAL,
-                    'AttributeType': 'S'
-                },
-                {
-                    'AttributeName': OWNER_PRINCIPAL,
-                    'AttributeType': 'S'
-                },
-                {
-                    'AttributeName': STATUS,
-                    'AttributeType': 'S'
-                }
-            ],
+            AttributeDefinitions=self._attribute_definitions(SECONDARY_INDEXES),
             KeySchema=[
                 {
                     'AttributeName': SUBSCRIPTION_ID,
                     'KeyType': 'HASH'
                 }
             ],
-            GlobalSecondaryIndexes=[
-                {
-                    'IndexName': self.owner_indexname(),
-                    'KeySchema': [
-                        {
-                            'AttributeName': OWNER_PRINCIPAL,
-                            'KeyType': 'HASH',
-                        },
-                        {
-                            'AttributeName': STATUS,
-                            'KeyType': 'RANGE',
-                        }
-                    ],
-                    'Projection': {
-                        'ProjectionType': 'ALL'
-                    }
-                },
-                {
-                    'IndexName': self.subscriber_indexname(),
-                    'KeySchema': [
-                        {
-                            'AttributeName': SUBSCRIBER_PRINCIPAL,
-                            'KeyType': 'HASH',
-                        }
-                    ],
-                    'Projection': {
-                        'ProjectionType': 'ALL'
-                    }
-                }
-            ],
+            GlobalSecondaryIndexes=[self._index_definition(*i) for i in SECONDARY_INDEXES],
             BillingMode='PAY_PER_REQUEST',
             StreamSpecification={
                 'StreamEnabled': True,
@@ -227,6 +296,44 @@ class SubscriberTracker:
     def get_endpoints(self):
         return self._table_info
 
+    def enable_cache(self, max_size: int = SUBSCRIPTION_CACHE_SIZE,
+                     max_age_seconds: float = SUBSCRIPTION_CACHE_MAX_AGE_SECONDS, follow_stream: bool = True,
+                     stream_endpoint_url: str = None):
+        '''
+        Cache the subscriptions read by get_subscription() and get_subscriptions(). Writes made by this tracker
+        invalidate the cache, and by default so do changes read from the table's DynamoDB stream
+        :param max_size: Number of subscriptions to cache
+        :param max_age_seconds: Staleness bound, after which a cached subscription is read again
+        :param follow_stream: Invalidate subscriptions changed by other processes by tailing the table's stream
+        :param stream_endpoint_url: Endpoint of DynamoDB Streams, such as a local DynamoDB
+        :return: SubscriptionCache
+        '''
+        from data_mesh_util.lib.SubscriptionCache import SubscriptionCache
+
+        if self._cache is not None:
+            self._cache.stop()
+
+        self._cache = SubscriptionCache(max_size=max_size, max_age_seconds=max_age_seconds, logger=self._logger)
+
+        if follow_stream:
+            if self._table_info.get('Stream') is None:
+                raise Exception(f"Table {SUBSCRIPTIONS_TRACKER_TABLE} does not have a Stream")
+
+            streams_client = utils.generate_client(service='dynamodbstreams', region=self._region,
+                                                   credentials=self._credentials, endpoint_url=stream_endpoint_url)
+            self._cache.follow_stream(streams_client=streams_client, stream_arn=self._table_info.get('Stream'))
+
+        return self._cache
+
+    def disable_cache(self):
+        if self._cache is not None:
+            self._cache.stop()
+            self._cache = None
+
+    def _invalidate_cached(self, subscription_id: str):
+        if self._cache is not None:
+            self._cache.invalidate(subscription_id)
+
     def _validate_objects(self, database_name: str, tables: list, suppress_object_validation: bool = False):
         for table_name in tables:
             # validate if the table exists
@@ -256,83 +363,59 @@ class SubscriberTracker:
                 # if we get access denied here, it's because the object doesn't exist
                 return False
 
-    def create_subscription_request(self, owner_account_id: str, principal: str,
-                                    request_grants: list, domain=None, data_product_name=None,
-                                    database_name: str = None, tables: list = None,
-                                    suppress_object_validation: bool = False) -> dict:
-        # look up if there is already a subscription request for this object
-        subscription_type = None
+    def _subscription_type(self, domain: str = None, data_product_name: str = None, database_name: str = None,
+                           tables: list = None):
         if database_name is not None:
-            filter = Attr(DATABASE_NAME).eq(database_name)
             if tables is None:
-                subscription_type = SubType.DATABASE
+                return SubType.DATABASE
             else:
-                subscription_type = SubType.TABLE
+                return SubType.TABLE
         elif data_product_name is not None:
-            filter = And(Attr(DATA_PRODUCT_TAG_KEY).eq(data_product_name))
-            subscription_type = SubType.DATA_PRODUCT
+            return SubType.DATA_PRODUCT
         elif domain is not None:
-            filter = And(Attr(DOMAIN_TAG_KEY).eq(domain))
-            subscription_type = SubType.DOMAIN
-
-        def _sub_exists():
-            found = self._table.query(
-                IndexName=self.subscriber_indexname(),
-                Select='ALL_ATTRIBUTES',
-                ConsistentRead=False,
-                KeyConditionExpression=Key(SUBSCRIBER_PRINCIPAL).eq(principal),
-                FilterExpression=filter
-            )
-
-            for i in found.get('Items'):
-                if (subscription_type == SubType.TABLE and tables == i.get(TABLE_NAME)) and request_grants == i.get(
-                        REQUESTED_GRANTS):
-                    return i
-
+            return SubType.DOMAIN
+        else:
             return None
 
-        def _put_subscription(item: dict):
-            item = self._add_www(item=item)
-
-            self._table.put_item(
-                Item=item
-            )
-
-        # check if a subscription already exists
-        subscription = _sub_exists()
+    def _subscription_id(self, owner_account_id: str, principal: str, request_grants: list, domain=None,
+                         data_product_name=None, database_name: str = None, tables: list = None) -> str:
+        '''
+        Generate the id of a subscription from the request, so that the same request always has the same id
+        '''
+        subscription_type = self._subscription_type(domain=domain, data_product_name=data_product_name,
+                                                    database_name=database_name, tables=tables)
+        return _generate_id(
+            name=_subscription_key(principal=principal, owner_account_id=owner_account_id,
+                                   subscription_type=subscription_type, database_name=database_name,
+                                   tables=tables, domain=domain, data_product_name=data_product_name,
+                                   request_grants=request_grants))
+
+    def _build_subscription(self, owner_account_id: str, principal: str, request_grants: list, domain=None,
+                            data_product_name=None, database_name: str = None, tables: list = None) -> tuple:
+        '''
+        Build the item for a subscription request, whose id is derived from the request
+        :return: Tuple of the item, and the response to return for the request
+        '''
+        subscription_type = self._subscription_type(domain=domain, data_product_name=data_product_name,
+                                                    database_name=database_name, tables=tables)
 
         # create the base subscription object to be inserted into DDB
         item = {
-            SUBSCRIPTION_ID: _generate_id() if subscription is None else subscription.get(SUBSCRIPTION_ID),
+            SUBSCRIPTION_ID: self._subscription_id(owner_account_id=owner_account_id, principal=principal,
+                                                   request_grants=request_grants, domain=domain,
+                                                   data_product_name=data_product_name, database_name=database_name,
+                                                   tables=tables),
             OWNER_PRINCIPAL: owner_account_id,
             SUBSCRIBER_PRINCIPAL: principal,
             REQUESTED_GRANTS: request_grants,
-            STATUS: STATUS_PENDING if subscription is None else subscription.get(STATUS)
+            STATUS: STATUS_PENDING
         }
 
-        sub_type = ()
-
-        def _return():
-            return {
-                "Type": subscription_type,
-                sub_type[0]: sub_type[1],
-                SUBSCRIPTION_ID: item.get(SUBSCRIPTION_ID)
-            }
-
         if subscription_type == SubType.DATABASE:
-            # validate that the database exists
-            exists = self._validate_object(database_name=database_name,
-                                           suppress_object_validation=suppress_object_validation)
-            if not exists:
-                raise Exception("Database %s does not exist" % (database_name))
-            else:
-                # create a database level subscription
-                item[DATABASE_NAME] = database_name
-                sub_type = DATABASE_NAME, database_name
+            # create a database level subscription
+            item[DATABASE_NAME] = database_name
+            sub_type = DATABASE_NAME, database_name
         elif subscription_type == SubType.TABLE:
-            # validate the table list
-            self._validate_objects(database_name=database_name, tables=tables,
-                                   suppress_object_validation=suppress_object_validation)
             item[DATABASE_NAME] = database_name
             item[TABLE_NAME] = tables
             sub_type = TABLE_NAME, tables
@@ -343,11 +426,284 @@ class SubscriberTracker:
         else:
             # create a data product level subscription
             item[DATA_PRODUCT_TAG_KEY] = data_product_name
-            _put_subscription(item=item, principal=principal)
             sub_type = DATA_PRODUCT_TAG_KEY, data_product_name
 
-        _put_subscription(item=item)
-        return _return()
+        return item, {
+            "Type": subscription_type,
+            sub_type[0]: sub_type[1],
+            SUBSCRIPTION_ID: item.get(SUBSCRIPTION_ID)
+        }
+
+    def create_subscription_request(self, owner_account_id: str, principal: str,
+                                    request_grants: list, domain=None, data_product_name=None,
+                                    database_name: str = None, tables: list = None,
+                                    suppress_object_validation: bool = False) -> dict:
+        item, response = self._build_subscription(owner_account_id=owner_account_id, principal=principal,
+                                                  request_grants=request_grants, domain=domain,
+                                                  data_product_name=data_product_name, database_name=database_name,
+                                                  tables=tables)
+        subscription_type = response.get("Type")
+
+        if subscription_type == SubType.DATABASE:
+            # validate that the database exists
+            exists = self._validate_object(database_name=database_name,
+                                           suppress_object_validation=suppress_object_validation)
+            if not exists:
+                raise Exception("Database %s does not exist" % (database_name))
+        elif subscription_type == SubType.TABLE:
+            # validate the table list
+            self._validate_objects(database_name=database_name, tables=tables,
+                                   suppress_object_validation=suppress_object_validation)
+
+        self._put_subscription(item=item)
+
+        return response
+
+    def _put_subscription(self, item: dict) -> bool:
+        '''
+        Write a new subscription, unless it has already been requested
+        :param item:
+        :return: True if the subscription was written
+        '''
+        from boto3.dynamodb.conditions import Attr, Or
+
+        written = True
+        try:
+            # the id is derived from the request, so a duplicate request is rejected by this write without a read.
+            # Subscriptions which have been deleted may be requested again
+            self._table.put_item(
+                Item=self._add_www(item=item),
+                ConditionExpression=Or(Attr(SUBSCRIPTION_ID).not_exists(), Attr(STATUS).eq(STATUS_DELETED))
+            )
+        except self._table.meta.client.exceptions.ConditionalCheckFailedException:
+            self._logger.debug(f"Subscription {item.get(SUBSCRIPTION_ID)} has already been requested")
+            written = False
+
+        self._invalidate_cached(item.get(SUBSCRIPTION_ID))
+
+        return written
+
+    def migrate_legacy_subscriptions(self, total_segments: int = 1) -> dict:
+        '''
+        Move subscriptions created before subscription ids were generated from the request to the id their request now
+        generates, so that requesting them again is rejected by the conditional write in create_subscription_request().
+        Each subscription is moved in a transaction which also removes the original, and subscriptions whose request
+        has already been made again under the new id are left in place. This is run once by a Data Mesh administrator
+        :param total_segments: Number of segments to scan in parallel
+        :return: Dictionary with Migrated, a map of original to new subscription id, and NotMigrated, a list of the
+        original ids which were left in place
+        '''
+        client = self._table.meta.client
+        migrated = {}
+        not_migrated = []
+        for existing in self.iter_subscriptions(total_segments=total_segments):
+            legacy_id = existing.get(SUBSCRIPTION_ID)
+            if existing.get(STATUS) == STATUS_DELETED:
+                continue
+
+            subscription_id = self._subscription_id(
+                owner_account_id=existing.get(OWNER_PRINCIPAL), principal=existing.get(SUBSCRIBER_PRINCIPAL),
+                request_grants=existing.get(REQUESTED_GRANTS), domain=existing.get(DOMAIN_TAG_KEY),
+                data_product_name=existing.get(DATA_PRODUCT_TAG_KEY), database_name=existing.get(DATABASE_NAME),
+                tables=existing.get(TABLE_NAME))
+            if subscription_id == legacy_id:
+                continue
+
+            try:
+                # condition objects aren't rewritten inside transactions, so the expressions are written out
+                client.transact_write_items(TransactItems=[
+                    {'Put': {
+                        'TableName': SUBSCRIPTIONS_TRACKER_TABLE,
+                        'Item': {**existing, SUBSCRIPTION_ID: subscription_id},
+                        'ConditionExpression': "attribute_not_exists(#id) OR #status = :deleted",
+                        'ExpressionAttributeNames': {'#id': SUBSCRIPTION_ID, '#status': STATUS},
+                        'ExpressionAttributeValues': {':deleted': STATUS_DELETED}
+                    }},
+                    # the original is only removed if it hasn't changed since it was read
+                    {'Delete': {
+                        'TableName': SUBSCRIPTIONS_TRACKER_TABLE,
+                        'Key': {SUBSCRIPTION_ID: legacy_id},
+                        'ConditionExpression': "#status = :status",
+                        'ExpressionAttributeNames': {'#status': STATUS},
+                        'ExpressionAttributeValues': {':status': existing.get(STATUS)}
+                    }}
+                ])
+                migrated[legacy_id] = subscription_id
+            except client.exceptions.TransactionCanceledException as e:
+                self._logger.warning(f"Unable to migrate Subscription {legacy_id} to {subscription_id}: {e}")
+                not_migrated.append(legacy_id)
+            finally:
+                self._invalidate_cached(legacy_id)
+                self._invalidate_cached(subscription_id)
+
+        self._logger.info(
+            f"Migrated {len(migrated)} Subscriptions to request based ids, {len(not_migrated)} were left in place")
+
+        return {"Migrated": migrated, "NotMigrated": not_migrated}
+
+    def _get_table_names(self, database_name: str):
+        '''
+        List the tables in a database with one paginated call, rather than a call per table
+        :param database_name:
+        :return: Set of table names, or None if the database does not exist
+        '''
+        table_names = set()
+        try:
+            for page in self._glue_client.get_paginator('get_tables').paginate(DatabaseName=database_name):
+                table_names.update(t.get('Name') for t in page.get('TableList'))
+        except (
+                self._glue_client.exceptions.AccessDeniedException,
+                self._glue_client.exceptions.EntityNotFoundException):
+            # if we get access denied here, it's because the object doesn't exist
+            return None
+
+        return table_names
+
+    def create_subscription_requests(self, principal: str, requests: list,
+                                     suppress_object_validation: bool = False) -> list:
+        '''
+        Create many subscription requests for a principal. Objects are validated with one call per database, and
+        subscriptions are written with TransactWriteItems, each with the same condition as
+        create_subscription_request(), so that a subscription which already exists is never overwritten
+        :param principal:
+        :param requests: List of dicts with the arguments of create_subscription_request(): owner_account_id,
+        request_grants, and database_name with optional tables, or domain or data_product_name
+        :param suppress_object_validation:
+        :return: List with the response of create_subscription_request() for each request in order, with Created set
+        to False if the subscription had already been requested, or a dict with an Error for requests which could not
+        be made or written
+        '''
+        results = [None] * len(requests)
+        items = {}
+        table_names = {}
+
+        for position, request in enumerate(requests):
+            try:
+                item, response = self._build_subscription(principal=principal, **request)
+                database_name = request.get('database_name')
+
+                if response.get("Type") in [SubType.DATABASE, SubType.TABLE] and not suppress_object_validation:
+                    if database_name not in table_names:
+                        table_names[database_name] = self._get_table_names(database_name)
+
+                    if table_names.get(database_name) is None:
+                        raise Exception("Database %s does not exist" % (database_name))
+
+                    for table_name in request.get('tables') or []:
+                        if table_name not in table_names.get(database_name):
+                            raise Exception("Table %s does not exist in Database %s" % (table_name, database_name))
+
+                results[position] = response
+                items[item.get(SUBSCRIPTION_ID)] = item
+            except Exception as e:
+                results[position] = {"Request": request, "Error": str(e)}
+
+        written = {}
+        item_list = list(items.values())
+        for i in range(0, len(item_list), DYNAMODB_TRANSACT_WRITE_SIZE):
+            written.update(self._transact_put_subscriptions(item_list[i:i + DYNAMODB_TRANSACT_WRITE_SIZE]))
+
+        for position, result in enumerate(results):
+            outcome = written.get(result.get(SUBSCRIPTION_ID))
+            if isinstance(outcome, Exception):
+                results[position] = {"Request": requests[position], "Error": str(outcome)}
+            elif outcome is not None:
+                result["Created"] = outcome
+
+        self._logger.info(
+            f"Created {list(written.values()).count(True)} Subscription Requests from {len(requests)} Requests")
+
+        return results
+
+    def _transact_put_subscriptions(self, items: list) -> dict:
+        '''
+        Write new subscriptions in one transaction, each conditional on not already having been requested. Items which
+        fail their condition are already requested, and the rest of a cancelled transaction is retried
+        :param items:
+        :return: Dictionary of subscription id to True if it was written, False if it had already been requested, or
+        the Exception which prevented it from being written
+        '''
+        import botocore.exceptions
+
+        client = self._table.meta.client
+        outcomes = {}
+        pending = items
+        retries = 0
+        while len(pending) > 0:
+            try:
+                # condition objects aren't rewritten inside transactions, so the expressions are written out
+                client.transact_write_items(TransactItems=[{'Put': {
+                    'TableName': SUBSCRIPTIONS_TRACKER_TABLE,
+                    'Item': self._add_www(item=item),
+                    'ConditionExpression': "attribute_not_exists(#id) OR #status = :deleted",
+                    'ExpressionAttributeNames': {'#id': SUBSCRIPTION_ID, '#status': STATUS},
+                    'ExpressionAttributeValues': {':deleted': STATUS_DELETED}
+                }} for item in pending])
+
+                outcomes.update({item.get(SUBSCRIPTION_ID): True for item in pending})
+                pending = []
+            except client.exceptions.TransactionCanceledException as e:
+                reasons = e.response.get('CancellationReasons', [])
+                retry = []
+                for position, item in enumerate(pending):
+                    code = reasons[position].get('Code') if position < len(reasons) else None
+                    if code == 'ConditionalCheckFailed':
+                        self._logger.debug(f"Subscription {item.get(SUBSCRIPTION_ID)} has already been requested")
+                        outcomes[item.get(SUBSCRIPTION_ID)] = False
+                    else:
+                        # items which didn't cause the cancellation, or which conflicted with another write
+                        retry.append(item)
+
+                if len(retry) > 0 and retries >= MAX_API_RETRIES:
+                    outcomes.update({item.get(SUBSCRIPTION_ID): e for item in retry})
+                    retry = []
+                elif len(retry) == len(pending):
+                    retries += 1
+                    time.sleep(min(2 ** retries * 0.1, 5))
+
+                pending = retry
+            except botocore.exceptions.ClientError as e:
+                outcomes.update({item.get(SUBSCRIPTION_ID): e for item in pending})
+                pending = []
+
+        for item in items:
+            self._invalidate_cached(item.get(SUBSCRIPTION_ID))
+
+        return outcomes
+
+    def _batch_get(self, subscription_ids: list, projection: list = None, consistent_read: bool = False) -> list:
+        '''
+        Read subscriptions with BatchGetItem, retrying any unprocessed keys
+        :param subscription_ids:
+        :param projection: Attributes to return, or None for all attributes
+        :param consistent_read:
+        :return: List of the subscriptions which exist, in no particular order
+        '''
+        found = []
+        keys = [{SUBSCRIPTION_ID: i} for i in dict.fromkeys(subscription_ids)]
+
+        for i in range(0, len(keys), DYNAMODB_BATCH_GET_SIZE):
+            request = {'Keys': keys[i:i + DYNAMODB_BATCH_GET_SIZE], 'ConsistentRead': consistent_read}
+            if projection is not None:
+                names = {"#p%s" % n: a for n, a in enumerate(projection)}
+                request['ProjectionExpression'] = ", ".join(names.keys())
+                request['ExpressionAttributeNames'] = names
+
+            request_items = {SUBSCRIPTIONS_TRACKER_TABLE: request}
+            retries = 0
+            while len(request_items) > 0:
+                response = self._dynamo_resource.batch_get_item(RequestItems=request_items)
+                found.extend(response.get('Responses', {}).get(SUBSCRIPTIONS_TRACKER_TABLE, []))
+
+                request_items = response.get('UnprocessedKeys', {})
+                if len(request_items) > 0:
+                    if retries >= MAX_API_RETRIES:
+                        unprocessed = request_items.get(SUBSCRIPTIONS_TRACKER_TABLE).get('Keys')
+                        raise Exception(f"Unable to read {len(unprocessed)} Subscriptions")
+                    retries += 1
+                    time.sleep(min(2 ** retries * 0.1, 5))
+
+        return found
 
     def get_subscription(self, subscription_id: str, force: bool = False) -> dict:
         args = {
@@ -357,16 +713,61 @@ class SubscriberTracker:
             "ConsistentRead": True
         }
 
-        item = self._table.get_item(**args)
+        i = None if self._cache is None else self._cache.get(subscription_id)
+        if i is None:
+            generation = None if self._cache is None else self._cache.generation()
+            i = self._table.get_item(**args).get("Item")
+
+            if i is not None and self._cache is not None:
+                self._cache.put(subscription_id, i, generation)
 
-        i = item.get("Item")
         if i is None:
             return None
         else:
             if i.get(STATUS) != STATUS_DELETED or force:
                 return i
 
+    def get_subscriptions(self, subscription_ids: list, projection: list = None, consistent_read: bool = True,
+                          force: bool = False) -> list:
+        '''
+        Get many subscriptions with BatchGetItem, rather than a call per subscription
+        :param subscription_ids:
+        :param projection: Attributes to return, or None for all attributes
+        :param consistent_read: Set to False for eventually consistent reads, which consume half the read capacity
+        :param force: Return deleted subscriptions
+        :return: List of the subscriptions in the order of subscription_ids, with None for those which don't exist or
+        have been deleted
+        '''
+        # the id is needed to order the results, and the status to remove deleted subscriptions
+        read_projection = None if projection is None else list(
+            dict.fromkeys([SUBSCRIPTION_ID, STATUS] + list(projection)))
+
+        cached = {}
+        generation = None
+        if self._cache is not None:
+            generation = self._cache.generation()
+            for subscription_id in subscription_ids:
+                i = self._cache.get(subscription_id)
+                if i is not None:
+                    cached[subscription_id] = i
+
+        read = self._batch_get(subscription_ids=[i for i in subscription_ids if i not in cached],
+                               projection=read_projection, consistent_read=consistent_read)
+        if self._cache is not None and projection is None:
+            for i in read:
+                self._cache.put(i.get(SUBSCRIPTION_ID), i, generation)
+
+        found = {}
+        for i in list(cached.values()) + read:
+            if i.get(STATUS) != STATUS_DELETED or force:
+                found[i.get(SUBSCRIPTION_ID)] = i if projection is None else {k: v for k, v in i.items() if
+                                                                              k in projection}
+
+        return [found.get(i) for i in subscription_ids]
+
     def _arg_builder(self, key: str, value):
+        from boto3.dynamodb.conditions import Attr, Or
+
         if value is not None:
             if isinstance(value, str):
                 return Attr(key).eq(value)
@@ -388,6 +789,8 @@ class SubscriberTracker:
             return None
 
     def _build_filter_expression(self, args: dict):
+        from boto3.dynamodb.conditions import And, Attr
+
         filter = None
 
         for arg in args.items():
@@ -397,48 +800,241 @@ class SubscriberTracker:
                 else:
                     filter = And(filter, Attr(arg[0]).eq(arg[1]))
 
-        # add the deleted filter
-        filter = And(filter, Attr(STATUS).ne(STATUS_DELETED))
+        # add the deleted filter, unless a status has been requested
+        if args.get(STATUS) is None:
+            not_deleted = Attr(STATUS).ne(STATUS_DELETED)
+            filter = not_deleted if filter is None else And(filter, not_deleted)
 
         return filter
 
+    def _plan_query(self, criteria: dict) -> dict:
+        '''
+        Choose the secondary index which can resolve the most criteria in its key condition
+        :param criteria: Attribute values to match
+        :return: dict of the IndexName to query, or None if the table must be scanned, the Key attribute values for the
+        key condition, and the Residual attribute values which the query results must be filtered by
+        '''
+        criteria = {k: v for k, v in criteria.items() if v is not None}
+        plan = {'IndexName': None, 'Key': {}, 'Residual': criteria}
+        best = (0, False)
+
+        for (suffix, hash_key, range_key) in SECONDARY_INDEXES:
+            index_name = self._indexname(suffix)
+            if index_name not in self._active_indexes or not isinstance(criteria.get(hash_key), str):
+                continue
+
+            key = {hash_key: criteria.get(hash_key)}
+            if range_key is not None and isinstance(criteria.get(range_key), str):
+                key[range_key] = criteria.get(range_key)
+
+            # prefer indexes matching more attributes, and then those whose whole key is matched
+            score = (len(key), range_key is None or range_key in key)
+            if score > best:
+                best = score
+                plan = {
+                    'IndexName': index_name,
+                    'Key': key,
+                    'Residual': {k: v for k, v in criteria.items() if k not in key}
+                }
+
+        return plan
+
+    def _matches(self, item: dict, residual: dict, request_status: str = None) -> bool:
+        # deleted subscriptions are only returned when they are asked for
+        if request_status is None and item.get(STATUS) == STATUS_DELETED:
+            return False
+
+        for k, v in residual.items():
+            if item.get(k) != v:
+                return False
+
+        return True
+
+    def _prepare_list(self, criteria: dict, projection: list = None) -> tuple:
+        '''
+        Plan a listing and build the arguments for the query or scan which will read it
+        :param criteria: Attribute values to match
+        :param projection: Attributes to read, or None for all attributes
+        :return: Tuple of the plan from _plan_query() and the request arguments
+        '''
+        from boto3.dynamodb.conditions import And, Key
+
+        plan = self._plan_query(criteria)
+        args = {"TableName": SUBSCRIPTIONS_TRACKER_TABLE}
+
+        if projection is not None:
+            # always read the attributes needed to filter the results
+            attributes = [SUBSCRIPTION_ID, STATUS]
+            for a in list(projection) + list(plan.get('Residual').keys()):
+                if a not in attributes:
+                    attributes.append(a)
+
+            names = {"#p%s" % i: a for i, a in enumerate(attributes)}
+            args["ProjectionExpression"] = ", ".join(names.keys())
+            args["ExpressionAttributeNames"] = names
+
+        if plan.get('IndexName') is None:
+            args["FilterExpression"] = self._build_filter_expression(criteria)
+        else:
+            key_condition = None
+            for k, v in plan.get('Key').items():
+                key_condition = Key(k).eq(v) if key_condition is None else And(key_condition, Key(k).eq(v))
+
+            args["IndexName"] = plan.get('IndexName')
+            args["KeyConditionExpression"] = key_condition
+            if projection is None:
+                args["Select"] = "ALL_PROJECTED_ATTRIBUTES"
+
+        return plan, args
+
+    def _read_page(self, table, plan: dict, args: dict, request_status: str = None, start_token: dict = None,
+                   **kwargs) -> dict:
+        # expressions are rewritten into the request arguments, so each request gets its own copy
+        page_args = copy.deepcopy(args)
+        page_args.update(kwargs)
+        if start_token is not None:
+            page_args["ExclusiveStartKey"] = start_token
+
+        if plan.get('IndexName') is None:
+            return table.scan(**page_args)
+        else:
+            response = table.query(**page_args)
+
+            # the key condition only reads matching items, and the rest of the criteria are applied here
+            response['Items'] = [i for i in response.get('Items') if
+                                 self._matches(i, plan.get('Residual'), request_status)]
+            return response
+
+    def _replan(self, error, plan: dict) -> bool:
+        # roles created by earlier versions are only allowed to query the original indexes
+        if plan.get('IndexName') is not None and error.response.get('Error', {}).get(
+                'Code') == 'AccessDeniedException':
+            self._logger.debug(f"Unable to query Index {plan.get('IndexName')}, replanning")
+            self._active_indexes.discard(plan.get('IndexName'))
+            return True
+        else:
+            return False
+
     def list_subscriptions(self, owner_id: str = None, principal_id: str = None, database_name: str = None,
                            tables: list = None, includes_grants: list = None, request_status: str = None,
-                           start_token: str = None) -> dict:
-        args = {}
-
-        def _add_arg(key: str, value):
-            if value is not None:
-                args[key] = value
-
-        _add_arg("TableName", SUBSCRIPTIONS_TRACKER_TABLE)
-        _add_arg("ExclusiveStartKey", start_token)
-
-        if principal_id is not None:
-            _add_arg("IndexName", self.subscriber_indexname())
-            _add_arg("KeyConditionExpression", Key(SUBSCRIBER_PRINCIPAL).eq(principal_id))
-            _add_arg("Select", "ALL_PROJECTED_ATTRIBUTES")
-            _add_arg("FilterExpression", Attr(STATUS).ne(STATUS_DELETED))
-
-            response = self._table.query(**args)
-            return self._format_list_response(response)
-        elif owner_id is not None and request_status is not None:
-            _add_arg("IndexName", self.owner_indexname())
-            key_condition = And(Key(OWNER_PRINCIPAL).eq(owner_id), Key(STATUS).eq(request_status))
-            _add_arg("KeyConditionExpression", key_condition)
-            _add_arg("Select", "ALL_PROJECTED_ATTRIBUTES")
-
-            response = self._table.query(**args)
-            return self._format_list_response(response)
-        else:
-            # build the filter expression
-            filter_expression = self._build_filter_expression(
-                {OWNER_PRINCIPAL: owner_id, SUBSCRIBER_PRINCIPAL: principal_id, DATABASE_NAME: database_name,
-                 TABLE_NAME: tables, REQUESTED_GRANTS: includes_grants})
-            _add_arg("FilterExpression", filter_expression)
+                           start_token: str = None, projection: list = None) -> dict:
+        '''
+        Lists one page of the subscriptions matching the supplied arguments. Use iter_subscriptions() to read every page
+        :param owner_id:
+        :param principal_id:
+        :param database_name:
+        :param tables:
+        :param includes_grants:
+        :param request_status:
+        :param start_token: LastEvaluatedKey from the previous page
+        :param projection: Attributes to return, or None for all attributes
+        :return:
+        '''
+        import botocore.exceptions
+
+        criteria = {OWNER_PRINCIPAL: owner_id, SUBSCRIBER_PRINCIPAL: principal_id, DATABASE_NAME: database_name,
+                    TABLE_NAME: tables, REQUESTED_GRANTS: includes_grants, STATUS: request_status}
+
+        while True:
+            plan, args = self._prepare_list(criteria, projection)
+            try:
+                response = self._read_page(self._table, plan, args, request_status, start_token)
+                return self._format_list_response(response)
+            except botocore.exceptions.ClientError as e:
+                if not self._replan(e, plan):
+                    raise e
+
+    def iter_subscriptions(self, owner_id: str = None, principal_id: str = None, database_name: str = None,
+                           tables: list = None, includes_grants: list = None, request_status: str = None,
+                           projection: list = None, total_segments: int = 1):
+        '''
+        Generator over every subscription matching the supplied arguments, which reads all pages of results. Where no
+        index can be used, the table is scanned, optionally as parallel segments
+        :param owner_id:
+        :param principal_id:
+        :param database_name:
+        :param tables:
+        :param includes_grants:
+        :param request_status:
+        :param projection: Attributes to return, or None for all attributes. Attributes needed to filter the results
+        are always returned
+        :param total_segments: Number of segments to scan in parallel, if the table must be scanned
+        :return:
+        '''
+        import botocore.exceptions
+
+        criteria = {OWNER_PRINCIPAL: owner_id, SUBSCRIBER_PRINCIPAL: principal_id, DATABASE_NAME: database_name,
+                    TABLE_NAME: tables, REQUESTED_GRANTS: includes_grants, STATUS: request_status}
+        plan, args = self._prepare_list(criteria, projection)
 
-            response = self._table.scan(**args)
-            return self._format_list_response(response)
+        if plan.get('IndexName') is None and total_segments > 1:
+            yield from self._parallel_scan(args, total_segments)
+            return
+
+        start_token = None
+        while True:
+            try:
+                response = self._read_page(self._table, plan, args, request_status, start_token)
+            except botocore.exceptions.ClientError as e:
+                if start_token is None and self._replan(e, plan):
+                    plan, args = self._prepare_list(criteria, projection)
+                    continue
+                else:
+                    raise e
+
+            yield from response.get('Items')
+
+            start_token = response.get('LastEvaluatedKey')
+            if start_token is None:
+                return
+
+    def _parallel_scan(self, args: dict, total_segments: int):
+        # bounded, so segments don't read ahead of the caller by more than a couple of pages each
+        pages = queue.Queue(maxsize=total_segments * 2)
+        stop = threading.Event()
+        scan_plan = {'IndexName': None}
+
+        def _scan_segment(segment: int):
+            try:
+                # resources aren't thread safe, so each segment uses the one for its thread
+                table = utils.generate_resource(service='dynamodb', region=self._region,
+                                                credentials=self._credentials).Table(SUBSCRIPTIONS_TRACKER_TABLE)
+                start_token = None
+                while not stop.is_set():
+                    response = self._read_page(table, scan_plan, args, start_token=start_token, Segment=segment,
+                                               TotalSegments=total_segments)
+                    pages.put(response.get('Items'))
+
+                    start_token = response.get('LastEvaluatedKey')
+                    if start_token is None:
+                        break
+            except Exception as e:
+                pages.put(e)
+            finally:
+                pages.put(None)
+
+        executor = ThreadPoolExecutor(max_workers=total_segments)
+        for segment in range(total_segments):
+            executor.submit(_scan_segment, segment)
+
+        # each segment ends with None, after any error it raised
+        remaining = total_segments
+        try:
+            while remaining > 0:
+                page = pages.get()
+                if page is None:
+                    remaining -= 1
+                elif isinstance(page, Exception):
+                    raise page
+                else:
+                    yield from page
+        finally:
+            # if the caller stops iterating, stop the remaining segments and unblock any waiting to add a page
+            stop.set()
+            while remaining > 0:
+                if pages.get() is None:
+                    remaining -= 1
+            executor.shutdown(wait=True)
 
     def _format_list_response(self, response) -> dict:
         out = {
@@ -460,6 +1056,9 @@ class SubscriberTracker:
         # add who information
         args = self._upd_www(args)
 
+        # whether or not the update succeeds, the cached subscription may be out of date
+        self._invalidate_cached(args.get("Key").get(SUBSCRIPTION_ID))
+
         try:
             response = self._table.update_item(**args)
 
@@ -514,6 +1113,8 @@ class SubscriberTracker:
         :param status:
         :return:
         '''
+        from boto3.dynamodb.conditions import Attr, Or
+
         # build the map of proposed status to allowed status
         status_attr = Attr(STATUS)
         expected = None
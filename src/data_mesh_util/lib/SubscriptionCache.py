@@ -0,0 +1,200 @@
+import collections
+import copy
+import threading
+import time
+
+from data_mesh_util.lib.constants import *
+from data_mesh_util.lib.SubscriberTracker import SUBSCRIPTION_ID
+
+
+class SubscriptionCache:
+    '''
+    In process LRU cache of subscription items. Entries are invalidated by writes made through the Subscriber Tracker,
+    and can also be invalidated by tailing the DynamoDB stream of the tracker table, so that writes made by other
+    processes are seen. Entries older than the staleness bound are never returned
+    '''
+    _entries = None
+    _lock = None
+    _max_size = None
+    _max_age_seconds = None
+    _generation = 0
+    _stop = None
+    _stream_worker = None
+    _logger = None
+
+    def __init__(self, max_size: int = SUBSCRIPTION_CACHE_SIZE,
+                 max_age_seconds: float = SUBSCRIPTION_CACHE_MAX_AGE_SECONDS, logger=None):
+        '''
+        :param max_size: Number of subscriptions to cache, after which the least recently used are removed
+        :param max_age_seconds: Staleness bound, after which a cached subscription is read again
+        :param logger:
+        '''
+        # map of subscription id to (time cached, item), in order of use
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._max_size = max_size
+        self._max_age_seconds = max_age_seconds
+        self._stop = threading.Event()
+        self._logger = logger
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, subscription_id: str) -> dict:
+        '''
+        Get a cached subscription
+        :param subscription_id:
+        :return: A copy of the subscription, or None if it is not cached or is older than the staleness bound
+        '''
+        with self._lock:
+            entry = self._entries.get(subscription_id)
+            if entry is None:
+                return None
+
+            if time.monotonic() - entry[0] > self._max_age_seconds:
+                del self._entries[subscription_id]
+                return None
+
+            self._entries.move_to_end(subscription_id)
+
+        # callers may modify the subscription they are given
+        return copy.deepcopy(entry[1])
+
+    def generation(self) -> int:
+        '''
+        Counter of invalidations, which is read before reading a subscription from the table and passed to put()
+        '''
+        return self._generation
+
+    def put(self, subscription_id: str, item: dict, generation: int = None) -> None:
+        '''
+        Cache a subscription
+        :param subscription_id:
+        :param item:
+        :param generation: Value of generation() from before the subscription was read. If anything has been
+        invalidated since, the subscription may be out of date and isn't cached
+        '''
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+
+            self._entries[subscription_id] = (time.monotonic(), copy.deepcopy(item))
+            self._entries.move_to_end(subscription_id)
+
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, subscription_id: str = None) -> None:
+        '''
+        Remove a subscription from the cache, or all subscriptions if no id is provided
+        '''
+        with self._lock:
+            self._generation += 1
+            if subscription_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(subscription_id, None)
+
+    def apply_stream_records(self, records: list) -> int:
+        '''
+        Invalidate the subscriptions changed by a set of DynamoDB stream records
+        :param records: Records from dynamodbstreams:GetRecords
+        :return: Number of records applied
+        '''
+        for record in records:
+            subscription_id = record.get('dynamodb', {}).get('Keys', {}).get(SUBSCRIPTION_ID, {}).get('S')
+            if subscription_id is not None:
+                self.invalidate(subscription_id)
+
+        return len(records)
+
+    @staticmethod
+    def _list_shards(streams_client, stream_arn: str) -> list:
+        shards = []
+        args = {'StreamArn': stream_arn}
+        while True:
+            description = streams_client.describe_stream(**args).get('StreamDescription')
+            shards.extend(description.get('Shards', []))
+
+            if description.get('LastEvaluatedShardId') is None:
+                return shards
+            else:
+                args['ExclusiveStartShardId'] = description.get('LastEvaluatedShardId')
+
+    def _tail_stream(self, streams_client, stream_arn: str, poll_seconds: float) -> None:
+        # map of open shard id to its current iterator, and the shards which have been read to their end
+        iterators = {}
+        finished = set()
+        started = False
+
+        while not self._stop.is_set():
+            try:
+                # shards are closed and replaced over time, so new shards are picked up on each pass
+                for shard in self._list_shards(streams_client, stream_arn):
+                    shard_id = shard.get('ShardId')
+                    if shard_id in iterators or shard_id in finished:
+                        continue
+
+                    if not started and shard.get('SequenceNumberRange', {}).get('EndingSequenceNumber') is not None:
+                        # shards closed before the worker started have nothing which isn't already stale
+                        finished.add(shard_id)
+                        continue
+
+                    # shards which exist when the worker starts are read from now on, and those created later from
+                    # their beginning, so that no changes are missed
+                    iterators[shard_id] = streams_client.get_shard_iterator(
+                        StreamArn=stream_arn, ShardId=shard_id,
+                        ShardIteratorType='TRIM_HORIZON' if started else 'LATEST'
+                    ).get('ShardIterator')
+                started = True
+
+                for shard_id, iterator in list(iterators.items()):
+                    response = streams_client.get_records(ShardIterator=iterator)
+                    self.apply_stream_records(response.get('Records', []))
+
+                    if response.get('NextShardIterator') is None:
+                        del iterators[shard_id]
+                        finished.add(shard_id)
+                    else:
+                        iterators[shard_id] = response.get('NextShardIterator')
+            except Exception as e:
+                # changes may have been missed, so nothing in the cache can be trusted, and the stream is read again
+                # from now on
+                if self._logger is not None:
+                    self._logger.warning(f"Subscription Cache stream reader failed, clearing the cache: {e}")
+                self.invalidate()
+                iterators.clear()
+                started = False
+
+            self._stop.wait(poll_seconds)
+
+    def follow_stream(self, streams_client, stream_arn: str,
+                      poll_seconds: float = SUBSCRIPTION_STREAM_POLL_SECONDS) -> threading.Thread:
+        '''
+        Start a background worker which invalidates subscriptions as they change, by tailing the DynamoDB stream of the
+        tracker table. The cache is cleared when the worker starts, as earlier changes won't be read
+        :param streams_client: DynamoDB Streams client
+        :param stream_arn: LatestStreamArn of the tracker table
+        :param poll_seconds: Time to wait between reads of the stream
+        :return: The worker thread
+        '''
+        if self._stream_worker is not None and self._stream_worker.is_alive():
+            raise Exception("Subscription Cache is already following a stream")
+
+        self.invalidate()
+        self._stop.clear()
+        self._stream_worker = threading.Thread(target=self._tail_stream,
+                                               args=(streams_client, stream_arn, poll_seconds),
+                                               name="SubscriptionCacheStreamReader", daemon=True)
+        self._stream_worker.start()
+
+        return self._stream_worker
+
+    def stop(self, timeout: float = None) -> None:
+        '''
+        Stop the stream worker, if there is one
+        '''
+        self._stop.set()
+        if self._stream_worker is not None:
+            self._stream_worker.join(timeout)
+            self._stream_worker = None
@@ -22,3 +22,40 @@ CONSUMER = 'Consumer'
 PRODUCER_ADMIN = 'ProducerAdmin'
 CONSUMER_ADMIN = 'ConsumerAdmin'
 BUCKET_POLICY_STATEMENT_SID = 'AwsDataMeshUtilsBucketPolicyStatement'
+DATA_PRODUCT_CREATED = 'Created'
+DATA_PRODUCT_FAILED = 'Failed'
+GLUE_PARTITION_BATCH_SIZE = 100
+GLUE_PARTITION_WORKERS = 4
+PARTITIONS_CREATED = 'Created'
+PARTITIONS_EXISTING = 'AlreadyExisting'
+PARTITIONS_FAILED = 'Failed'
+THROTTLING_ERROR_CODES = ['ThrottlingException', 'TooManyRequestsException', 'RequestLimitExceeded']
+MAX_API_RETRIES = 5
+GLUE_MAX_PARTITION_SEGMENTS = 10
+GLUE_PARTITION_READ_SEGMENTS = 4
+GLUE_PARTITION_DELETE_BATCH_SIZE = 25
+PARTITIONS_UPDATED = 'Updated'
+PARTITIONS_DELETED = 'Deleted'
+PARTITIONS_UNCHANGED = 'Unchanged'
+LF_TAG_CACHE_TTL_SECONDS = 300
+LF_TAG_SEARCH_MAX_VALUES = 50
+LF_GRANT_BATCH_SIZE = 20
+GRANTS_GRANTED = 'Granted'
+GRANTS_SUPPRESSED = 'Suppressed'
+GRANTS_FAILED = 'Failed'
+GLUE_RESOURCE_POLICY_MAX_BYTES = 10240
+CLIENT_MAX_POOL_CONNECTIONS = 50
+CLIENT_MAX_ATTEMPTS = 10
+CLIENT_RETRY_MODE = 'adaptive'
+CLIENT_TCP_KEEPALIVE = True
+CREDENTIAL_EXPIRY_MARGIN_SECONDS = 300
+CREDENTIAL_REFRESH_MARGIN_SECONDS = 900
+CREDENTIAL_CACHE_FILE_ENV = 'DATA_MESH_CREDENTIAL_CACHE_FILE'
+CREDENTIAL_CACHE_KEY_ENV = 'DATA_MESH_CREDENTIAL_CACHE_KEY'
+RENDERED_POLICY_CACHE_SIZE = 1024
+IDENTITY_CACHE_SIZE = 256
+DYNAMODB_BATCH_GET_SIZE = 100
+DYNAMODB_TRANSACT_WRITE_SIZE = 25
+SUBSCRIPTION_CACHE_SIZE = 1024
+SUBSCRIPTION_CACHE_MAX_AGE_SECONDS = 60
+SUBSCRIPTION_STREAM_POLL_SECONDS = 1
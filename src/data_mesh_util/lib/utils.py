@@ -4,13 +4,69 @@ except ImportError:
     from collections import Mapping  # noqa
 
 from data_mesh_util.lib.constants import *
+import collections
+import copy
+import hashlib
 import json
+import logging
 import os
-import pystache
-import botocore
-import boto3
+import sys
+import threading
 import datetime
 
+# boto3, botocore, pystache and shortuuid are imported on first use, as they dominate the time taken to import the
+# package
+
+from data_mesh_util.lib.CredentialCache import CredentialCache
+
+# process-wide registry of clients keyed by (service, region, credential identity), along with the sessions they
+# were created from and the expiry of the credentials they use. Refreshable credentials are held in place of their
+# expiry, as it changes each time they are refreshed
+_client_registry = {}
+_client_registry_sessions = {}
+_client_registry_expiry = {}
+_client_registry_lock = threading.RLock()
+_client_registry_resources = threading.local()
+_client_config = None
+_credential_cache = None
+_credential_cache_lock = threading.Lock()
+
+# parsed pystache templates by file name, and an LRU of rendered policies by template and config
+_template_registry = {}
+_template_registry_lock = threading.Lock()
+_template_renderer = None
+_rendered_policies = collections.OrderedDict()
+
+# LRU of credential access key to the caller identity of those credentials. Keys change each time credentials are
+# refreshed, so entries for old keys are dropped as new ones are added
+_identity_cache = collections.OrderedDict()
+_identity_cache_lock = threading.Lock()
+
+
+def configure_logger(logger: logging.Logger, log_level: str) -> logging.Logger:
+    '''
+    Set the level of a logger, and log to standard out unless the application has already configured handlers for it
+    :param logger:
+    :param log_level:
+    :return:
+    '''
+    if not logger.handlers:
+        logger.addHandler(logging.StreamHandler(sys.stdout))
+    logger.setLevel(log_level)
+
+    return logger
+
+
+def generate_id(name: str = None) -> str:
+    '''
+    Generate a short unique ID, or a deterministic one from a name
+    :param name:
+    :return:
+    '''
+    import shortuuid
+
+    return shortuuid.uuid() if name is None else shortuuid.uuid(name=name)
+
 
 def make_iam_session_name(current_account):
     val = "%s-%s-%s" % (current_account.get('UserId').replace(":", ""), current_account.get(
@@ -29,9 +85,62 @@ def get_central_role_name(account_id: str, type: str) -> str:
         return f"{DATA_MESH_ADMIN_CONSUMER_ROLENAME}-{account_id}"
 
 
+def _get_access_key(credentials, region: str = None) -> str:
+    if credentials is None:
+        # resolve the default credential provider chain from the registry session, rather than a new session
+        with _client_registry_lock:
+            key, use_region, identity = _resolve_registry_entry('sts', region, None)
+            default_credentials = _get_registry_session(use_region, None, identity).get_credentials()
+        return default_credentials.access_key if default_credentials is not None else None
+    else:
+        return _validate_credentials(credentials).get('AccessKeyId')
+
+
+def whoami(credentials=None, region: str = None, refresh: bool = False) -> dict:
+    '''
+    Get the caller identity of a set of credentials. The most recently used identities are cached by the access key of
+    the credentials, so credentials which have been refreshed are looked up again
+    :param credentials: Credentials to get the identity of, or None for the default credential provider chain
+    :param region:
+    :param refresh: Call sts:GetCallerIdentity even if the identity is cached
+    :return: Dict of UserId, Account and Arn
+    '''
+    access_key = _get_access_key(credentials, region)
+
+    with _identity_cache_lock:
+        identity = _identity_cache.get(access_key)
+        if identity is not None:
+            _identity_cache.move_to_end(access_key)
+
+    if identity is None or refresh is True:
+        caller_identity = generate_client(service='sts', region=region, credentials=credentials).get_caller_identity()
+        identity = {k: caller_identity.get(k) for k in ['UserId', 'Account', 'Arn']}
+
+        with _identity_cache_lock:
+            _identity_cache[access_key] = identity
+            _identity_cache.move_to_end(access_key)
+            if len(_identity_cache) > IDENTITY_CACHE_SIZE:
+                _identity_cache.popitem(last=False)
+
+    return identity
+
+
+def invalidate_whoami(credentials=None, region: str = None) -> None:
+    '''
+    Remove the cached caller identity of a set of credentials
+    :param credentials: Credentials to remove, or None to remove all cached identities
+    :param region:
+    :return:
+    '''
+    with _identity_cache_lock:
+        if credentials is None:
+            _identity_cache.clear()
+        else:
+            _identity_cache.pop(_get_access_key(credentials, region), None)
+
+
 def validate_correct_account(credentials, account_id: str, should_match: bool = True):
-    caller_account = generate_client(service='sts', region=None, credentials=credentials).get_caller_identity().get(
-        'Account')
+    caller_account = whoami(credentials=credentials).get('Account')
     if should_match is False and caller_account == account_id:
         raise Exception(
             f"Function should not run within the Data Mesh Account ({account_id}) ")
@@ -44,13 +153,73 @@ def convert_s3_path_to_arn(s3_path: str) -> str:
     return f"arn:aws:s3:::{s3_path.replace('s3://', '')}"
 
 
+def get_template(template_file: str):
+    '''
+    Get a parsed policy template from the template registry, loading and parsing it from the resource directory on
+    first use
+    :param template_file:
+    :return:
+    '''
+    parsed = _template_registry.get(template_file)
+
+    if parsed is None:
+        with open("%s/%s" % (os.path.join(os.path.dirname(__file__), "../resource"), template_file)) as t:
+            import pystache
+            parsed = pystache.parse(t.read())
+
+        with _template_registry_lock:
+            parsed = _template_registry.setdefault(template_file, parsed)
+
+    return parsed
+
+
+def load_templates() -> int:
+    '''
+    Parse all policy templates in the resource directory into the template registry
+    :return: The number of templates loaded
+    '''
+    templates = [f for f in os.listdir(os.path.join(os.path.dirname(__file__), "../resource")) if
+                 f.endswith('.pystache')]
+    for t in templates:
+        get_template(t)
+
+    return len(templates)
+
+
 def generate_policy(template_file: str, config: dict):
-    with open("%s/%s" % (os.path.join(os.path.dirname(__file__), "../resource"), template_file)) as t:
-        template = t.read()
+    global _template_renderer
+
+    if _template_renderer is None:
+        import pystache
+        _template_renderer = pystache.Renderer()
+
+    return _template_renderer.render(get_template(template_file), config)
+
+
+def generate_policy_dict(template_file: str, config: dict) -> dict:
+    '''
+    Render a policy template to a dict. Policies are cached by their template and config, so rendering the same
+    policy again returns a copy of the cached policy without rendering or parsing it
+    :param template_file:
+    :param config:
+    :return:
+    '''
+    key = (template_file, json.dumps(config, sort_keys=True, default=str))
+
+    with _template_registry_lock:
+        policy = _rendered_policies.get(key)
+        if policy is not None:
+            _rendered_policies.move_to_end(key)
 
-    rendered = pystache.Renderer().render(template, config)
+    if policy is None:
+        policy = json.loads(generate_policy(template_file, config))
 
-    return rendered
+        with _template_registry_lock:
+            _rendered_policies[key] = policy
+            if len(_rendered_policies) > RENDERED_POLICY_CACHE_SIZE:
+                _rendered_policies.popitem(last=False)
+
+    return copy.deepcopy(policy)
 
 
 def remove_dict_keys(input_dict: dict, remove_keys: list) -> dict:
@@ -68,6 +237,19 @@ def remove_dict_keys(input_dict: dict, remove_keys: list) -> dict:
     return out
 
 
+def get_partition_fingerprint(partition: dict) -> str:
+    # only the location and schema of a partition determine whether it needs to be synchronised
+    sd = partition.get('StorageDescriptor', {})
+    significant = {
+        'Location': sd.get('Location'),
+        'Columns': sd.get('Columns'),
+        'InputFormat': sd.get('InputFormat'),
+        'OutputFormat': sd.get('OutputFormat'),
+        'SerdeInfo': sd.get('SerdeInfo')
+    }
+    return hashlib.sha1(json.dumps(significant, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
 def get_table_arn(region_name: str, catalog_id: str, database_name: str, table_name: str):
     # format is arn:aws:glue:region:account-id:table/database name/table name
     return f"arn:aws:glue:{region_name}:{catalog_id}:table/{database_name}/{table_name}"
@@ -131,22 +313,96 @@ def get_datamesh_consumer_role_arn(source_account_id: str, data_mesh_account_id:
     return get_role_arn(data_mesh_account_id, get_central_role_name(source_account_id, CONSUMER))
 
 
+def configure_credential_cache(cache_file: str = None, encryption_key: str = None):
+    '''
+    Set the cache used for credentials from assume_iam_role. By default credentials are only cached in memory, unless
+    environment variable DATA_MESH_CREDENTIAL_CACHE_FILE is set
+    :param cache_file: Path of an encrypted file used to share credentials across processes. Requires the cryptography
+    module
+    :param encryption_key: Fernet key used to encrypt the cache file. Defaults to environment variable
+    DATA_MESH_CREDENTIAL_CACHE_KEY
+    :return:
+    '''
+    global _credential_cache
+
+    with _credential_cache_lock:
+        _credential_cache = CredentialCache(cache_file=cache_file, encryption_key=encryption_key)
+        return _credential_cache
+
+
+def get_credential_cache():
+    with _credential_cache_lock:
+        cache = _credential_cache
+
+    if cache is None:
+        cache = configure_credential_cache(cache_file=os.getenv(CREDENTIAL_CACHE_FILE_ENV))
+
+    return cache
+
+
 def assume_iam_role(role_name: str, region_name: str, target_account: str = None,
-                    use_credentials=None) -> (boto3.session.Session, dict):
+                    use_credentials=None) -> tuple:
+    '''
+    Assume a data mesh role, reusing cached credentials for the role where they are current. The Session refreshes its
+    credentials automatically before they expire, but the returned Credentials are a copy taken now
+    :param role_name:
+    :param region_name:
+    :param target_account:
+    :param use_credentials:
+    :return: Tuple of the Session for the role, and its Credentials as a dict of AccessKeyId, SecretAccessKey,
+    SessionToken and Expiration
+    '''
+    session, credentials = assume_refreshable_iam_role(role_name=role_name, region_name=region_name,
+                                                       target_account=target_account,
+                                                       use_credentials=use_credentials)
+
+    return session, _freeze_credentials(credentials)
+
+
+def _freeze_credentials(credentials) -> dict:
+    if credentials is None or isinstance(credentials, Mapping):
+        return credentials
+
+    frozen = _validate_credentials(credentials.get_frozen_credentials())
+    if _is_refreshable(credentials):
+        frozen['Expiration'] = credentials._expiry_time
+
+    return frozen
+
+
+def assume_refreshable_iam_role(role_name: str, region_name: str, target_account: str = None,
+                                use_credentials=None) -> tuple:
+    '''
+    Assume a data mesh role, reusing cached credentials for the role where they are current. Returned credentials are
+    refreshed automatically before they expire
+    :param role_name:
+    :param region_name:
+    :param target_account:
+    :param use_credentials:
+    :return: Tuple of the Session for the role, and its botocore Credentials
+    '''
     _sts_client = generate_client('sts', region_name, use_credentials)
-    _current_identity = _sts_client.get_caller_identity()
+    _current_identity = whoami(credentials=use_credentials, region=region_name)
     set_account = target_account if target_account is not None else _current_identity.get('Account')
-
-    if _current_identity.get('Arn') == get_role_arn(account_id=set_account,
-                                                    role_name=role_name):
-        return boto3.session.Session(region_name=region_name)
+    role_arn = get_role_arn(account_id=set_account, role_name=role_name)
+
+    if _current_identity.get('Arn') == role_arn:
+        # we are already running as the role
+        if use_credentials is None:
+            import boto3
+            _session = boto3.session.Session(region_name=region_name)
+            return _session, _session.get_credentials()
+        else:
+            return create_session(credentials=use_credentials, region=region_name), use_credentials
     else:
-        _creds = _sts_client.assume_role(
-            RoleArn=get_role_arn(set_account, role_name),
-            RoleSessionName=make_iam_session_name(_current_identity)
+        _creds = get_credential_cache().assume_role(
+            sts_client=_sts_client,
+            source_identity=_current_identity.get('Arn'),
+            role_arn=role_arn,
+            session_name=make_iam_session_name(_current_identity)
         )
 
-        return create_session(credentials=_creds.get('Credentials'), region=region_name), _creds.get('Credentials')
+        return create_session(credentials=_creds, region=region_name), _creds
 
 
 def _validate_credentials(credentials) -> dict:
@@ -172,7 +428,7 @@ def _validate_credentials(credentials) -> dict:
 
 
 def load_ram_shares(lf_client, data_mesh_account_id: str, database_name: str, table_name: str,
-                    target_principal: str) -> dict:
+                    target_principal: str, load_database_share: bool = True) -> dict:
     ram_shares = {}
 
     def _get_ram_share(d: str, t: str = None) -> None:
@@ -215,7 +471,8 @@ def load_ram_shares(lf_client, data_mesh_account_id: str, database_name: str, ta
             raise Exception("Unable to Load RAM Share for Permission")
 
     # load the RAM shares for the database
-    _get_ram_share(database_name)
+    if load_database_share is True:
+        _get_ram_share(database_name)
 
     # load the RAM shares for the table
     _get_ram_share(database_name, table_name)
@@ -223,8 +480,25 @@ def load_ram_shares(lf_client, data_mesh_account_id: str, database_name: str, ta
     return ram_shares
 
 
+def _is_refreshable(credentials) -> bool:
+    if credentials is None or isinstance(credentials, Mapping):
+        return False
+
+    from botocore.credentials import RefreshableCredentials
+    return isinstance(credentials, RefreshableCredentials)
+
+
 def create_session(credentials=None, region=None):
-    if credentials is not None:
+    import boto3
+    import botocore.session
+
+    if _is_refreshable(credentials):
+        # sessions use the credentials directly, so that they are refreshed rather than copied
+        botocore_session = botocore.session.Session()
+        botocore_session._credentials = credentials
+        return boto3.session.Session(botocore_session=botocore_session,
+                                     region_name=region if region is not None else os.getenv('AWS_REGION'))
+    elif credentials is not None:
         use_creds = _validate_credentials(credentials)
         args = {
             "aws_access_key_id": use_creds.get('AccessKeyId'),
@@ -243,20 +517,190 @@ def create_session(credentials=None, region=None):
         return botocore.session.get_session()
 
 
-def generate_client(service: str, region: str, credentials):
-    session = create_session(credentials=credentials, region=region)
+def configure_clients(max_pool_connections: int = CLIENT_MAX_POOL_CONNECTIONS,
+                      max_attempts: int = CLIENT_MAX_ATTEMPTS, retry_mode: str = CLIENT_RETRY_MODE,
+                      tcp_keepalive: bool = CLIENT_TCP_KEEPALIVE, **kwargs):
+    '''
+    Set the botocore Config used for all clients created by generate_client and generate_resource. Clients which were
+    already created with a different configuration are discarded
+    :param max_pool_connections: Size of each client's HTTP connection pool
+    :param max_attempts: Maximum number of attempts for each API call, including retries
+    :param retry_mode: botocore retry mode - legacy, standard or adaptive
+    :param tcp_keepalive: Enable TCP keepalive on client connections, where supported by the installed botocore
+    :param kwargs: Any other botocore Config arguments
+    :return:
+    '''
+    global _client_config
+    import botocore.config
 
-    return session.client(service)
+    args = {
+        "max_pool_connections": max_pool_connections,
+        "retries": {"max_attempts": max_attempts, "mode": retry_mode},
+        **kwargs
+    }
+    try:
+        config = botocore.config.Config(tcp_keepalive=tcp_keepalive, **args)
+    except TypeError:
+        # tcp_keepalive was added in botocore 1.27
+        config = botocore.config.Config(**args)
 
+    with _client_registry_lock:
+        _client_config = config
+        clear_client_registry()
+
+    return config
+
+
+def get_client_config():
+    with _client_registry_lock:
+        if _client_config is None:
+            configure_clients()
+
+        return _client_config
+
+
+def _get_credential_expiry(credentials):
+    if _is_refreshable(credentials):
+        # the current expiry, which is only in the past if nothing has used, and so refreshed, the credentials since
+        return credentials._expiry_time
+
+    expiry = credentials.get('Expiration') if isinstance(credentials, Mapping) else None
+    if isinstance(expiry, str):
+        expiry = datetime.datetime.fromisoformat(expiry.replace('Z', '+00:00'))
+
+    return expiry
+
+
+def _get_credential_identity(credentials) -> tuple:
+    if credentials is None:
+        # clients from the default credential provider chain
+        return None,
+    elif _is_refreshable(credentials):
+        # keys change on refresh, so clients are shared by all users of the same credentials object
+        return credentials,
 
-def generate_resource(service: str, region: str, credentials):
     use_creds = _validate_credentials(credentials)
-    args = {
-        "service_name": service,
-        "region_name": region,
-        "aws_access_key_id": use_creds.get('AccessKeyId'),
-        "aws_secret_access_key": use_creds.get('SecretAccessKey')
-    }
-    if 'SessionToken' in use_creds:
-        args['aws_session_token'] = use_creds.get('SessionToken')
-    return boto3.resource(**args)
+
+    # secrets are only held in the registry as a digest
+    return use_creds.get('AccessKeyId'), hashlib.sha1(
+        f"{use_creds.get('SecretAccessKey')}{use_creds.get('SessionToken')}".encode('utf-8')).hexdigest()
+
+
+def _is_expired(expiry) -> bool:
+    if expiry is None:
+        return False
+
+    return expiry - datetime.timedelta(seconds=CREDENTIAL_EXPIRY_MARGIN_SECONDS) <= datetime.datetime.now(
+        tz=expiry.tzinfo)
+
+
+def evict_expired_clients() -> int:
+    '''
+    Remove all clients whose credentials have expired, or will expire shortly, from the client registry
+    :return: The number of credential identities which were evicted
+    '''
+    with _client_registry_lock:
+        expired = [k for k, v in _client_registry_expiry.items() if _is_expired(
+            _get_credential_expiry(v) if _is_refreshable(v) else v)]
+        for identity in expired:
+            _evict_identity(identity)
+
+        return len(expired)
+
+
+def _evict_identity(identity: tuple) -> None:
+    for key in [k for k in _client_registry.keys() if k[2] == identity]:
+        del _client_registry[key]
+    for key in [k for k in _client_registry_sessions.keys() if k[1] == identity]:
+        del _client_registry_sessions[key]
+    _client_registry_expiry.pop(identity, None)
+
+
+def clear_client_registry() -> None:
+    with _client_registry_lock:
+        _client_registry.clear()
+        _client_registry_sessions.clear()
+        _client_registry_expiry.clear()
+
+
+def _get_registry_session(region: str, credentials, identity: tuple):
+    # must be called holding the registry lock, as sessions are not thread safe
+    session = _client_registry_sessions.get((region, identity))
+    if session is None:
+        if credentials is None:
+            import boto3
+            session = boto3.session.Session(region_name=region)
+        else:
+            session = create_session(credentials=credentials, region=region)
+        _client_registry_sessions[(region, identity)] = session
+
+    return session
+
+
+def _resolve_registry_entry(service: str, region: str, credentials) -> tuple:
+    if region is None:
+        region = os.getenv('AWS_REGION')
+
+    identity = _get_credential_identity(credentials)
+
+    # clients for credentials which are about to expire are removed rather than handed out again
+    evict_expired_clients()
+    if _is_refreshable(credentials):
+        # clients refresh these credentials themselves, so their expiry is checked when evicting rather than now
+        _client_registry_expiry[identity] = credentials
+    else:
+        expiry = _get_credential_expiry(credentials)
+        if expiry is not None:
+            _client_registry_expiry[identity] = expiry
+
+    return (service, region, identity), region, identity
+
+
+def generate_client(service: str, region: str, credentials, endpoint_url: str = None):
+    '''
+    Get a client from the process-wide client registry, creating it on first use. Clients are thread safe, and are
+    shared by all callers using the same service, region and credentials, including the API Automators
+    :param service:
+    :param region:
+    :param credentials:
+    :param endpoint_url: Endpoint to use instead of the service's regional endpoint, such as a local stand-in
+    :return:
+    '''
+    with _client_registry_lock:
+        key, region, identity = _resolve_registry_entry(service, region, credentials)
+        if endpoint_url is not None:
+            key = key + (endpoint_url,)
+
+        client = _client_registry.get(key)
+        if client is None:
+            client = _get_registry_session(region, credentials, identity).client(service, config=get_client_config(),
+                                                                                 endpoint_url=endpoint_url)
+            _client_registry[key] = client
+
+        return client
+
+
+def generate_resource(service: str, region: str, credentials):
+    '''
+    Get a resource from the client registry. Resources are not thread safe, so each thread is given its own
+    :param service:
+    :param region:
+    :param credentials:
+    :return:
+    '''
+    thread_resources = getattr(_client_registry_resources, 'cache', None)
+    if thread_resources is None:
+        thread_resources = {}
+        _client_registry_resources.cache = thread_resources
+
+    with _client_registry_lock:
+        key, region, identity = _resolve_registry_entry(service, region, credentials)
+        session = _get_registry_session(region, credentials, identity)
+
+        # resources created from a session which has since been evicted are replaced
+        session_resource = thread_resources.get(key)
+        if session_resource is None or session_resource[0] is not session:
+            session_resource = (session, session.resource(service, config=get_client_config()))
+            thread_resources[key] = session_resource
+
+        return session_resource[1]
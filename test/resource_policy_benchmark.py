@@ -0,0 +1,117 @@
+'''
+Micro-benchmark of merging consumer grants into a Glue Catalog resource policy. Compares the indexed policy model used
+by GlueResourcePolicyManager with the previous linear scan of every statement and resource. Runs offline:
+
+    python test/resource_policy_benchmark.py --statements 1000 --resources 10000
+'''
+import argparse
+import copy
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "../src"))
+
+from data_mesh_util.lib.GlueResourcePolicy import GlueResourcePolicy
+
+REGION = 'eu-west-1'
+PRODUCER_ACCOUNT = '600214582022'
+
+
+def _consumer(i: int) -> str:
+    return str(100000000000 + i)
+
+
+def _table_arn(database: str, i: int) -> str:
+    return f"arn:aws:glue:{REGION}:{PRODUCER_ACCOUNT}:table/{database}/table_{i}"
+
+
+def build_policy(statements: int, resources: int) -> dict:
+    # one statement per consumer, with the table resources spread evenly between them
+    per_statement = max(1, resources // statements)
+    return {"Version": "2012-10-17", "Statement": [{
+        "Effect": "Allow",
+        "Action": ["glue:*"],
+        "Principal": {"AWS": [_consumer(s)]},
+        "Resource": [_table_arn(f"db_{s}", t) for t in range(per_statement)] + [
+            f"arn:aws:glue:{REGION}:{PRODUCER_ACCOUNT}:database/db_{s}",
+            f"arn:aws:glue:{REGION}:{PRODUCER_ACCOUNT}:catalog"
+        ],
+        "Condition": {"Bool": {"glue:EvaluatedByLakeFormationTags": True}}
+    } for s in range(statements)]}
+
+
+def build_grants(statements: int, resources: int) -> list:
+    # every consumer asks for its existing tables again plus the same number of new ones, in no particular order
+    per_statement = max(1, resources // statements)
+    shuffle = random.Random(0)
+    grants = []
+    for s in range(statements):
+        tables = [_table_arn(f"db_{s}", t) for t in range(per_statement * 2)]
+        shuffle.shuffle(tables)
+        grants.append((_consumer(s), f"db_{s}", tables))
+
+    return grants
+
+
+def legacy_merge(policy: dict, grants: list) -> dict:
+    for consumer, database, tables in grants:
+        statement_match = None
+        missing_tables = tables.copy()
+        for statement in policy.get('Statement'):
+            if consumer in statement.get('Principal').get('AWS'):
+                for resource in statement.get('Resource'):
+                    if REGION in resource and PRODUCER_ACCOUNT in resource and (
+                            ':database' in resource and database in resource):
+                        statement_match = statement
+                        break
+
+        if statement_match is not None:
+            for resource in statement_match.get('Resource'):
+                try:
+                    del missing_tables[missing_tables.index(resource)]
+                except ValueError:
+                    pass
+            statement_match['Resource'].extend(missing_tables)
+
+    return policy
+
+
+def indexed_merge(policy: dict, grants: list) -> dict:
+    model = GlueResourcePolicy(policy)
+    for consumer, database, tables in grants:
+        position = model.find_statement(principal=consumer, region=REGION, account=PRODUCER_ACCOUNT,
+                                        database=database)
+        if position is not None:
+            model.add_resources(position, tables)
+
+    return model.to_dict()
+
+
+def _time(merge, policy: dict, grants: list) -> tuple:
+    policy = copy.deepcopy(policy)
+    start = time.perf_counter()
+    result = merge(policy, grants)
+    return time.perf_counter() - start, result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--statements', type=int, default=1000)
+    parser.add_argument('--resources', type=int, default=10000)
+    parser.add_argument('--skip-legacy', action='store_true', help='Only time the indexed policy model')
+    args = parser.parse_args()
+
+    policy = build_policy(args.statements, args.resources)
+    grants = build_grants(args.statements, args.resources)
+    print(f"Merging {len(grants)} consumer grants into {args.statements} statements with {args.resources} resources")
+
+    indexed_seconds, indexed_result = _time(indexed_merge, policy, grants)
+    print(f"indexed: {indexed_seconds * 1000:.1f} ms")
+
+    if not args.skip_legacy:
+        legacy_seconds, legacy_result = _time(legacy_merge, policy, grants)
+        print(f"legacy:  {legacy_seconds * 1000:.1f} ms ({legacy_seconds / indexed_seconds:.1f}x)")
+        if legacy_result != indexed_result:
+            raise Exception("Indexed and legacy merges produced different policies")
@@ -3,12 +3,15 @@ import sys
 import os
 import warnings
 import boto3
+from botocore.stub import ANY, Stubber
 
 sys.path.append(os.path.join(os.path.dirname(__file__), "../src"))
 sys.path.append(os.path.join(os.path.dirname(__file__), "../src/resource"))
 sys.path.append(os.path.join(os.path.dirname(__file__), "../src/lib"))
+sys.path.append(os.path.dirname(__file__))
 
 from data_mesh_util.lib.ApiAutomator import *
+from data_mesh_util.lib.GlueResourcePolicy import GlueResourcePolicy
 
 warnings.filterwarnings(action="ignore", message="unclosed", category=ResourceWarning)
 
@@ -18,15 +21,39 @@ PRODUCER_ACCOUNT = '600214582022'
 
 
 class ApiAutomatorTests(unittest.TestCase):
-    _session = boto3.session.Session()
-    _automator = ApiAutomator(session=_session, log_level='INFO')
+    _session = boto3.session.Session(region_name='eu-west-1', aws_access_key_id='testing',
+                                     aws_secret_access_key='testing')
+    _automator = ApiAutomator(target_account=PRODUCER_ACCOUNT, session=_session, log_level='INFO')
     _proofs = None
 
     def setUp(self) -> None:
-        with open('s3_bucket_policy_proofs.json', 'r') as fp:
+        with open(os.path.join(os.path.dirname(__file__), 's3_bucket_policy_proofs.json'), 'r') as fp:
             self._proofs = json.load(fp)
             fp.close()
 
+    def test_clients_are_shared_between_threads(self):
+        automator = ApiAutomator(target_account=PRODUCER_ACCOUNT, session=self._session, log_level='INFO')
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            clients = list(executor.map(lambda n: automator._get_client('glue'), range(8)))
+
+        self.assertEqual(1, len(set(id(c) for c in clients)))
+        self.assertIs(clients[0], automator._get_client('glue'))
+
+        # automators using the same credentials share the clients in the client registry
+        other = ApiAutomator(target_account=MESH_ACCOUNT, session=self._session, log_level='INFO')
+        self.assertIs(clients[0], other._get_client('glue'))
+        self.assertIs(clients[0], utils.generate_client('glue', 'eu-west-1', self._session.get_credentials()))
+
+    def test_lf_grant_adds_describe_without_changing_permissions(self):
+        permissions = ['SELECT']
+        for table_name in ['t1', 't2']:
+            grant = self._automator._build_lf_grant(data_mesh_account_id=MESH_ACCOUNT, principal=CONSUMER_ACCOUNT,
+                                                    database_name='db', table_name=table_name,
+                                                    permissions=permissions)
+            self.assertListEqual(['SELECT', 'DESCRIBE'], grant.get('Permissions'))
+
+        self.assertListEqual(['SELECT'], permissions)
+
     def test_new_s3_bucket_policy(self):
         new_policy = self._automator._transform_bucket_policy(
             bucket_policy=None, principal_account=PRODUCER_ACCOUNT,
@@ -121,3 +148,452 @@ class ApiAutomatorTests(unittest.TestCase):
             access_path='s3://org-1-data'
         )
         self.assertEqual(self._proofs.get('New').get('Statement'), new_policy.get('Statement'))
+
+    def test_batch_create_partitions(self):
+        automator = ApiAutomator(target_account=MESH_ACCOUNT, session=self._session, log_level='INFO')
+        glue_client = automator._get_client('glue')
+        partitions = [{'Values': [str(i)], 'CatalogId': PRODUCER_ACCOUNT} for i in range(150)]
+
+        with Stubber(glue_client) as stubber:
+            stubber.add_response('batch_create_partition', {'Errors': [
+                {'PartitionValues': ['0'], 'ErrorDetail': {'ErrorCode': 'AlreadyExistsException'}},
+                {'PartitionValues': ['1'], 'ErrorDetail': {'ErrorCode': 'InternalServiceException'}}
+            ]}, {'DatabaseName': 'db', 'TableName': 't',
+                 'PartitionInputList': [{'Values': [str(i)]} for i in range(100)]})
+            stubber.add_response('batch_create_partition', {'Errors': []},
+                                 {'DatabaseName': 'db', 'TableName': 't',
+                                  'PartitionInputList': [{'Values': [str(i)]} for i in range(100, 150)]})
+
+            counts = automator.create_table_partition_metadata(database_name='db', table_name='t',
+                                                               partition_input_list=partitions, max_workers=1)
+
+        self.assertEqual({PARTITIONS_CREATED: 148, PARTITIONS_EXISTING: 1, PARTITIONS_FAILED: 1}, counts)
+
+    def test_iter_table_partitions_by_segment(self):
+        class SegmentedGlue:
+            def get_partitions(self, **kwargs):
+                segment = kwargs.get('Segment').get('SegmentNumber')
+                if 'NextToken' not in kwargs:
+                    return {'Partitions': [{'Values': [f"{segment}-0"]}], 'NextToken': 'page-2'}
+                else:
+                    return {'Partitions': [{'Values': [f"{segment}-1"]}]}
+
+        automator = ApiAutomator(target_account=PRODUCER_ACCOUNT, session=self._session, log_level='INFO')
+        automator._get_client = lambda client_name: SegmentedGlue()
+
+        pages = list(automator.iter_table_partitions(database_name='db', table_name='t', total_segments=3))
+
+        self.assertEqual(6, len(pages))
+        self.assertSetEqual({f"{s}-{p}" for s in range(3) for p in range(2)},
+                            {page[0].get('Values')[0] for page in pages})
+
+    def test_diff_partition_page(self):
+        def _partition(value: str, location: str) -> dict:
+            return {'Values': [value], 'StorageDescriptor': {'Location': location, 'Columns': [{'Name': 'c'}]}}
+
+        partition_index = {
+            ('1',): utils.get_partition_fingerprint(_partition('1', 's3://bucket/1')),
+            ('2',): utils.get_partition_fingerprint(_partition('2', 's3://bucket/2')),
+            ('3',): utils.get_partition_fingerprint(_partition('3', 's3://bucket/3'))
+        }
+        page = [_partition('1', 's3://bucket/1'), _partition('2', 's3://bucket/2-moved'),
+                _partition('4', 's3://bucket/4')]
+
+        to_create, to_update, unchanged = self._automator._diff_partition_page(partition_index, page)
+
+        self.assertEqual([['4']], [p.get('Values') for p in to_create])
+        self.assertEqual([['2']], [p.get('Values') for p in to_update])
+        self.assertEqual(1, unchanged)
+        # partitions left in the index are those removed from the source
+        self.assertListEqual([('3',)], list(partition_index.keys()))
+
+    def test_sync_table_partitions(self):
+        class RecordingGlue:
+            calls = []
+
+            def batch_update_partition(self, **kwargs):
+                self.calls.append(('update', len(kwargs.get('Entries'))))
+                return {'Errors': []}
+
+            def batch_delete_partition(self, **kwargs):
+                self.calls.append(('delete', len(kwargs.get('PartitionsToDelete'))))
+                return {'Errors': []}
+
+        def _partition(value: str, location: str) -> dict:
+            return {'Values': [value], 'StorageDescriptor': {'Location': location}}
+
+        glue = RecordingGlue()
+        automator = ApiAutomator(target_account=MESH_ACCOUNT, session=self._session, log_level='INFO')
+        automator._get_client = lambda client_name: glue
+        automator.get_partition_index = lambda **kwargs: {
+            (str(i),): utils.get_partition_fingerprint(_partition(str(i), 's3://bucket/old')) for i in range(160)
+        }
+
+        def _pages():
+            for start in range(0, 150, 50):
+                yield [_partition(str(i), 's3://bucket/new') for i in range(start, start + 50)]
+                glue.calls.append(('page', start))
+
+        counts = automator.sync_table_partitions(database_name='db', table_name='t', source_partition_pages=_pages())
+
+        # a full batch of updates is written as soon as it has been diffed, and nothing is deleted by default
+        self.assertListEqual([('page', 0), ('update', 100), ('page', 50), ('page', 100), ('update', 50)], glue.calls)
+        self.assertEqual(150, counts.get(PARTITIONS_UPDATED))
+        self.assertEqual(0, counts.get(PARTITIONS_DELETED))
+
+        glue.calls.clear()
+        counts = automator.sync_table_partitions(database_name='db', table_name='t', source_partition_pages=_pages(),
+                                                 delete_missing=True)
+        self.assertEqual(('delete', 10), glue.calls[-1])
+        self.assertEqual(10, counts.get(PARTITIONS_DELETED))
+
+    def test_lf_tag_cache(self):
+        automator = ApiAutomator(target_account=MESH_ACCOUNT, session=self._session, log_level='INFO')
+        lf_client = automator._get_client('lakeformation')
+
+        with Stubber(lf_client) as stubber:
+            stubber.add_response('list_lf_tags', {'LFTags': [{'TagKey': 'Domain', 'TagValues': ['a']}],
+                                                  'NextToken': 'next'}, {})
+            stubber.add_response('list_lf_tags', {'LFTags': [{'TagKey': 'DataProduct', 'TagValues': ['b']}]},
+                                 {'NextToken': 'next'})
+            stubber.add_response('get_lf_tag', {'TagKey': 'Domain', 'TagValues': ['a', 'c']}, {'TagKey': 'Domain'})
+
+            automator.load_lf_tag_definitions()
+
+            # served from the cache without any further calls
+            self.assertListEqual(['a'], automator.get_lf_tag_values('Domain'))
+            self.assertListEqual(['b'], automator.get_lf_tag_values('DataProduct'))
+
+            # invalidation forces a reload of the definition
+            automator.invalidate_lf_tag_cache('Domain')
+            self.assertListEqual(['a', 'c'], automator.get_lf_tag_values('Domain'))
+            stubber.assert_no_pending_responses()
+
+    def test_bulk_load_lf_tags(self):
+        automator = ApiAutomator(target_account=PRODUCER_ACCOUNT, session=self._session, log_level='INFO')
+        glue_client = automator._get_client('glue')
+        lf_client = automator._get_client('lakeformation')
+
+        def _table(name: str) -> dict:
+            return {'Name': name, 'DatabaseName': 'db'}
+
+        domain_values = [str(i) for i in range(60)]
+
+        def _search(tag_key: str, tag_values: list, tables: list, next_token: str = None):
+            response = {'TableList': [
+                {'Table': {'CatalogId': PRODUCER_ACCOUNT, 'DatabaseName': db, 'Name': name},
+                 'LFTagsOnTable': [{'TagKey': 'Domain', 'TagValues': ['1']}]} for db, name in tables
+            ]}
+            if next_token is not None:
+                response['NextToken'] = next_token
+            lf_stubber.add_response('search_tables_by_lf_tags', response, {
+                'CatalogId': PRODUCER_ACCOUNT, 'Expression': [{'TagKey': tag_key, 'TagValues': tag_values}]})
+
+        def _get_tags(name: str, tags: list):
+            lf_stubber.add_response('get_resource_lf_tags', {'LFTagsOnTable': tags} if len(tags) > 0 else {}, {
+                'CatalogId': PRODUCER_ACCOUNT, 'ShowAssignedLFTags': True,
+                'Resource': {'Table': {'CatalogId': PRODUCER_ACCOUNT, 'DatabaseName': 'db', 'Name': name}}})
+
+        definitions = {'LFTags': [{'TagKey': 'Domain', 'TagValues': domain_values},
+                                  {'TagKey': 'Owner', 'TagValues': ['x']}]}
+
+        with Stubber(glue_client) as glue_stubber, Stubber(lf_client) as lf_stubber:
+            glue_stubber.add_response('get_tables', {'TableList': [_table(n) for n in ['t1', 't2', 'untagged',
+                                                                                       'shared']]},
+                                      {'CatalogId': PRODUCER_ACCOUNT, 'DatabaseName': 'db'})
+            lf_stubber.add_response('list_lf_tags', definitions, {})
+            # tag values are searched in chunks, and tables in other databases are ignored
+            _search('Domain', domain_values[:50], [('db', 't1'), ('db', 't2'), ('other', 'untagged')])
+            _search('Domain', domain_values[50:], [])
+            _search('Owner', ['x'], [])
+            # tables which the search did not return may have tags shared from another account, so are loaded
+            # individually
+            _get_tags('untagged', [])
+            _get_tags('shared', [{'TagKey': 'Shared', 'TagValues': ['s']}])
+            lf_stubber.add_response('get_lf_tag', {'TagKey': 'Shared', 'TagValues': ['s', 't']}, {'TagKey': 'Shared'})
+
+            tables = automator.load_glue_tables(catalog_id=PRODUCER_ACCOUNT, source_db_name='db',
+                                                table_name_regex=None, bulk_load_lf_tags=True)
+            lf_stubber.assert_no_pending_responses()
+
+            self.assertDictEqual({'Domain': {'TagValues': ['1'], 'ValidValues': domain_values}},
+                                 tables[0].get('Tags'))
+            self.assertNotIn('Tags', tables[2])
+            self.assertDictEqual({'Shared': {'TagValues': ['s'], 'ValidValues': ['s', 't']}}, tables[3].get('Tags'))
+
+            # searching stops once every table in the database has been found
+            glue_stubber.add_response('get_tables', {'TableList': [_table(n) for n in ['t1', 't2', 't3', 't4']]},
+                                      {'CatalogId': PRODUCER_ACCOUNT, 'DatabaseName': 'db', 'Expression': 't*'})
+            lf_stubber.add_response('list_lf_tags', definitions, {})
+            _search('Domain', domain_values[:50], [('db', n) for n in ['t1', 't2', 't3', 't4']], next_token='page-2')
+
+            tables = automator.load_glue_tables(catalog_id=PRODUCER_ACCOUNT, source_db_name='db',
+                                                table_name_regex='t*', bulk_load_lf_tags=True)
+            lf_stubber.assert_no_pending_responses()
+            self.assertTrue(all('Tags' in t for t in tables))
+
+            # a database with fewer tables than the search would make calls is loaded table by table
+            glue_stubber.add_response('get_tables', {'TableList': [_table('t1')]},
+                                      {'CatalogId': PRODUCER_ACCOUNT, 'DatabaseName': 'db', 'Expression': 't1'})
+            lf_stubber.add_response('list_lf_tags', definitions, {})
+            _get_tags('t1', [{'TagKey': 'Domain', 'TagValues': ['1']}])
+
+            tables = automator.load_glue_tables(catalog_id=PRODUCER_ACCOUNT, source_db_name='db',
+                                                table_name_regex='t1', bulk_load_lf_tags=True)
+            lf_stubber.assert_no_pending_responses()
+
+        self.assertIn('Tags', tables[0])
+
+    def test_attach_tags_validates_once(self):
+        automator = ApiAutomator(target_account=MESH_ACCOUNT, session=self._session, log_level='INFO')
+        lf_client = automator._get_client('lakeformation')
+        tags = {'Domain': {'TagValues': ['a'], 'ValidValues': ['a']},
+                'DataProduct': {'TagValues': ['b'], 'ValidValues': ['b']}}
+
+        def _attach_args(table: str) -> dict:
+            return {'Resource': {'Table': {'DatabaseName': 'db', 'Name': table}},
+                    'LFTags': [{'TagKey': 'Domain', 'TagValues': ['a']},
+                               {'TagKey': 'DataProduct', 'TagValues': ['b']}]}
+
+        with Stubber(lf_client) as stubber:
+            for key, values in [('Domain', ['a']), ('DataProduct', ['b'])]:
+                stubber.add_response('create_lf_tag', {}, {'TagKey': key, 'TagValues': values})
+                stubber.add_response('get_lf_tag', {'TagKey': key, 'TagValues': values}, {'TagKey': key})
+            stubber.add_response('add_lf_tags_to_resource', {}, _attach_args('t1'))
+            # the second table reuses the validated tags, so only the attach is called
+            stubber.add_response('add_lf_tags_to_resource', {}, _attach_args('t2'))
+
+            automator.attach_tags(database='db', table='t1', tags=tags)
+            automator.attach_tags(database='db', table='t2', tags=tags)
+            stubber.assert_no_pending_responses()
+
+    def test_grant_accumulator(self):
+        automator = ApiAutomator(target_account=MESH_ACCOUNT, session=self._session, log_level='INFO')
+        lf_client = automator._get_client('lakeformation')
+        grants = automator.lf_grant_accumulator(data_mesh_account_id=MESH_ACCOUNT)
+
+        table_ids = [grants.add(principal=CONSUMER_ACCOUNT, database_name='db', table_name=f"t{i}",
+                                permissions=['SELECT']) for i in range(25)]
+        db_ids = {grants.add(principal=CONSUMER_ACCOUNT, database_name='db', permissions=['DESCRIBE']) for i in
+                  range(25)}
+
+        # the database grant is only sent once
+        self.assertEqual(1, len(db_ids))
+        self.assertEqual(26, len(grants))
+
+        with Stubber(lf_client) as stubber:
+            stubber.add_response('batch_grant_permissions', {'Failures': [
+                {'RequestEntry': {'Id': table_ids[0]},
+                 'Error': {'ErrorCode': 'InvalidInputException', 'ErrorMessage': 'Permissions modification is invalid'}},
+                {'RequestEntry': {'Id': table_ids[1]},
+                 'Error': {'ErrorCode': 'EntityNotFoundException', 'ErrorMessage': 'Table not found'}}
+            ]}, {'CatalogId': MESH_ACCOUNT, 'Entries': ANY})
+            stubber.add_response('batch_grant_permissions', {}, {'CatalogId': MESH_ACCOUNT, 'Entries': ANY})
+
+            result = grants.flush(raise_on_failure=False)
+            stubber.assert_no_pending_responses()
+
+        self.assertListEqual([table_ids[0]], result.get(GRANTS_SUPPRESSED))
+        self.assertListEqual([table_ids[1]], list(result.get(GRANTS_FAILED).keys()))
+        self.assertEqual(24, len(result.get(GRANTS_GRANTED)))
+        self.assertEqual(0, len(grants))
+
+    def test_resolve_glue_tables(self):
+        automator = ApiAutomator(target_account=PRODUCER_ACCOUNT, session=self._session, log_level='INFO')
+        glue_client = automator._get_client('glue')
+
+        with Stubber(glue_client) as stubber:
+            # the database is only listed once for both resolutions
+            stubber.add_response('get_tables', {'TableList': [{'Name': n} for n in
+                                                              ['customer', 'customer_address', 'orders']]},
+                                 {'CatalogId': PRODUCER_ACCOUNT, 'DatabaseName': 'db'})
+
+            resolved = automator.resolve_glue_tables(catalog_id=PRODUCER_ACCOUNT, source_db_name='db',
+                                                     table_name_patterns=['customer.*', 'customer'])
+            self.assertListEqual(['customer', 'customer_address'], [t.get('Name') for t in resolved])
+
+            resolved = automator.resolve_glue_tables(catalog_id=PRODUCER_ACCOUNT, source_db_name='db',
+                                                     table_name_patterns=['orders', '*'])
+            self.assertEqual(3, len(resolved))
+            stubber.assert_no_pending_responses()
+
+            # a pattern which matches nothing lists the database again once, in case the table is new
+            stubber.add_response('get_tables', {'TableList': [{'Name': n} for n in
+                                                              ['customer', 'customer_address', 'orders']]},
+                                 {'CatalogId': PRODUCER_ACCOUNT, 'DatabaseName': 'db'})
+            with self.assertRaises(Exception):
+                automator.resolve_glue_tables(catalog_id=PRODUCER_ACCOUNT, source_db_name='db',
+                                              table_name_patterns=['missing'])
+            stubber.assert_no_pending_responses()
+
+    def test_resolve_glue_tables_uses_glue_wildcards(self):
+        automator = ApiAutomator(target_account=PRODUCER_ACCOUNT, session=self._session, log_level='INFO')
+        glue_client = automator._get_client('glue')
+
+        with Stubber(glue_client) as stubber:
+            stubber.add_response('get_tables', {'TableList': [{'Name': n} for n in
+                                                              ['usecase', 'usecase_orders', 'usecase_customers',
+                                                               'other_usecase']]},
+                                 {'CatalogId': PRODUCER_ACCOUNT, 'DatabaseName': 'db'})
+
+            # the pattern documented in the README, where '*' is a wildcard as in the GetTables Expression
+            resolved = automator.resolve_glue_tables(catalog_id=PRODUCER_ACCOUNT, source_db_name='db',
+                                                     table_name_patterns=['usecase*'])
+            self.assertListEqual(['usecase', 'usecase_orders', 'usecase_customers'],
+                                 [t.get('Name') for t in resolved])
+
+            # new tables are found by listing the database again
+            stubber.add_response('get_tables', {'TableList': [{'Name': n} for n in ['usecase', 'usecase_new']]},
+                                 {'CatalogId': PRODUCER_ACCOUNT, 'DatabaseName': 'db'})
+            resolved = automator.resolve_glue_tables(catalog_id=PRODUCER_ACCOUNT, source_db_name='db',
+                                                     table_name_patterns=['usecase_new'])
+            self.assertListEqual(['usecase_new'], [t.get('Name') for t in resolved])
+            stubber.assert_no_pending_responses()
+
+    def test_bucket_policy_manager(self):
+        automator = ApiAutomator(target_account=PRODUCER_ACCOUNT, session=self._session, log_level='INFO')
+        s3_client = automator._get_client('s3')
+
+        policies = automator.bucket_policy_manager()
+        for i in range(300):
+            policies.add(principal_account=MESH_ACCOUNT, access_path='org-1-data')
+        policies.add(principal_account=CONSUMER_ACCOUNT, access_path='org-1-data')
+
+        existing_policy = automator._transform_bucket_policy(bucket_policy=None, principal_account=MESH_ACCOUNT,
+                                                             access_path='org-1-data')
+        with Stubber(s3_client) as stubber:
+            # one read and write for all grants on the bucket
+            stubber.add_client_error('get_bucket_policy', service_error_code='NoSuchBucketPolicy',
+                                     expected_params={'Bucket': 'org-1-data'})
+            stubber.add_response('put_bucket_policy', {}, {'Bucket': 'org-1-data', 'Policy': ANY})
+            # the policy already contains the grant, so it is not written
+            stubber.add_response('get_bucket_policy', {'Policy': json.dumps(existing_policy)},
+                                 {'Bucket': 'org-1-data'})
+
+            self.assertDictEqual({'org-1-data': True}, policies.apply())
+
+            policies.add(principal_account=MESH_ACCOUNT, access_path='org-1-data')
+            self.assertDictEqual({'org-1-data': False}, policies.apply())
+            stubber.assert_no_pending_responses()
+
+    def test_glue_resource_policy_manager(self):
+        automator = ApiAutomator(target_account=MESH_ACCOUNT, session=self._session, log_level='INFO')
+        glue_client = automator._get_client('glue')
+        region = 'eu-west-1'
+        table_arn = f"arn:aws:glue:{region}:{MESH_ACCOUNT}:table/db/t1"
+
+        def _statement(consumer: str, tables: list) -> dict:
+            return utils.generate_policy_dict('lf_cross_account_tbac.pystache', config={
+                'region': region, 'producer_account_id': MESH_ACCOUNT, 'consumer_account_id': consumer,
+                'database_name': 'db', 'table_list': tables})
+
+        # two statements for the same consumer and database are folded into one
+        current = {'Version': '2012-10-17',
+                   'Statement': [_statement(CONSUMER_ACCOUNT, []), _statement(CONSUMER_ACCOUNT, [table_arn])]}
+        current_response = {'PolicyInJson': json.dumps(current), 'PolicyHash': 'h1'}
+
+        policies = automator.glue_resource_policy_manager(region=region, producer_account_id=MESH_ACCOUNT)
+        policies.add(consumer_account_id=CONSUMER_ACCOUNT, database_name='db', tables=[table_arn])
+        policies.add(consumer_account_id=PRODUCER_ACCOUNT, database_name='db', tables=[table_arn])
+
+        merged = policies._merge(json.loads(json.dumps(current)))
+        self.assertEqual(2, len(merged.get('Statement')))
+        self.assertEqual(1, merged.get('Statement')[0].get('Resource').count(table_arn))
+
+        put_args = {'PolicyInJson': json.dumps(merged), 'PolicyHashCondition': 'h1',
+                    'PolicyExistsCondition': 'MUST_EXIST', 'EnableHybrid': 'TRUE'}
+        with Stubber(glue_client) as stubber:
+            # a concurrent writer changes the policy, so it is read and merged again
+            stubber.add_response('get_resource_policy', current_response, {})
+            stubber.add_client_error('put_resource_policy', service_error_code='ConditionCheckFailureException',
+                                     expected_params=put_args)
+            stubber.add_response('get_resource_policy', current_response, {})
+            stubber.add_response('put_resource_policy', {}, put_args)
+
+            self.assertTrue(policies.apply())
+            stubber.assert_no_pending_responses()
+
+    def test_glue_resource_policy_manager_ignores_other_statements(self):
+        automator = ApiAutomator(target_account=MESH_ACCOUNT, session=self._session, log_level='INFO')
+        region = 'eu-west-1'
+        t1 = f"arn:aws:glue:{region}:{MESH_ACCOUNT}:table/db/t1"
+        t2 = f"arn:aws:glue:{region}:{MESH_ACCOUNT}:table/db/t2"
+        allow = utils.generate_policy_dict('lf_cross_account_tbac.pystache', config={
+            'region': region, 'producer_account_id': MESH_ACCOUNT, 'consumer_account_id': CONSUMER_ACCOUNT,
+            'database_name': 'db', 'table_list': [t1]})
+
+        # a deny with the same principal and condition must not be folded into, or extended like, the allow
+        deny = json.loads(json.dumps(allow))
+        deny['Effect'] = 'Deny'
+        deny['Resource'] = [t2]
+        read_only = json.loads(json.dumps(allow))
+        read_only['Action'] = ['glue:GetTable']
+
+        policies = automator.glue_resource_policy_manager(region=region, producer_account_id=MESH_ACCOUNT)
+        policies.add(consumer_account_id=CONSUMER_ACCOUNT, database_name='db', tables=[t2])
+
+        merged = policies._merge({'Version': '2012-10-17', 'Statement': [json.loads(json.dumps(deny)),
+                                                                         json.loads(json.dumps(read_only))]})
+        self.assertEqual([deny, read_only], merged.get('Statement')[:2])
+        self.assertEqual(3, len(merged.get('Statement')))
+        self.assertEqual('Allow', merged.get('Statement')[2].get('Effect'))
+        self.assertIn(t2, merged.get('Statement')[2].get('Resource'))
+
+        # the deny is left alone when the allow it follows is extended
+        merged = policies._merge({'Version': '2012-10-17', 'Statement': [json.loads(json.dumps(deny)),
+                                                                         json.loads(json.dumps(allow))]})
+        self.assertEqual([deny], merged.get('Statement')[:1])
+        self.assertEqual(2, len(merged.get('Statement')))
+        self.assertIn(t2, merged.get('Statement')[1].get('Resource'))
+
+    def test_glue_resource_policy_index(self):
+        region = 'eu-west-1'
+        db_arn = f"arn:aws:glue:{region}:{MESH_ACCOUNT}:database/db"
+        t1 = f"arn:aws:glue:{region}:{MESH_ACCOUNT}:table/db/t1"
+        t2 = f"arn:aws:glue:{region}:{MESH_ACCOUNT}:table/db/t2"
+        policy = {'Version': '2012-10-17', 'Statement': [
+            {'Effect': 'Allow', 'Action': ['glue:*'], 'Principal': {'AWS': [PRODUCER_ACCOUNT]},
+             'Resource': [f"arn:aws:glue:{region}:{MESH_ACCOUNT}:database/db2"]},
+            {'Effect': 'Allow', 'Action': ['glue:*'], 'Principal': {'AWS': CONSUMER_ACCOUNT},
+             'Resource': [t1, t1, db_arn]}
+        ]}
+
+        model = GlueResourcePolicy(policy)
+        self.assertIsNone(model.find_statement(CONSUMER_ACCOUNT, region, MESH_ACCOUNT, 'db2'))
+        self.assertIsNone(model.find_statement(CONSUMER_ACCOUNT, 'us-east-1', MESH_ACCOUNT, 'db'))
+        position = model.find_statement(CONSUMER_ACCOUNT, region, MESH_ACCOUNT, 'db')
+        self.assertEqual(1, position)
+        self.assertEqual([t1, db_arn], model.get_statement(position).get('Resource'))
+
+        self.assertTrue(model.add_resources(position, [t1, t2]))
+        self.assertFalse(model.add_resources(position, [t2]))
+        self.assertEqual([t1, db_arn, t2], model.to_dict().get('Statement')[1].get('Resource'))
+
+        # a principal's statement for another database is extended with the missing tables
+        model = GlueResourcePolicy(policy)
+        position = model.find_statement(PRODUCER_ACCOUNT, region, MESH_ACCOUNT, 'db2')
+        self.assertEqual(0, position)
+        self.assertTrue(model.add_resources(position, [t1]))
+        self.assertIn(t1, model.get_statement(position).get('Resource'))
+        self.assertIsNone(model.find_statement(PRODUCER_ACCOUNT, region, MESH_ACCOUNT, 'db'))
+
+    def test_glue_resource_policy_index_scales_with_grants(self):
+        import resource_policy_benchmark as benchmark
+
+        # the indexed merge produces the same policy as the linear scan it replaced
+        policy = benchmark.build_policy(statements=50, resources=500)
+        grants = benchmark.build_grants(statements=50, resources=500)
+        self.assertEqual(benchmark.legacy_merge(json.loads(json.dumps(policy)), grants),
+                         benchmark.indexed_merge(json.loads(json.dumps(policy)), grants))
+
+        # each grant is resolved by looking at the single statement indexed for it, however large the policy is. A
+        # linear scan would look at every statement for every grant
+        for statements in [100, 1000]:
+            model = GlueResourcePolicy(benchmark.build_policy(statements=statements, resources=statements * 10))
+            examined = []
+            for consumer, database, tables in benchmark.build_grants(statements=statements,
+                                                                      resources=statements * 10):
+                model.find_statement(principal=consumer, region=benchmark.REGION,
+                                     account=benchmark.PRODUCER_ACCOUNT, database=database,
+                                     matches=lambda s: examined.append(s) or True)
+            self.assertEqual(statements, len(examined))
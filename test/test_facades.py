@@ -0,0 +1,192 @@
+import os
+import sys
+import threading
+import unittest
+from unittest import mock
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "../src"))
+
+from data_mesh_util.DataMeshProducer import DataMeshProducer
+from data_mesh_util.DataMeshConsumer import DataMeshConsumer
+import data_mesh_util.lib.utils as utils
+from data_mesh_util.lib.constants import DATA_PRODUCT_CREATED, DATA_PRODUCT_FAILED
+from data_mesh_util.lib.SubscriberTracker import SUBSCRIPTION_ID, SUBSCRIBER_PRINCIPAL, DATABASE_NAME, TABLE_NAME, \
+    REQUESTED_GRANTS, TABLE_ARNS
+
+MESH_ACCOUNT = '887210671223'
+REGION = 'eu-west-1'
+
+
+class FacadeTests(unittest.TestCase):
+    def test_construction_makes_no_api_calls(self):
+        with mock.patch.object(utils, 'assume_refreshable_iam_role') as assume_role, \
+                mock.patch.object(utils, 'generate_client') as generate_client:
+            producer = DataMeshProducer(data_mesh_account_id=MESH_ACCOUNT, region_name=REGION)
+            consumer = DataMeshConsumer(data_mesh_account_id=MESH_ACCOUNT, region_name=REGION)
+
+            assume_role.assert_not_called()
+            generate_client.assert_not_called()
+
+    def test_sessions_are_created_once_on_first_use(self):
+        with mock.patch.object(utils, 'assume_refreshable_iam_role',
+                               return_value=(mock.MagicMock(), {})) as assume_role, \
+                mock.patch.object(utils, 'whoami', return_value={'Account': '206160724517'}), \
+                mock.patch.object(utils, 'validate_correct_account') as validate_correct_account:
+            consumer = DataMeshConsumer(data_mesh_account_id=MESH_ACCOUNT, region_name=REGION)
+
+            # the consumer role is all that's needed to resolve the consumer account
+            self.assertEqual('206160724517', consumer._data_consumer_account_id)
+            self.assertEqual(1, assume_role.call_count)
+
+            # the mesh role is assumed and validated once, and the read only role only when it's used
+            consumer._lazy('mesh_role', consumer._assume_mesh_role)
+            consumer._lazy('mesh_role', consumer._assume_mesh_role)
+            self.assertEqual(2, assume_role.call_count)
+            validate_correct_account.assert_called_once()
+
+            consumer._ro_session
+            self.assertEqual(3, assume_role.call_count)
+
+    def test_resource_policy_is_written_before_access_is_granted(self):
+        with mock.patch.object(utils, 'assume_refreshable_iam_role'), mock.patch.object(utils, 'generate_client'):
+            producer = DataMeshProducer(data_mesh_account_id=MESH_ACCOUNT, region_name=REGION)
+
+        calls = mock.MagicMock()
+        tracker = calls.tracker
+        tracker.get_subscriptions.return_value = [{'SubscriptionId': '1'}, {'SubscriptionId': '2'}]
+        automator = mock.MagicMock()
+        automator.glue_resource_policy_manager.return_value = calls.resource_policies
+
+        with mock.patch.object(DataMeshProducer, '_mesh_automator', new_callable=mock.PropertyMock,
+                               return_value=automator), \
+                mock.patch.object(DataMeshProducer, '_subscription_tracker', new_callable=mock.PropertyMock,
+                                  return_value=tracker), \
+                mock.patch.object(producer, '_plan_access_request',
+                                  side_effect=lambda subscription: {'Principal': subscription.get('SubscriptionId')}), \
+                mock.patch.object(producer, '_execute_access_request_plan', calls.execute):
+            # a resource policy which can't be written leaves no grants behind
+            calls.resource_policies.apply.side_effect = Exception("Catalog Resource Policy would exceed 10240 bytes")
+            with self.assertRaises(Exception):
+                producer.approve_access_requests(request_ids=['1', '2'])
+            calls.execute.assert_not_called()
+
+            calls.resource_policies.apply.side_effect = None
+            producer.approve_access_requests(request_ids=['1', '2'])
+
+            # a plan which fails doesn't stop the others, and is reported along with those which were applied
+            calls.execute.side_effect = [Exception("AccessDenied"), None]
+            with self.assertRaises(Exception) as failure:
+                producer.approve_access_requests(request_ids=['1', '2'])
+            self.assertIn("Approved: ['2']", str(failure.exception))
+            self.assertIn("Failed: {'1': 'AccessDenied'}", str(failure.exception))
+
+        names = [c[0] for c in calls.mock_calls if c[0] in ['resource_policies.apply', 'execute']]
+        self.assertListEqual(['resource_policies.apply', 'resource_policies.apply', 'execute', 'execute',
+                              'resource_policies.apply', 'execute', 'execute'], names)
+
+    def _create_data_products(self, tables: list, create_table, max_workers: int = None) -> tuple:
+        with mock.patch.object(utils, 'assume_refreshable_iam_role'), mock.patch.object(utils, 'generate_client'):
+            producer = DataMeshProducer(data_mesh_account_id=MESH_ACCOUNT, region_name=REGION)
+
+        producer_automator = mock.MagicMock()
+        producer_automator.load_glue_tables.return_value = [{'Name': t} for t in tables]
+
+        with mock.patch.object(DataMeshProducer, '_producer_automator', new_callable=mock.PropertyMock,
+                               return_value=producer_automator), \
+                mock.patch.object(DataMeshProducer, '_mesh_automator', new_callable=mock.PropertyMock,
+                                  return_value=mock.MagicMock()), \
+                mock.patch.object(DataMeshProducer, '_data_producer_identity', new_callable=mock.PropertyMock,
+                                  return_value={'Account': '206160724517'}), \
+                mock.patch.object(producer, '_create_data_product_table', side_effect=create_table):
+            results = producer.create_data_products(source_database_name='db', max_workers=max_workers)
+
+        return results, producer_automator.bucket_policy_manager.return_value
+
+    def test_data_products_are_created_by_a_worker_pool(self):
+        threads = set()
+
+        def _create_table(table, **kwargs):
+            threads.add(threading.get_ident())
+            # hold each worker until all of them have started, so the tables must be processed concurrently
+            barrier.wait(timeout=5)
+            return {'TableName': table.get('Name'), 'Status': DATA_PRODUCT_CREATED}
+
+        barrier = threading.Barrier(4)
+        tables = ['t1', 't2', 't3', 't4']
+        results, bucket_policies = self._create_data_products(tables, _create_table, max_workers=4)
+
+        # results are returned in table order, and bucket policies are written once for all tables
+        self.assertListEqual(tables, [r.get('TableName') for r in results])
+        self.assertEqual(4, len(threads))
+        bucket_policies.apply.assert_called_once()
+
+    def test_data_product_failures_are_reported_per_table(self):
+        def _create_table(table, **kwargs):
+            if table.get('Name') == 't2':
+                raise Exception("AccessDenied")
+            return {'TableName': table.get('Name'), 'Status': DATA_PRODUCT_CREATED}
+
+        # the sequential and parallel paths return the same report
+        for max_workers in [None, 1, 3]:
+            results, bucket_policies = self._create_data_products(['t1', 't2', 't3'], _create_table,
+                                                                  max_workers=max_workers)
+            self.assertListEqual([
+                {'TableName': 't1', 'Status': DATA_PRODUCT_CREATED},
+                {'TableName': 't2', 'Status': DATA_PRODUCT_FAILED, 'Error': 'AccessDenied'},
+                {'TableName': 't3', 'Status': DATA_PRODUCT_CREATED}
+            ], results)
+            bucket_policies.apply.assert_called_once()
+
+    def test_data_products_are_created_sequentially_by_default(self):
+        threads = set()
+
+        def _create_table(table, **kwargs):
+            threads.add(threading.get_ident())
+            return {'TableName': table.get('Name'), 'Status': DATA_PRODUCT_CREATED}
+
+        results, bucket_policies = self._create_data_products(['t1', 't2'], _create_table)
+
+        self.assertEqual(2, len(results))
+        self.assertSetEqual({threading.get_ident()}, threads)
+        bucket_policies.apply.assert_called_once()
+
+    def test_access_request_plan_deduplicates_grants(self):
+        with mock.patch.object(utils, 'assume_refreshable_iam_role'), mock.patch.object(utils, 'generate_client'):
+            producer = DataMeshProducer(data_mesh_account_id=MESH_ACCOUNT, region_name=REGION)
+
+        # two table patterns which both match t1, with both tables in the same bucket
+        producer_automator = mock.MagicMock()
+        producer_automator.resolve_glue_tables.return_value = [
+            {'Name': name, 'StorageDescriptor': {'Location': f"s3://bucket/{name}"}} for name in ['t1', 't2', 't1']
+        ]
+        tracker = mock.MagicMock()
+        tracker.get_subscription.return_value = {
+            SUBSCRIPTION_ID: '1', SUBSCRIBER_PRINCIPAL: '206160724517', DATABASE_NAME: 'db-111111111111',
+            TABLE_NAME: ['t*', 't1'], REQUESTED_GRANTS: ['SELECT'], TABLE_ARNS: ['arn']
+        }
+
+        with mock.patch.object(DataMeshProducer, '_producer_automator', new_callable=mock.PropertyMock,
+                               return_value=producer_automator), \
+                mock.patch.object(DataMeshProducer, '_subscription_tracker', new_callable=mock.PropertyMock,
+                                  return_value=tracker), \
+                mock.patch.object(DataMeshProducer, '_data_producer_identity', new_callable=mock.PropertyMock,
+                                  return_value={'Account': '111111111111'}), \
+                mock.patch.object(producer, '_execute_access_request_plan') as execute:
+            plan = producer.approve_access_request(request_id='1', dry_run=True)
+
+            # a dry run changes nothing
+            execute.assert_not_called()
+            tracker.update_status.assert_not_called()
+
+        producer_automator.resolve_glue_tables.assert_called_once_with(
+            catalog_id='111111111111', source_db_name='db', table_name_patterns=['t*', 't1'], refresh=False)
+
+        # the database is described once, each table is granted once, and the bucket policy is written once
+        self.assertListEqual([{'Principal': '206160724517', 'Bucket': 'bucket'}], plan.get('BucketPolicyEntries'))
+        self.assertEqual(1, len(plan.get('DatabaseGrants')))
+        self.assertListEqual(['t1', 't2'], [g.get('TableName') for g in plan.get('TableGrants')])
+        self.assertListEqual(['SELECT'], plan.get('TableGrants')[0].get('Permissions'))
+        self.assertIsNot(plan.get('TableGrants')[0].get('Permissions'), plan.get('TableGrants')[1].get('Permissions'))
+        self.assertDictEqual({'GetBucketPolicy': 1, 'PutBucketPolicy': 1, 'BatchGrantPermissions': 1,
+                              'ListPermissions': 3, 'GetResourcePolicy': 1, 'PutResourcePolicy': 1},
+                             plan.get('ApiCalls'))
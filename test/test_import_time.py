@@ -0,0 +1,26 @@
+import os
+import subprocess
+import sys
+import unittest
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../src")
+
+MODULES = ['data_mesh_util', 'data_mesh_util.DataMeshProducer', 'data_mesh_util.DataMeshConsumer',
+           'data_mesh_util.DataMeshAdmin']
+# these dominate the time taken to import the package, so are only imported on first use
+DEFERRED_MODULES = ['boto3', 'botocore', 'pystache', 'shortuuid']
+
+
+def _run(code: str, *args) -> subprocess.CompletedProcess:
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([SRC, env.get('PYTHONPATH', '')])
+    return subprocess.run([sys.executable, *args, '-c', code], env=env, capture_output=True, text=True, check=True)
+
+
+class ImportTimeTests(unittest.TestCase):
+    def test_heavy_dependencies_are_deferred(self):
+        # run in a fresh interpreter, as other tests will already have imported them into this one
+        for module in MODULES:
+            loaded = _run(f"import sys; import {module}; "
+                          f"print(','.join(m for m in {DEFERRED_MODULES} if m in sys.modules))").stdout.strip()
+            self.assertEqual('', loaded, f"import {module} loaded {loaded}")
@@ -0,0 +1,211 @@
+import datetime
+import json
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from botocore.stub import ANY, Stubber
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "../src"))
+
+import data_mesh_util.lib.utils as utils
+from data_mesh_util.lib.CredentialCache import CredentialCache
+
+try:
+    from cryptography.fernet import Fernet
+except ImportError:
+    Fernet = None
+
+REGION = 'eu-west-1'
+
+
+def _credentials(key: str, expires_in: int = 3600) -> dict:
+    return {
+        'AccessKeyId': key,
+        'SecretAccessKey': 'testing',
+        'SessionToken': 'testing',
+        'Expiration': datetime.datetime.now(tz=datetime.timezone.utc) + datetime.timedelta(seconds=expires_in)
+    }
+
+
+class UtilsTests(unittest.TestCase):
+    def setUp(self) -> None:
+        utils.clear_client_registry()
+
+    def test_client_registry_shares_clients(self):
+        creds = _credentials('AKIA1')
+        client = utils.generate_client('glue', REGION, creds)
+
+        self.assertIs(client, utils.generate_client('glue', REGION, dict(creds)))
+        self.assertIsNot(client, utils.generate_client('glue', 'us-east-1', creds))
+        self.assertIsNot(client, utils.generate_client('glue', REGION, _credentials('AKIA2')))
+        self.assertEqual('adaptive', client.meta.config.retries.get('mode'))
+        self.assertEqual(utils.CLIENT_MAX_POOL_CONNECTIONS, client.meta.config.max_pool_connections)
+
+    def test_client_registry_evicts_expired_credentials(self):
+        expiring = _credentials('AKIA3', expires_in=60)
+        client = utils.generate_client('sts', REGION, expiring)
+
+        self.assertEqual(1, utils.evict_expired_clients())
+        self.assertIsNot(client, utils.generate_client('sts', REGION, expiring))
+
+        current = _credentials('AKIA4')
+        client = utils.generate_client('sts', REGION, current)
+        self.assertEqual(0, utils.evict_expired_clients())
+        self.assertIs(client, utils.generate_client('sts', REGION, current))
+
+    def test_client_registry_keeps_clients_for_refreshed_credentials(self):
+        from botocore.credentials import RefreshableCredentials
+
+        def _metadata(expires_in: int) -> dict:
+            expiry = datetime.datetime.now(tz=datetime.timezone.utc) + datetime.timedelta(seconds=expires_in)
+            return {'access_key': 'AKIA8', 'secret_key': 'testing', 'token': 'testing',
+                    'expiry_time': expiry.isoformat()}
+
+        refreshable = RefreshableCredentials.create_from_metadata(metadata=_metadata(3600),
+                                                                  refresh_using=lambda: _metadata(3600),
+                                                                  method='test')
+        client = utils.generate_client('sts', REGION, refreshable)
+
+        # a refresh changes the expiry, but the client refreshes the same credentials object so it is kept
+        refreshable._set_from_data(_metadata(7200))
+        self.assertEqual(0, utils.evict_expired_clients())
+        self.assertIs(client, utils.generate_client('sts', REGION, refreshable))
+
+        # credentials which nothing has refreshed since they expired are evicted
+        refreshable._set_from_data(_metadata(-60))
+        self.assertEqual(1, utils.evict_expired_clients())
+
+    def test_resources_are_per_thread(self):
+        creds = _credentials('AKIA5')
+        resource = utils.generate_resource('dynamodb', REGION, creds)
+        self.assertIs(resource, utils.generate_resource('dynamodb', REGION, creds))
+
+        other = []
+        t = threading.Thread(target=lambda: other.append(utils.generate_resource('dynamodb', REGION, creds)))
+        t.start()
+        t.join()
+        self.assertIsNot(resource, other[0])
+
+        # a new configuration replaces existing clients and resources
+        utils.configure_clients(max_pool_connections=5)
+        try:
+            self.assertEqual(5, utils.generate_resource('dynamodb', REGION, creds).meta.client.meta.config.max_pool_connections)
+        finally:
+            utils.configure_clients()
+
+    def test_assume_iam_role_uses_credential_cache(self):
+        utils.configure_credential_cache()
+        utils.invalidate_whoami()
+        source = _credentials('AKIA6')
+        sts_client = utils.generate_client('sts', REGION, source)
+        identity = {'UserId': 'AIDA:user', 'Account': '600214582022', 'Arn': 'arn:aws:iam::600214582022:user/user'}
+        role_arn = utils.get_role_arn('600214582022', utils.DATA_MESH_PRODUCER_ROLENAME)
+        assumed = {'Credentials': {**_credentials('ASIAASSUMED000001'), 'SecretAccessKey': 'assumed'}}
+
+        with Stubber(sts_client) as stubber:
+            stubber.add_response('get_caller_identity', identity, {})
+            stubber.add_response('assume_role', assumed, {'RoleArn': role_arn, 'RoleSessionName': ANY})
+
+            session, creds = utils.assume_iam_role(role_name=utils.DATA_MESH_PRODUCER_ROLENAME, region_name=REGION,
+                                                   use_credentials=source)
+            # the second construction is served from the caches, without calling STS
+            _, cached_creds = utils.assume_iam_role(role_name=utils.DATA_MESH_PRODUCER_ROLENAME, region_name=REGION,
+                                                    use_credentials=source)
+            stubber.assert_no_pending_responses()
+
+        self.assertEqual('ASIAASSUMED000001', session.get_credentials().access_key)
+        self.assertIs(utils.generate_client('glue', REGION, creds), utils.generate_client('glue', REGION, creds))
+
+        # credentials are returned in the shape of the STS Credentials, while the facades use refreshable credentials
+        self.assertIsInstance(cached_creds, dict)
+        self.assertDictEqual({'AccessKeyId': 'ASIAASSUMED000001', 'SecretAccessKey': 'assumed',
+                              'SessionToken': 'testing'},
+                             {k: cached_creds.get(k) for k in ['AccessKeyId', 'SecretAccessKey', 'SessionToken']})
+        self.assertIsInstance(cached_creds.get('Expiration'), datetime.datetime)
+        _, refreshable = utils.assume_refreshable_iam_role(role_name=utils.DATA_MESH_PRODUCER_ROLENAME,
+                                                           region_name=REGION, use_credentials=source)
+        self.assertEqual('ASIAASSUMED000001', refreshable.access_key)
+        self.assertTrue(utils._is_refreshable(refreshable))
+
+    def test_credential_cache_refreshes_expiring_credentials(self):
+        cache = CredentialCache()
+        sts_client = utils.generate_client('sts', REGION, _credentials('AKIA7'))
+        role_arn = 'arn:aws:iam::600214582022:role/Test'
+
+        with Stubber(sts_client) as stubber:
+            # credentials inside botocore's refresh window are replaced transparently on next use
+            stubber.add_response('assume_role', {'Credentials': _credentials('ASIAASSUMED000002', expires_in=600)},
+                                 {'RoleArn': role_arn, 'RoleSessionName': 'test'})
+            stubber.add_response('assume_role', {'Credentials': _credentials('ASIAASSUMED000003')},
+                                 {'RoleArn': role_arn, 'RoleSessionName': 'test'})
+
+            creds = cache.assume_role(sts_client, 'source', role_arn, 'test')
+            self.assertEqual('ASIAASSUMED000003', creds.access_key)
+            self.assertEqual('ASIAASSUMED000003', cache.get('source', role_arn).get('access_key'))
+            stubber.assert_no_pending_responses()
+
+    @unittest.skipIf(Fernet is None, "cryptography is not installed")
+    def test_credential_cache_persistence(self):
+        key = Fernet.generate_key()
+        with tempfile.TemporaryDirectory() as tmp:
+            cache_file = os.path.join(tmp, 'credentials')
+            CredentialCache(cache_file=cache_file, encryption_key=key).put('source', 'role', _credentials('ASIA4'))
+
+            self.assertNotIn(b'ASIA4', open(cache_file, 'rb').read())
+            self.assertEqual('ASIA4', CredentialCache(cache_file=cache_file, encryption_key=key).get(
+                'source', 'role').get('access_key'))
+            self.assertIsNone(
+                CredentialCache(cache_file=cache_file, encryption_key=Fernet.generate_key()).get('source', 'role'))
+
+    def test_whoami_is_cached_per_credentials(self):
+        utils.invalidate_whoami()
+        creds = _credentials('AKIA8')
+        identity = {'UserId': 'AIDA:user', 'Account': '887210671223', 'Arn': 'arn:aws:iam::887210671223:user/user'}
+
+        with Stubber(utils.generate_client('sts', REGION, creds)) as stubber:
+            stubber.add_response('get_caller_identity', identity, {})
+            stubber.add_response('get_caller_identity', identity, {})
+
+            self.assertEqual(identity, utils.whoami(credentials=creds, region=REGION))
+            utils.validate_correct_account(creds, '887210671223')
+            with self.assertRaises(Exception):
+                utils.validate_correct_account(creds, '887210671223', should_match=False)
+            self.assertEqual(1, len(stubber._queue))
+
+            # invalidated identities are looked up again
+            utils.invalidate_whoami(creds, region=REGION)
+            self.assertEqual(identity, utils.whoami(credentials=creds, region=REGION))
+            stubber.assert_no_pending_responses()
+
+    def test_whoami_cache_is_bounded(self):
+        utils.invalidate_whoami()
+        identity = {'UserId': 'AIDA:user', 'Account': '887210671223', 'Arn': 'arn:aws:iam::887210671223:user/user'}
+
+        with mock.patch.object(utils, 'IDENTITY_CACHE_SIZE', 2), \
+                mock.patch.object(utils, 'generate_client') as generate_client:
+            generate_client.return_value.get_caller_identity.return_value = identity
+            for key in ['AKIA9', 'AKIA10', 'AKIA9', 'AKIA11']:
+                utils.whoami(credentials=_credentials(key), region=REGION)
+
+            # the least recently used identity is evicted, and the others are still served from the cache
+            self.assertListEqual(['AKIA9', 'AKIA11'], list(utils._identity_cache.keys()))
+            self.assertEqual(3, generate_client.return_value.get_caller_identity.call_count)
+            utils.whoami(credentials=_credentials('AKIA10'), region=REGION)
+            self.assertEqual(4, generate_client.return_value.get_caller_identity.call_count)
+
+    def test_policy_templates_are_parsed_once(self):
+        self.assertEqual(9, utils.load_templates())
+        config = {'account_id': '206160724517', 'access_path': 'bucket/prefix', 'sid': 'sid'}
+
+        # rendering uses the registry, and doesn't read the template again
+        with mock.patch('builtins.open', side_effect=AssertionError('template was read')):
+            policy = utils.generate_policy_dict('producer_bucket_policy.pystache', config)
+            self.assertEqual(json.loads(utils.generate_policy('producer_bucket_policy.pystache', config)), policy)
+
+            # callers may modify the policies they are given
+            policy['Sid'] = 'modified'
+            self.assertEqual('sid', utils.generate_policy_dict('producer_bucket_policy.pystache', config).get('Sid'))
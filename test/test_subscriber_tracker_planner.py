@@ -0,0 +1,364 @@
+import datetime
+import os
+import sys
+import unittest
+from unittest import mock
+
+from botocore.stub import ANY, Stubber
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "../src"))
+
+import data_mesh_util.lib.utils as utils
+from data_mesh_util.lib.constants import SUBSCRIPTIONS_TRACKER_TABLE
+from data_mesh_util.lib.SubscriberTracker import SubscriberTracker, SECONDARY_INDEXES, SUBSCRIPTION_ID, \
+    OWNER_PRINCIPAL, SUBSCRIBER_PRINCIPAL, DATABASE_NAME, TABLE_NAME, REQUESTED_GRANTS, STATUS, STATUS_ACTIVE, \
+    STATUS_DELETED, STATUS_PENDING, CREATION_DATE, CREATED_BY
+
+MESH_ACCOUNT = '887210671223'
+PRODUCER_ACCOUNT = '600214582022'
+CONSUMER_ACCOUNT = '206160724517'
+REGION = 'eu-west-1'
+CREDENTIALS = {
+    'AccessKeyId': 'AKIAPLANNER000001',
+    'SecretAccessKey': 'testing',
+    'SessionToken': 'testing',
+    'Expiration': datetime.datetime.now(tz=datetime.timezone.utc) + datetime.timedelta(hours=1)
+}
+
+
+ANY_ITEM = {CREATION_DATE: ANY, CREATED_BY: ANY, OWNER_PRINCIPAL: ANY, SUBSCRIBER_PRINCIPAL: ANY, DATABASE_NAME: ANY,
+            TABLE_NAME: ANY, REQUESTED_GRANTS: ANY, STATUS: STATUS_PENDING}
+
+
+def _index(suffix: str, status: str = 'ACTIVE') -> dict:
+    return {'IndexName': "%s-%s" % (SUBSCRIPTIONS_TRACKER_TABLE, suffix), 'IndexStatus': status}
+
+
+def _item(subscription_id: str, status: str, tables: list) -> dict:
+    return {SUBSCRIPTION_ID: {'S': subscription_id}, OWNER_PRINCIPAL: {'S': PRODUCER_ACCOUNT},
+            SUBSCRIBER_PRINCIPAL: {'S': CONSUMER_ACCOUNT}, DATABASE_NAME: {'S': 'tpcds'},
+            TABLE_NAME: {'L': [{'S': t} for t in tables]}, STATUS: {'S': status}}
+
+
+class SubscriberTrackerPlannerTests(unittest.TestCase):
+    def setUp(self) -> None:
+        utils.clear_client_registry()
+        self._client = utils.generate_client('dynamodb', REGION, CREDENTIALS)
+        self._resource_client = utils.generate_resource('dynamodb', REGION, CREDENTIALS).meta.client
+
+    def _describe_table(self, stubber: Stubber, indexes: list) -> None:
+        stubber.add_response('describe_table', {'Table': {
+            'TableName': SUBSCRIPTIONS_TRACKER_TABLE, 'TableStatus': 'ACTIVE', 'GlobalSecondaryIndexes': indexes}},
+                             {'TableName': SUBSCRIPTIONS_TRACKER_TABLE})
+
+    def _tracker(self, indexes: list) -> SubscriberTracker:
+        # constructing a tracker only reads the table, and never changes its indexes
+        with Stubber(self._client) as stubber, mock.patch.object(utils, 'validate_correct_account'):
+            self._describe_table(stubber, indexes)
+
+            tracker = SubscriberTracker(credentials=CREDENTIALS, data_mesh_account_id=MESH_ACCOUNT,
+                                        region_name=REGION)
+            stubber.assert_no_pending_responses()
+
+        return tracker
+
+    def test_plan_uses_most_selective_index(self):
+        tracker = self._tracker([_index(i[0]) for i in SECONDARY_INDEXES])
+
+        def _plan(**criteria):
+            plan = tracker._plan_query(criteria)
+            return plan.get('IndexName'), plan.get('Key'), plan.get('Residual')
+
+        self.assertEqual((tracker.subscriber_status_indexname(),
+                          {SUBSCRIBER_PRINCIPAL: CONSUMER_ACCOUNT, STATUS: STATUS_ACTIVE},
+                          {OWNER_PRINCIPAL: PRODUCER_ACCOUNT}),
+                         _plan(OwnerPrincipal=PRODUCER_ACCOUNT, SubscriberPrincipal=CONSUMER_ACCOUNT,
+                               Status=STATUS_ACTIVE))
+        self.assertEqual((tracker.owner_indexname(), {OWNER_PRINCIPAL: PRODUCER_ACCOUNT, STATUS: STATUS_PENDING}, {}),
+                         _plan(OwnerPrincipal=PRODUCER_ACCOUNT, Status=STATUS_PENDING))
+        self.assertEqual((tracker.subscriber_indexname(), {SUBSCRIBER_PRINCIPAL: CONSUMER_ACCOUNT},
+                          {DATABASE_NAME: 'tpcds', TABLE_NAME: ['customer']}),
+                         _plan(SubscriberPrincipal=CONSUMER_ACCOUNT, DatabaseName='tpcds', TableName=['customer']))
+        self.assertEqual((tracker.database_indexname(), {DATABASE_NAME: 'tpcds'}, {OWNER_PRINCIPAL: PRODUCER_ACCOUNT}),
+                         _plan(OwnerPrincipal=PRODUCER_ACCOUNT, DatabaseName='tpcds'))
+        self.assertEqual((tracker.owner_created_indexname(), {OWNER_PRINCIPAL: PRODUCER_ACCOUNT}, {}),
+                         _plan(OwnerPrincipal=PRODUCER_ACCOUNT))
+        self.assertEqual((None, {}, {REQUESTED_GRANTS: ['SELECT']}), _plan(RequestedGrants=['SELECT']))
+
+    def test_missing_indexes_are_migrated_one_at_a_time(self):
+        # a table from an earlier version has only the owner and subscriber indexes, so the first missing one is created
+        legacy = [_index('Owner'), _index('Subscriber')]
+        tracker = self._tracker(legacy)
+        self.assertEqual({tracker.owner_indexname(), tracker.subscriber_indexname()}, tracker._active_indexes)
+
+        with Stubber(self._client) as stubber:
+            self._describe_table(stubber, legacy)
+            stubber.add_response('update_table', {}, {
+                'TableName': SUBSCRIPTIONS_TRACKER_TABLE, 'AttributeDefinitions': ANY,
+                'GlobalSecondaryIndexUpdates': [{'Create': {
+                    'IndexName': tracker.subscriber_status_indexname(), 'KeySchema': ANY,
+                    'Projection': {'ProjectionType': 'ALL'}}}]})
+            self.assertListEqual([tracker.subscriber_status_indexname()], tracker.migrate_indexes())
+
+            # no further indexes are created while one is backfilling, and it isn't queried until it's ACTIVE
+            self._describe_table(stubber, legacy + [_index('SubscriberStatus', 'CREATING')])
+            self.assertListEqual([], tracker.migrate_indexes())
+            self.assertEqual(tracker.subscriber_indexname(),
+                             tracker._plan_query({SUBSCRIBER_PRINCIPAL: CONSUMER_ACCOUNT, STATUS: STATUS_ACTIVE}).get(
+                                 'IndexName'))
+
+            # an index which can't be created is reported as a warning, and queries use the indexes which exist
+            self._describe_table(stubber, legacy)
+            stubber.add_client_error('update_table', service_error_code='AccessDeniedException')
+            with self.assertLogs('SubscriberTracker', level='WARNING'):
+                self.assertListEqual([], tracker.migrate_indexes())
+            stubber.assert_no_pending_responses()
+
+    def test_list_subscriptions_filters_query_results(self):
+        tracker = self._tracker([_index(i[0]) for i in SECONDARY_INDEXES])
+
+        with Stubber(self._resource_client) as stubber:
+            stubber.add_response('query', {'Items': [_item('1', STATUS_ACTIVE, ['customer']),
+                                                     _item('2', STATUS_DELETED, ['customer']),
+                                                     _item('3', STATUS_PENDING, ['store'])]},
+                                 {'TableName': SUBSCRIPTIONS_TRACKER_TABLE, 'IndexName': tracker.database_indexname(),
+                                  'KeyConditionExpression': ANY, 'Select': 'ALL_PROJECTED_ATTRIBUTES'})
+            stubber.add_response('query', {'Items': [_item('2', STATUS_DELETED, ['customer'])]},
+                                 {'TableName': SUBSCRIPTIONS_TRACKER_TABLE,
+                                  'IndexName': tracker.subscriber_status_indexname(), 'KeyConditionExpression': ANY,
+                                  'Select': 'ALL_PROJECTED_ATTRIBUTES'})
+
+            # deleted subscriptions and those for other tables are filtered from the query results
+            subscriptions = tracker.list_subscriptions(database_name='tpcds', tables=['customer']).get('Subscriptions')
+            self.assertEqual(['1'], [s.get(SUBSCRIPTION_ID) for s in subscriptions])
+
+            # unless they are asked for
+            subscriptions = tracker.list_subscriptions(principal_id=CONSUMER_ACCOUNT,
+                                                       request_status=STATUS_DELETED).get('Subscriptions')
+            self.assertEqual(['2'], [s.get(SUBSCRIPTION_ID) for s in subscriptions])
+            stubber.assert_no_pending_responses()
+
+    def test_iter_subscriptions_reads_every_page(self):
+        tracker = self._tracker([_index(i[0]) for i in SECONDARY_INDEXES])
+
+        with Stubber(self._resource_client) as stubber:
+            expected = {'TableName': SUBSCRIPTIONS_TRACKER_TABLE, 'IndexName': tracker.owner_indexname(),
+                        'KeyConditionExpression': ANY, 'Select': 'ALL_PROJECTED_ATTRIBUTES'}
+            stubber.add_response('query', {'Items': [_item('1', STATUS_PENDING, ['customer'])],
+                                           'LastEvaluatedKey': {SUBSCRIPTION_ID: {'S': '1'}}}, expected)
+            stubber.add_response('query', {'Items': [_item('2', STATUS_PENDING, ['store'])]},
+                                 {**expected, 'ExclusiveStartKey': {SUBSCRIPTION_ID: '1'}})
+
+            subscriptions = tracker.iter_subscriptions(owner_id=PRODUCER_ACCOUNT, request_status=STATUS_PENDING)
+            self.assertEqual(['1', '2'], [s.get(SUBSCRIPTION_ID) for s in subscriptions])
+            stubber.assert_no_pending_responses()
+
+    def test_iter_subscriptions_scans_segments_in_parallel(self):
+        tracker = self._tracker([_index(i[0]) for i in SECONDARY_INDEXES])
+
+        # each of 4 segments returns 2 pages of 2 items
+        def _scan(**kwargs):
+            segment = kwargs.get('Segment')
+            page = 0 if kwargs.get('ExclusiveStartKey') is None else 1
+            response = {'Items': [{SUBSCRIPTION_ID: f"{segment}-{page}-{i}"} for i in range(2)]}
+            if page == 0:
+                response['LastEvaluatedKey'] = {SUBSCRIPTION_ID: f"{segment}-0-1"}
+            return response
+
+        resource = mock.MagicMock()
+        resource.Table.return_value.scan.side_effect = _scan
+        with mock.patch.object(utils, 'generate_resource', return_value=resource):
+            subscriptions = list(tracker.iter_subscriptions(includes_grants=['SELECT'], projection=[DATABASE_NAME],
+                                                            total_segments=4))
+            self.assertEqual(16, len(subscriptions))
+            self.assertEqual(16, len(set(s.get(SUBSCRIPTION_ID) for s in subscriptions)))
+
+            scans = resource.Table.return_value.scan.call_args_list
+            self.assertEqual({0, 1, 2, 3}, set(c.kwargs.get('Segment') for c in scans))
+            self.assertEqual({4}, set(c.kwargs.get('TotalSegments') for c in scans))
+            self.assertEqual([SUBSCRIPTION_ID, STATUS, DATABASE_NAME, REQUESTED_GRANTS],
+                             list(scans[0].kwargs.get('ExpressionAttributeNames').values()))
+
+            # segments stop reading when the caller stops iterating
+            resource.Table.return_value.scan.reset_mock()
+            subscriptions = tracker.iter_subscriptions(includes_grants=['SELECT'], total_segments=4)
+            next(subscriptions)
+            subscriptions.close()
+            self.assertLessEqual(resource.Table.return_value.scan.call_count, 8)
+
+    def test_duplicate_requests_are_rejected_by_a_conditional_write(self):
+        tracker = self._tracker([_index(i[0]) for i in SECONDARY_INDEXES])
+
+        with Stubber(self._resource_client) as stubber, \
+                mock.patch.object(utils, 'whoami', return_value={'Arn': 'arn:aws:iam::206160724517:role/Consumer'}):
+            expected = {'TableName': SUBSCRIPTIONS_TRACKER_TABLE, 'Item': ANY, 'ConditionExpression': ANY}
+            stubber.add_response('put_item', {}, expected)
+            stubber.add_client_error('put_item', service_error_code='ConditionalCheckFailedException',
+                                     expected_params=expected)
+            stubber.add_response('put_item', {}, expected)
+
+            def _request(tables: list, grants: list) -> str:
+                return tracker.create_subscription_request(
+                    owner_account_id=PRODUCER_ACCOUNT, principal=CONSUMER_ACCOUNT, request_grants=grants,
+                    database_name='tpcds', tables=tables, suppress_object_validation=True).get(SUBSCRIPTION_ID)
+
+            # the same request in any order has the same id, and a duplicate is rejected without reading the table
+            first = _request(['customer', 'store'], ['SELECT', 'DESCRIBE'])
+            self.assertEqual(first, _request(['store', 'customer'], ['DESCRIBE', 'SELECT']))
+            self.assertNotEqual(first, _request(['customer'], ['SELECT', 'DESCRIBE']))
+            stubber.assert_no_pending_responses()
+
+    def test_legacy_subscriptions_are_migrated_to_request_ids(self):
+        tracker = self._tracker([_index(i[0]) for i in SECONDARY_INDEXES])
+
+        def _legacy(subscription_id: str, tables: list) -> dict:
+            item = _item(subscription_id, STATUS_ACTIVE, tables)
+            item[REQUESTED_GRANTS] = {'L': [{'S': 'SELECT'}]}
+            return item
+
+        def _request_id(tables: list) -> str:
+            return tracker._build_subscription(owner_account_id=PRODUCER_ACCOUNT, principal=CONSUMER_ACCOUNT,
+                                               request_grants=['SELECT'], database_name='tpcds',
+                                               tables=tables)[0].get(SUBSCRIPTION_ID)
+
+        current = _legacy(_request_id(['customer']), ['customer'])
+
+        with Stubber(self._resource_client) as stubber:
+            stubber.add_response('scan', {'Items': [_legacy('legacy-1', ['store', 'customer']), current,
+                                                    _legacy('legacy-2', ['store'])]})
+            stubber.add_response('transact_write_items', {}, {'TransactItems': [
+                {'Put': {'TableName': SUBSCRIPTIONS_TRACKER_TABLE, 'ConditionExpression': ANY,
+                         'ExpressionAttributeNames': ANY, 'ExpressionAttributeValues': ANY, 'Item': {
+                    SUBSCRIPTION_ID: _request_id(['customer', 'store']), OWNER_PRINCIPAL: PRODUCER_ACCOUNT,
+                    SUBSCRIBER_PRINCIPAL: CONSUMER_ACCOUNT, DATABASE_NAME: 'tpcds', TABLE_NAME: ['store', 'customer'],
+                    STATUS: STATUS_ACTIVE, REQUESTED_GRANTS: ['SELECT']}}},
+                {'Delete': {'TableName': SUBSCRIPTIONS_TRACKER_TABLE, 'Key': {SUBSCRIPTION_ID: 'legacy-1'},
+                            'ConditionExpression': '#status = :status', 'ExpressionAttributeNames': ANY,
+                            'ExpressionAttributeValues': {':status': STATUS_ACTIVE}}}]})
+            # the original changed after it was read, so its delete fails, the transaction writes nothing, and it is
+            # left in place
+            stubber.add_client_error('transact_write_items', service_error_code='TransactionCanceledException')
+
+            result = tracker.migrate_legacy_subscriptions()
+            stubber.assert_no_pending_responses()
+
+        self.assertEqual({'legacy-1': _request_id(['customer', 'store'])}, result.get('Migrated'))
+        self.assertEqual(['legacy-2'], result.get('NotMigrated'))
+
+    def test_bulk_requests_validate_once_per_database_and_write_conditionally(self):
+        tracker = self._tracker([_index(i[0]) for i in SECONDARY_INDEXES])
+        glue_client = utils.generate_client('glue', REGION, CREDENTIALS)
+
+        def _request(tables: list, grants: list, database_name: str = 'tpcds') -> dict:
+            return {'owner_account_id': PRODUCER_ACCOUNT, 'database_name': database_name, 'tables': tables,
+                    'request_grants': grants}
+
+        requests = [_request(['customer', 'store'], ['SELECT']), _request(['store', 'customer'], ['SELECT']),
+                    _request(['missing'], ['SELECT']), _request(['x'], ['SELECT'], database_name='other'),
+                    _request(['customer'], ['DESCRIBE'])]
+        new_id = tracker._build_subscription(principal=CONSUMER_ACCOUNT, **requests[0])[0].get(SUBSCRIPTION_ID)
+        existing_id = tracker._build_subscription(principal=CONSUMER_ACCOUNT, **requests[4])[0].get(SUBSCRIPTION_ID)
+
+        def _transaction(ids: list) -> dict:
+            return {'TransactItems': [{'Put': {
+                'TableName': SUBSCRIPTIONS_TRACKER_TABLE, 'Item': {**ANY_ITEM, SUBSCRIPTION_ID: i},
+                'ConditionExpression': "attribute_not_exists(#id) OR #status = :deleted",
+                'ExpressionAttributeNames': {'#id': SUBSCRIPTION_ID, '#status': STATUS},
+                'ExpressionAttributeValues': {':deleted': STATUS_DELETED}}} for i in ids]}
+
+        with Stubber(glue_client) as glue_stubber, Stubber(self._resource_client) as stubber, \
+                mock.patch.object(utils, 'whoami', return_value={'Arn': 'arn:aws:iam::206160724517:role/Consumer'}), \
+                mock.patch('time.sleep'):
+            glue_stubber.add_response('get_tables', {'TableList': [{'Name': 'customer'}, {'Name': 'store'}]},
+                                      {'DatabaseName': 'tpcds'})
+            glue_stubber.add_client_error('get_tables', service_error_code='EntityNotFoundException',
+                                          expected_params={'DatabaseName': 'other'})
+
+            # the existing subscription fails its condition, and the transaction is retried without it
+            stubber.add_client_error('transact_write_items', service_error_code='TransactionCanceledException',
+                                     modeled_fields={'CancellationReasons': [{'Code': 'None'},
+                                                                             {'Code': 'ConditionalCheckFailed'}]},
+                                     expected_params=_transaction([new_id, existing_id]))
+            stubber.add_response('transact_write_items', {}, _transaction([new_id]))
+
+            results = tracker.create_subscription_requests(principal=CONSUMER_ACCOUNT, requests=requests)
+            glue_stubber.assert_no_pending_responses()
+            stubber.assert_no_pending_responses()
+
+        self.assertEqual([new_id, new_id, None, None, existing_id], [r.get(SUBSCRIPTION_ID) for r in results])
+        self.assertEqual([True, True, None, None, False], [r.get('Created') for r in results])
+        self.assertEqual("Table missing does not exist in Database tpcds", results[2].get('Error'))
+        self.assertEqual("Database other does not exist", results[3].get('Error'))
+
+    def test_bulk_requests_report_writes_which_fail(self):
+        tracker = self._tracker([_index(i[0]) for i in SECONDARY_INDEXES])
+        requests = [{'owner_account_id': PRODUCER_ACCOUNT, 'database_name': 'tpcds', 'tables': [str(t)],
+                     'request_grants': ['SELECT']} for t in range(30)]
+
+        with Stubber(self._resource_client) as stubber, \
+                mock.patch.object(utils, 'whoami', return_value={'Arn': 'arn:aws:iam::206160724517:role/Consumer'}):
+            stubber.add_response('transact_write_items', {})
+            stubber.add_client_error('transact_write_items', service_error_code='AccessDeniedException')
+
+            results = tracker.create_subscription_requests(principal=CONSUMER_ACCOUNT, requests=requests,
+                                                           suppress_object_validation=True)
+            stubber.assert_no_pending_responses()
+
+        # the first transaction was written, and each request in the second has its own error
+        self.assertEqual([True] * 25, [r.get('Created') for r in results[:25]])
+        self.assertEqual(5, len([r for r in results[25:] if 'AccessDeniedException' in r.get('Error')]))
+        self.assertEqual(requests[29], results[29].get('Request'))
+
+    def test_get_subscriptions_reads_in_batches(self):
+        tracker = self._tracker([_index(i[0]) for i in SECONDARY_INDEXES])
+        ids = [str(i) for i in range(150)]
+
+        def _expected(keys: list) -> dict:
+            return {'RequestItems': {SUBSCRIPTIONS_TRACKER_TABLE: {
+                'Keys': [{SUBSCRIPTION_ID: k} for k in keys], 'ConsistentRead': False,
+                'ProjectionExpression': '#p0, #p1, #p2',
+                'ExpressionAttributeNames': {'#p0': SUBSCRIPTION_ID, '#p1': STATUS, '#p2': DATABASE_NAME}}}}
+
+        with Stubber(self._resource_client) as stubber:
+            stubber.add_response('batch_get_item', {'Responses': {SUBSCRIPTIONS_TRACKER_TABLE: [
+                _item('149', STATUS_ACTIVE, ['customer']), _item('3', STATUS_DELETED, ['customer'])]}},
+                                 _expected(ids[:100]))
+            stubber.add_response('batch_get_item', {'Responses': {SUBSCRIPTIONS_TRACKER_TABLE: [
+                _item('0', STATUS_PENDING, ['customer'])]}}, _expected(ids[100:]))
+
+            subscriptions = tracker.get_subscriptions(subscription_ids=ids, projection=[DATABASE_NAME],
+                                                      consistent_read=False)
+            stubber.assert_no_pending_responses()
+
+        # results are in the order requested, with None for missing and deleted subscriptions
+        self.assertEqual(150, len(subscriptions))
+        self.assertEqual({DATABASE_NAME: 'tpcds'}, subscriptions[0])
+        self.assertEqual({DATABASE_NAME: 'tpcds'}, subscriptions[149])
+        self.assertEqual(148, subscriptions.count(None))
+
+    def test_cached_subscriptions_are_invalidated_by_writes(self):
+        tracker = self._tracker([_index(i[0]) for i in SECONDARY_INDEXES])
+        tracker.enable_cache(follow_stream=False)
+
+        with Stubber(self._resource_client) as stubber, \
+                mock.patch.object(utils, 'whoami', return_value={'Arn': 'arn:aws:iam::600214582022:role/Producer'}):
+            get_item = {'TableName': SUBSCRIPTIONS_TRACKER_TABLE, 'Key': {SUBSCRIPTION_ID: '1'},
+                        'ConsistentRead': True}
+            stubber.add_response('get_item', {'Item': _item('1', STATUS_PENDING, ['customer'])}, get_item)
+            stubber.add_response('update_item', {'ConsumedCapacity': {'CapacityUnits': 1}},
+                                 {'TableName': SUBSCRIPTIONS_TRACKER_TABLE, 'Key': {SUBSCRIPTION_ID: '1'},
+                                  'UpdateExpression': ANY, 'ExpressionAttributeNames': ANY,
+                                  'ExpressionAttributeValues': ANY, 'ConditionExpression': ANY,
+                                  'ReturnConsumedCapacity': 'TOTAL'})
+            stubber.add_response('get_item', {'Item': _item('1', STATUS_ACTIVE, ['customer'])}, get_item)
+
+            # approval reads the subscription, and update_status reads it again for the requested grants
+            self.assertEqual(STATUS_PENDING, tracker.get_subscription(subscription_id='1').get(STATUS))
+            tracker.update_status(subscription_id='1', status=STATUS_ACTIVE, table_arns=[], notes='OK')
+
+            self.assertEqual(STATUS_ACTIVE, tracker.get_subscription(subscription_id='1').get(STATUS))
+            stubber.assert_no_pending_responses()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+import os
+import sys
+import threading
+import time
+import unittest
+from unittest import mock
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "../src"))
+
+from data_mesh_util.lib.SubscriptionCache import SubscriptionCache
+
+STREAM_ARN = 'arn:aws:dynamodb:eu-west-1:887210671223:table/AwsDataMeshSubscriptions/stream/2022-01-01T00:00:00.000'
+
+
+class FakeStreamsClient:
+    '''
+    Stand-in for a DynamoDB Streams client, whose shards can be written to and closed by the test
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.shards = {}
+        self.closed = set()
+        self.reads = threading.Event()
+
+    def add_shard(self, shard_id: str, records: list = None):
+        with self._lock:
+            self.shards[shard_id] = list(records or [])
+
+    def write(self, shard_id: str, subscription_id: str):
+        with self._lock:
+            self.shards[shard_id].append({'eventName': 'MODIFY', 'dynamodb': {
+                'Keys': {'SubscriptionId': {'S': subscription_id}}}})
+
+    def close_shard(self, shard_id: str):
+        with self._lock:
+            self.closed.add(shard_id)
+
+    def describe_stream(self, StreamArn: str, ExclusiveStartShardId: str = None):
+        with self._lock:
+            return {'StreamDescription': {'StreamArn': StreamArn, 'Shards': [{
+                'ShardId': s,
+                'SequenceNumberRange': {'StartingSequenceNumber': '0', 'EndingSequenceNumber': str(len(r))} if
+                s in self.closed else {'StartingSequenceNumber': '0'}
+            } for s, r in self.shards.items()]}}
+
+    def get_shard_iterator(self, StreamArn: str, ShardId: str, ShardIteratorType: str):
+        with self._lock:
+            position = 0 if ShardIteratorType == 'TRIM_HORIZON' else len(self.shards[ShardId])
+            return {'ShardIterator': f"{ShardId}:{position}"}
+
+    def get_records(self, ShardIterator: str):
+        shard_id, position = ShardIterator.split(':')
+        with self._lock:
+            records = self.shards[shard_id][int(position):]
+            end = len(self.shards[shard_id])
+            response = {'Records': records}
+            if shard_id not in self.closed:
+                response['NextShardIterator'] = f"{shard_id}:{end}"
+
+        self.reads.set()
+        return response
+
+
+class SubscriptionCacheTests(unittest.TestCase):
+    def _wait_for_reads(self, client: FakeStreamsClient, passes: int = 2):
+        # wait for the worker to complete whole passes over the stream
+        for i in range(passes):
+            client.reads.clear()
+            self.assertTrue(client.reads.wait(5))
+
+    def test_cache_is_lru_with_staleness_bound(self):
+        cache = SubscriptionCache(max_size=2, max_age_seconds=60)
+        cache.put('1', {'Status': 'Pending'})
+        cache.put('2', {'Status': 'Pending'})
+        cache.get('1')
+        cache.put('3', {'Status': 'Pending'})
+
+        # the least recently used subscription is evicted
+        self.assertIsNone(cache.get('2'))
+        self.assertEqual({'Status': 'Pending'}, cache.get('1'))
+
+        # cached subscriptions can't be modified by callers
+        cache.get('1')['Status'] = 'Active'
+        self.assertEqual({'Status': 'Pending'}, cache.get('1'))
+
+        # subscriptions older than the staleness bound are read again
+        with mock.patch('time.monotonic', return_value=time.monotonic() + 61):
+            self.assertIsNone(cache.get('1'))
+
+    def test_reads_racing_an_invalidation_are_not_cached(self):
+        cache = SubscriptionCache()
+        generation = cache.generation()
+        cache.invalidate('1')
+        cache.put('1', {'Status': 'Pending'}, generation)
+        self.assertIsNone(cache.get('1'))
+
+    def test_stream_worker_invalidates_changed_subscriptions(self):
+        client = FakeStreamsClient()
+        client.add_shard('shard-1')
+        client.write('shard-1', 'before')
+
+        cache = SubscriptionCache()
+        cache.follow_stream(client, STREAM_ARN, poll_seconds=0.01)
+        try:
+            self._wait_for_reads(client)
+            for i in ['before', '1', '2', '3']:
+                cache.put(i, {'SubscriptionId': i})
+
+            # changes from before the worker started aren't replayed
+            self._wait_for_reads(client)
+            self.assertEqual(4, len(cache))
+
+            client.write('shard-1', '1')
+            self._wait_for_reads(client)
+            self.assertIsNone(cache.get('1'))
+
+            # a closed shard is replaced by a new one, which is read from its beginning
+            client.close_shard('shard-1')
+            client.add_shard('shard-2')
+            client.write('shard-2', '2')
+            self._wait_for_reads(client, passes=3)
+            self.assertIsNone(cache.get('2'))
+            self.assertIsNotNone(cache.get('3'))
+        finally:
+            cache.stop(timeout=5)
+
+    def test_stream_worker_failure_clears_cache(self):
+        client = FakeStreamsClient()
+        client.add_shard('shard-1')
+
+        cache = SubscriptionCache()
+        cache.follow_stream(client, STREAM_ARN, poll_seconds=0.01)
+        try:
+            self._wait_for_reads(client)
+            cache.put('1', {'SubscriptionId': '1'})
+
+            with mock.patch.object(client, 'get_records', side_effect=Exception("ExpiredIteratorException")):
+                time.sleep(0.1)
+
+            self.assertIsNone(cache.get('1'))
+        finally:
+            cache.stop(timeout=5)
+
+
+if __name__ == '__main__':
+    unittest.main()